@@ -0,0 +1,207 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fire
+from yaml import safe_dump
+
+from get_metadata import ConnectionPool, parse_connection_string
+from get_metadata_sql import SQL_TO_GET_TABLES, SQL_TO_GET_TABLES_CATALOG
+
+
+# one cold CLI run of `startup`: argv is command, config and state dir, prints the number of loaded modules
+STARTUP_DRIVER = """
+import sys
+import fire
+from dms import DataMigrationService
+command, config, state_dir = sys.argv[1:]
+service = DataMigrationService(config=config, state_dir=state_dir)
+if command in ("cleanup", "cutover", "sync"):
+    from googleapiclient import discovery
+    from fake_gcp import FakeGcp
+    from gcp import GcpApi
+    service._gcp = GcpApi(logger=service._logger, build=FakeGcp(latency=0).build)
+getattr(service, command)("bench")
+sys.__stdout__.write(f"{len(sys.modules)}\\n")
+"""
+
+
+def _timed(func, repeat):
+    """
+    :return: best wall-clock time of `repeat` calls of func and its last result
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _measure(func, fake):
+    """
+    :return: wall-clock seconds, number of emulated API calls and peak traced memory in MB of one call of func
+    """
+    calls = fake.total_calls
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        func()
+    finally:
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, fake.total_calls - calls, peak / 1024 ** 2
+
+
+def _print_table(header, rows):
+    widths = [max(len(str(_)) for _ in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+
+class Benchmark:
+    """
+    Benchmarks of the migration tooling, run against local databases.
+    """
+
+    def catalog_query(self, connection="localhost:5432:postgres:postgres", tables=50000, schemas=10,
+                      database="dms_bench_catalog", repeat=3, keep=False):
+        """
+        Compare SQL_TO_GET_TABLES (information_schema) with SQL_TO_GET_TABLES_CATALOG (pg_class) on a synthetic
+        catalog of `tables` empty tables spread over `schemas` schemas.
+        :param connection: host:port:user:password of a scratch postgres server
+        :param keep: keep the synthetic database for the next run
+        """
+        pool = ConnectionPool(connection)
+        try:
+            with pool.connection("postgres") as conn, conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (database,))
+                exists = cur.fetchone() is not None
+                if not exists:
+                    cur.execute(f'CREATE DATABASE "{database}"')
+            with pool.connection(database) as conn, conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM pg_class WHERE relkind = 'r' AND relname LIKE 'bench\\_%'")
+                if cur.fetchone()[0] < tables:
+                    print(f"creating {tables} tables in {database}")
+                    conn.autocommit = False
+                    for i in range(schemas):
+                        cur.execute(f"CREATE SCHEMA IF NOT EXISTS bench_{i}")
+                    for start in range(0, tables, 1000):
+                        cur.execute("".join(f"CREATE TABLE IF NOT EXISTS bench_{i % schemas}.bench_{i} (id int);"
+                                            for i in range(start, min(start + 1000, tables))))
+                        conn.commit()
+                    conn.autocommit = True
+                list_schema = [f"bench_{i}" for i in range(schemas)]
+                legacy_sql = SQL_TO_GET_TABLES.format(",".join(f"'{_}'" for _ in list_schema))
+                legacy, legacy_rows = _timed(lambda: cur.execute(legacy_sql) or cur.fetchall(), repeat)
+                catalog, catalog_rows = _timed(
+                    lambda: cur.execute(SQL_TO_GET_TABLES_CATALOG,
+                                        {"schemas": list_schema, "toast": False, "indexes": False}) or cur.fetchall(),
+                    repeat)
+            print(f"information_schema query: {legacy:.3f}s for {len(legacy_rows)} tables")
+            print(f"pg_class query:           {catalog:.3f}s for {len(catalog_rows)} tables")
+            print(f"speedup: {legacy / catalog:.1f}x")
+        finally:
+            pool.close()
+        if not keep:
+            admin = ConnectionPool(connection)
+            try:
+                with admin.connection("postgres") as conn, conn.cursor() as cur:
+                    cur.execute(f'DROP DATABASE IF EXISTS "{database}"')
+            finally:
+                admin.close()
+
+    def startup(self, source="localhost:5432:postgres:postgres", destination="localhost:5433:postgres:postgres",
+                commands="get_progress,cleanup", repeat=5):
+        """
+        Measure the cold start of a CLI invocation: every run is a new interpreter that imports dms, loads the
+        config and runs one command against the local postgres pair. The in-process emulator stands in for
+        the APIs, the discovery client is still imported for the commands calling them.
+        :param commands: comma separated commands of DataMigrationService taking a database name
+        :param repeat: runs per command, the best is reported
+        """
+        src = parse_connection_string(source)
+        dst = parse_connection_string(destination)
+        rows = []
+        with tempfile.TemporaryDirectory() as tmp:
+            config = {"bench": {
+                "aws-host": src["host"], "aws-port": int(src["port"]), "aws-replication-username": src["user"],
+                "aws-replication-password": src["password"], "gcp-instance-region": "region",
+                "gcp-project-id": "bench-project", "gcp-host": dst["host"], "gcp-port": int(dst["port"]),
+                "gcp-root-password": dst["password"],
+            }}
+            config_path = os.path.join(tmp, "config.yaml")
+            with open(config_path, "w") as f:
+                safe_dump(config, f, sort_keys=False)
+            for command in commands.split(",") if isinstance(commands, str) else commands:
+                def run():
+                    output = subprocess.run([sys.executable, "-c", STARTUP_DRIVER, command, config_path,
+                                             os.path.join(tmp, "state")],
+                                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+                                            capture_output=True, text=True).stdout
+                    return int(output.split()[-1])
+                elapsed, modules = _timed(run, repeat)
+                rows.append((command, f"{elapsed:.3f}", modules))
+        _print_table(("command", "seconds", "modules"), rows)
+
+    def orchestration(self, databases="1,10,100", source="localhost:5432:postgres:postgres",
+                      destination="localhost:5433:postgres:postgres", latency=0.05, full_dump_seconds=3.0,
+                      poll_interval=1, workers=32, per_region=32, regions=4):
+        """
+        Measure sync_all, get_progress and cleanup_all against the in-process DMS/Cloud SQL emulator.
+        Every config entry points to the local postgres pair (see docker-compose.yml): `source` plays the RDS
+        instance, and the emulated cloud SQL instances resolve to `destination`. The preflight check is skipped,
+        since the local source has no pglogical.
+        :param databases: comma separated numbers of config entries to migrate
+        :param latency: seconds added to every emulated API call
+        :param full_dump_seconds: emulated time from job start to CDC
+        :param regions: number of regions the config entries are spread over
+        """
+        from dms import DataMigrationService
+        from fake_gcp import FakeGcp
+        from gcp import GcpApi
+
+        src = parse_connection_string(source)
+        dst = parse_connection_string(destination)
+        sizes = [int(_) for _ in str(databases).split(",")] if isinstance(databases, (str, int)) else databases
+        rows = []
+        for count in sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                config = {f"bench-{i}": {
+                    "aws-host": src["host"], "aws-port": int(src["port"]),
+                    "aws-replication-username": src["user"], "aws-replication-password": src["password"],
+                    "gcp-auto-storage-increase": True, "gcp-database-version": "POSTGRES_11",
+                    "gcp-disk-type": "PD_SSD", "gcp-instance-cpu": 1, "gcp-instance-mem": 3840,
+                    "gcp-instance-region": f"region-{i % regions}", "gcp-instance-storage": 20,
+                    "gcp-ip-config": {"enableIpv4": True}, "gcp-migration-type": "continuous",
+                    "gcp-port": int(dst["port"]), "gcp-project-id": "bench-project",
+                } for i in range(count)}
+                config_path = os.path.join(tmp, "config.yaml")
+                with open(config_path, "w") as f:
+                    safe_dump(config, f, sort_keys=False)
+
+                fake = FakeGcp(latency=latency, full_dump_seconds=full_dump_seconds, instance_host=dst["host"])
+                service = DataMigrationService(config=config_path, state_dir=os.path.join(tmp, "state"))
+                sys.stdout = sys.__stdout__
+                service._logger.setLevel(logging.WARNING)
+                service._gcp = GcpApi(logger=service._logger, build=fake.build, poll_interval=poll_interval)
+
+                rows.append(("sync_all", count) + _measure(
+                    lambda: service.sync_all(workers=workers, per_region=per_region, report_interval=3600,
+                                             preflight=False), fake))
+                # the emulator generated root passwords, the local destination uses its own
+                service._db_config["bench-0"]["gcp-root-password"] = dst["password"]
+                rows.append(("get_progress", count) + _measure(lambda: service.get_progress("bench-0"), fake))
+                rows.append(("cleanup_all", count) + _measure(service.cleanup_all, fake))
+        _print_table(("step", "databases", "seconds", "api calls", "peak MB"),
+                     [(step, count, f"{elapsed:.2f}", calls, f"{peak:.1f}") for step, count, elapsed, calls, peak in rows])
+
+
+if __name__ == '__main__':
+    fire.Fire(Benchmark)
@@ -0,0 +1,76 @@
+import time
+
+from get_metadata import ConnectionPool
+from get_metadata_sql import SQL_TO_GET_REPLICATION_LAG, SQL_TO_GET_REPLICATION_LAG_LEGACY, SQL_TO_CHECK_WRITABLE
+
+# DMS replicates with pglogical, whose slots use the pglogical_output plugin
+SLOT_PLUGIN = 'pglogical%'
+
+
+class LagMonitor:
+    """
+    Replication lag of DMS on the source: WAL bytes the active pglogical slots haven't confirmed yet. Inactive
+    slots (left over by a deleted job, or of a job not streaming) hold WAL but don't measure this migration.
+    """
+    def __init__(self, str_con_src, plugin=SLOT_PLUGIN):
+        self._pool = ConnectionPool(str_con_src)
+        self._plugin = plugin
+
+    def close(self):
+        self._pool.close()
+
+    def lag(self):
+        """
+        :return: highest lag in bytes of the active slots, None if no slot is active, and list of
+                 (slot, database, active, lag) of every slot
+        """
+        with self._pool.connection("postgres") as conn, conn.cursor() as cur:
+            cur.execute("SHOW server_version_num")
+            legacy = int(cur.fetchone()[0]) < 100000
+            cur.execute(SQL_TO_GET_REPLICATION_LAG_LEGACY if legacy else SQL_TO_GET_REPLICATION_LAG, (self._plugin,))
+            slots = [(slot, database, active, int(lag or 0)) for slot, database, active, lag in cur.fetchall()]
+        return max((_[3] for _ in slots if _[2]), default=None), slots
+
+    def wait_until_below(self, max_lag_bytes, window, interval=5, timeout=None, on_sample=None):
+        """
+        Block until the lag stays at or under `max_lag_bytes` for `window` seconds in a row.
+        :param on_sample: callable(lag, slots, seconds below the threshold) called on every sample
+        :return: lag of the last sample
+        """
+        started = time.time()
+        below_since = None
+        while True:
+            lag, slots = self.lag()
+            now = time.time()
+            if not slots:
+                raise Exception("no DMS replication slot found on the source")
+            if lag is not None and lag <= max_lag_bytes:
+                below_since = now if below_since is None else below_since
+            else:
+                below_since = None
+            if on_sample is not None:
+                on_sample(lag, slots, 0 if below_since is None else now - below_since)
+            if below_since is not None and now - below_since >= window:
+                return lag
+            if timeout is not None and now - started > timeout:
+                inactive = [slot for slot, _, active, _ in slots if not active]
+                raise TimeoutError(f"replication lag did not stay under {max_lag_bytes} bytes for {window}s "
+                                   f"within {timeout}s, last lag: {'no active slot' if lag is None else f'{lag} bytes'}, "
+                                   f"inactive slots: {inactive}")
+            time.sleep(interval)
+
+
+def check_writable(str_con_dst):
+    """
+    Raise unless the destination accepts writes: it is out of recovery, not read only and can assign
+    a transaction id.
+    """
+    pool = ConnectionPool(str_con_dst)
+    try:
+        with pool.connection("postgres") as conn, conn.cursor() as cur:
+            cur.execute(SQL_TO_CHECK_WRITABLE)
+            if not cur.fetchone()[0]:
+                raise Exception("destination is still read only")
+            cur.execute("SELECT txid_current()")
+    finally:
+        pool.close()
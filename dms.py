@@ -1,33 +1,44 @@
+import atexit
 import json
 import sys
-import fire
 import logging
-import multiprocessing
+import threading
 import time
 from datetime import datetime
-import pickle
-from pathlib import Path
-from yaml import safe_dump,safe_load
 import random
 import string
-from googleapiclient import discovery, errors
-from oauth2client.client import GoogleCredentials
-
-import psycopg2
 import os
 from gcp import GcpApi
+from fleet import FleetRunner
+from inventory import Inventory, DMS_FIELDS
+from metrics import METRICS
+from state import StateStore, SOURCE_PROFILE, DESTINATION_PROFILE, JOB_CREATED, JOB_STARTED, CDC_REACHED, PROMOTED, \
+    SEQUENCES_SYNCED, WARMED_UP, CUTOVER_DONE, NATIVE_COPIED, write_json
 
 DEFAULT_PORT = 5432
 MJ_PREFIX = 'auto-mj-'
 CP_SRC_PREFIX = 'src-'
+STATE_DIR = '.dms-state'
+# seconds a started job may take to report RUNNING before sync gives up
+AWAIT_RUNNING_TIMEOUT = 3600
+# replication lag under which a database is promoted, in bytes of WAL not yet confirmed by DMS
+CUTOVER_MAX_LAG_BYTES = 16 * 1024 ** 2
+# increments every sequence of the destination is moved ahead of its source position at cutover
+SEQUENCE_MARGIN = 1000
+# statuses a database rests in, their time is not counted as a stage of the run
+END_STATUSES = ("CDC", "COPIED", "CONNECTION_FAILED", "PREFLIGHT_FAILED", "NOT_IN_CDC", "CUTOVER_DONE")
 
 def setup_logger(verbose):
     logger = logging.getLogger(__name__)
     formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s', datefmt='%Y/%m/%d %H:%M:%S')
-    streamHandler = logging.StreamHandler()
-    streamHandler.setFormatter(formatter)
-    logger.addHandler(streamHandler)
-    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    # the modules scanning the databases log their progress through their own logger
+    for name in (__name__, "get_metadata", "progress"):
+        module_logger = logging.getLogger(name)
+        if not module_logger.handlers:
+            streamHandler = logging.StreamHandler()
+            streamHandler.setFormatter(formatter)
+            module_logger.addHandler(streamHandler)
+        module_logger.setLevel(logging.DEBUG if verbose else logging.INFO)
     sys.stdout = StreamToLogger(logger, logging.INFO)
     return logger
 
@@ -60,126 +71,808 @@ class StreamToLogger(object):
         self.linebuf = ''
 
 class DataMigrationService:
-    def __init__(self,config="config.yaml",verbose=False):
-        """[summary]"""
+    def __init__(self,config="config.yaml",verbose=False,state_dir=STATE_DIR,metrics=None):
+        """
+        :param config: yaml file, directory of yaml files or glob, or a comma separated list of them
+        :param state_dir: directory of the local state: completed steps, progress and validation results
+        :param metrics: file the metrics of the run are written to on exit, JSONL if it ends with .jsonl,
+                        Prometheus text otherwise
+        """
         self._config=config
+        self._state_dir = state_dir
+        self._state = StateStore(state_dir)
         self._logger = setup_logger(verbose)
-        self._gcp = GcpApi(logger=self._logger)
+        self._gcp = GcpApi(logger=self._logger, cache_dir=os.path.join(state_dir, "discovery"))
         self._now_str = datetime.now().strftime("%Y%m%dt%H%M%S")
-        with open(self._config) as f:
-            self._db_config = safe_load(f)
+        self._status = {}
+        self._config_lock = threading.Lock()
+        self._preflight_locks = {}
+        self._db_config = Inventory(config, os.path.join(state_dir, "inventory"))
+        if metrics is not None:
+            atexit.register(self._export_metrics, metrics)
         #self.rds_name = source_connection["postgresql"]["host"].split(".")[0]
     
-    def get_progress(self, dbname):
+    def get_progress(self, dbname, workers=8):
         """
         get progress of migration
+        :param workers: number of databases scanned at the same time on each side
         """
-        cfg = self._db_config[dbname]
-        from get_metadata import get_percentage_migrated
+        from get_metadata import get_migration_breakdown
         if self.test_connection(dbname):
-            progress = get_percentage_migrated( f'{cfg["aws-host"]}:{cfg["aws-port"]}:{cfg["aws-replication-username"]}:{cfg["aws-replication-password"]}',
-                                        f'{cfg["gcp-host"]}:{cfg["gcp-port"]}:{"postgres"}:{cfg["gcp-root-password"]}')
+            breakdown = get_migration_breakdown(self._source_connection(dbname), self._destination_connection(dbname),
+                                                workers=workers)
+            progress = breakdown["percentage"]
+            for database, row in breakdown["databases"].iterrows():
+                self._logger.info(f"progress {database} : {row['percentage']:.2f}% "
+                                  f"({int(row['size_dst'])}/{int(row['size_src'])} bytes)")
         else:
             progress = 0
         self._logger.info(f"progress : {progress}%")
 
-    def sync(self, dbname):
+    def watch_progress(self, dbname, interval=30, iterations=None, workers=8, top=10):
+        """
+        Report progress of migration every `interval` seconds.
+        The table inventory is discovered once and cached under the state dir, afterwards only table sizes are
+        sampled, unless the catalog of a side changes.
+        :param iterations: number of samples to take, forever if not set
+        :param top: number of tables with the highest throughput to report
+        """
+        from progress import ProgressStore, ProgressTracker
+        store = ProgressStore(os.path.join(self._state_dir, f"progress-{dbname}.sqlite"))
+        tracker = ProgressTracker(self._source_connection(dbname), self._destination_connection(dbname), store,
+                                  workers=workers)
+        try:
+            count = 0
+            while iterations is None or count < iterations:
+                started = time.time()
+                for side in ("source", "destination"):
+                    tracker.refresh_inventory(side)
+                report = tracker.sample()
+                if report is None:
+                    self._logger.info(f"progress {dbname}: no snapshot of the source yet")
+                    busiest = []
+                else:
+                    eta = f"{int(report['eta'])}s" if report["eta"] is not None else "unknown"
+                    self._logger.info(f"progress {dbname}: {report['percentage']:.2f}%, "
+                                      f"throughput: {report['throughput'] / 1024 ** 2:.2f} MB/s, "
+                                      f"remaining: {report['remaining'] / 1024 ** 2:.2f} MB, eta: {eta}")
+                    busiest = sorted(report["tables"], key=lambda _: _["throughput"], reverse=True)[:top]
+                for _ in busiest:
+                    if _["throughput"] > 0:
+                        self._logger.info(f"  {_['database']}.{_['schema']}.{_['table']}: "
+                                          f"{_['size_dst']}/{_['size_src']} bytes, {_['throughput'] / 1024:.1f} KB/s")
+                count += 1
+                if iterations is None or count < iterations:
+                    time.sleep(max(0, interval - (time.time() - started)))
+        finally:
+            tracker.close()
+            store.close()
+
+    def profile(self, dbname, interval=5, iterations=None, window=60, source_interval=300, workers=8, top=10):
+        """
+        Report every `interval` seconds the tables holding the migration back: tables not started or stalled
+        first, largest remaining first, then the slowest to finish at their copy rate over the last `window` seconds.
+        Only the destination is sampled every interval, the source every `source_interval` seconds.
+        :param iterations: number of samples to take, forever if not set
+        :param top: number of tables to report
+        """
+        from progress import ProgressStore, ProgressTracker
+        from profiler import TransferProfiler
+        store = ProgressStore(os.path.join(self._state_dir, f"progress-{dbname}.sqlite"))
+        tracker = ProgressTracker(self._source_connection(dbname), self._destination_connection(dbname), store,
+                                  workers=workers)
+        profiler = TransferProfiler(tracker, store, window=window, source_interval=source_interval)
+        try:
+            count = 0
+            while iterations is None or count < iterations:
+                started = time.time()
+                tables = profiler.sample()
+                statuses = {}
+                for _ in tables:
+                    statuses[_["status"]] = statuses.get(_["status"], 0) + 1
+                self._logger.info(f"profile {dbname}: {len(tables)} tables left "
+                                  f"({', '.join(f'{k}: {v}' for k, v in sorted(statuses.items())) or 'none'})")
+                for _ in tables[:top]:
+                    rate = f"{_['rate'] / 1024:.1f} KB/s" if _["rate"] is not None else "unknown rate"
+                    eta = f"{int(_['eta'])}s" if _["eta"] is not None else "unknown"
+                    self._logger.info(f"  {_['database']}.{_['schema']}.{_['table']}: {_['status']}, "
+                                      f"{_['remaining'] / 1024 ** 2:.2f} MB left, {rate}, eta: {eta}")
+                count += 1
+                if iterations is None or count < iterations:
+                    time.sleep(max(0, interval - (time.time() - started)))
+        finally:
+            tracker.close()
+            store.close()
+
+    def validate(self, dbname, mode="checksum", workers=4, chunk_rows=100000, rate=None, recheck=False,
+                 tolerance=0.1):
+        """
+        Compare data of source and destination before cutover.
+        :param mode: "checksum" compares exact row counts and checksums of primary key ranges,
+                     "estimate" compares the planner's row estimates
+        :param workers: number of chunks checked at the same time
+        :param chunk_rows: rows of a chunk, its primary key range is taken from a sample of the keys
+        :param rate: maximum number of chunk queries per second against the source
+        :param recheck: check again the chunks that matched in a previous run
+        :param tolerance: "estimate" mode, relative difference of the estimates under which a table matches,
+                          the estimates of two clusters come from different samples
+        :return: True if every table matches
+        """
+        from validate import DataValidator, ValidationStore
+        store = ValidationStore(os.path.join(self._state_dir, f"validation-{dbname}.sqlite"))
+        validator = DataValidator(self._source_connection(dbname), self._destination_connection(dbname), store,
+                                  workers=workers, chunk_rows=chunk_rows, rate=rate)
+        try:
+            if mode == "estimate":
+                mismatches, skipped = 0, 0
+                for database, schema, table, src_rows, dst_rows in validator.estimate():
+                    # reltuples is -1 until a table is analyzed (PostgreSQL 14 and later)
+                    if src_rows is not None and src_rows < 0 or dst_rows is not None and dst_rows < 0:
+                        skipped += 1
+                        continue
+                    if dst_rows is None or abs(src_rows - dst_rows) > tolerance * max(src_rows, dst_rows):
+                        mismatches += 1
+                        self._logger.info(f"{database}.{schema}.{table}: ~{src_rows} rows on source, "
+                                          f"~{dst_rows} on destination")
+                if skipped:
+                    self._logger.info(f"{skipped} tables of {dbname} never analyzed, not compared")
+            else:
+                chunks = validator.plan(recheck=recheck)
+                self._logger.info(f"validating {len(chunks)} chunks of {dbname}")
+                validator.check(chunks)
+                mismatches = 0
+                for database, schema, table, src_rows, dst_rows, count, bad in store.summary():
+                    if bad:
+                        mismatches += 1
+                        self._logger.info(f"{database}.{schema}.{table}: {src_rows} rows on source, {dst_rows} on "
+                                          f"destination, {bad}/{count} chunks differ")
+            self._logger.info(f"validation of {dbname}: {mismatches} tables differ")
+            return mismatches == 0
+        finally:
+            validator.close()
+            store.close()
+
+    def schema_diff(self, dbname, workers=8):
+        """
+        Compare functions, views, sequences, indexes, constraints and extensions of source and destination.
+        Object hashes are cached per host under the state dir, only databases whose catalog changed are read again.
+        :param workers: number of databases read at the same time on each side
+        :return: True if no object is missing or different on the destination
+        """
+        from schema_diff import diff
+        differences = diff(self._source_connection(dbname), self._destination_connection(dbname), workers=workers,
+                           cache_dir=os.path.join(self._state_dir, "schema"))
+        for _ in differences:
+            self._logger.info(f"{_['database']}: {_['kind']} {_['name']} is {_['status']} on the destination")
+        self._logger.info(f"schema diff of {dbname}: {len(differences)} objects missing or different")
+        return not differences
+
+    def benchmark_parity(self, dbname, statements=10, clients=4, iterations=50, warmup=1, max_ratio=1.5, workers=8):
+        """
+        Check the destination tier performs like the source before cutover: the top read-only statements of the
+        source (pg_stat_statements, without parameters) are replayed concurrently on both sides, see
+        parity.ParityBenchmark, and their latency percentiles and throughput compared.
+        :param statements: number of statements replayed, slowest in total on the source first
+        :param clients: connections running every statement at the same time on each side
+        :param iterations: executions of every statement per client
+        :param warmup: executions of every statement per client before the measured ones
+        :param max_ratio: highest p95 latency of the destination, relative to the source, before a statement is
+                          reported as a regression
+        :param workers: number of databases scanned at the same time
+        :return: True if no statement regressed or failed on the destination only
+        """
+        from parity import ParityBenchmark, SOURCE, DESTINATION
+        benchmark = ParityBenchmark(self._source_connection(dbname), self._destination_connection(dbname),
+                                    statements=statements, clients=clients, iterations=iterations, warmup=warmup,
+                                    workers=workers)
+        results = benchmark.run()
+        regressions = 0
+        lines = [f"{'database':<16}  {'side':<11}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}  {'exec/s':>8}  query"]
+        for result in results:
+            src, dst = result[SOURCE], result[DESTINATION]
+            regressed = (dst["error"] is not None and src["error"] is None) or (
+                src["p95"] is not None and dst["p95"] is not None and dst["p95"] > max_ratio * max(src["p95"], 0.001))
+            regressions += regressed
+            query = " ".join(result["query"].split())
+            for side, stats in ((SOURCE, src), (DESTINATION, dst)):
+                latencies = "  ".join(("-" if stats[_] is None else f"{stats[_]:.2f}").rjust(8)
+                                      for _ in ("p50", "p95", "p99"))
+                lines.append(f"{result['database']:<16}  {side:<11}  {latencies}  {stats['throughput']:>8.1f}  "
+                             f"{query[:80] if side == SOURCE else ('REGRESSION' if regressed else '')}")
+                if stats["error"] is not None:
+                    lines.append(f"{'':<16}  {side:<11}  failed: {stats['error']}")
+        self._logger.info(f"query parity of {dbname}, {clients} clients x {iterations} executions:\n" +
+                          "\n".join(lines))
+        self._logger.info(f"query parity of {dbname}: {regressions} of {len(results)} statements slower than "
+                          f"{max_ratio}x at p95 or failing on the destination")
+        return regressions == 0
+
+    def preflight(self, dbname, workers=8, refresh=False):
+        """
+        Check that the source is ready for a DMS migration: logical replication, replication slots and senders,
+        pglogical in every database, replication privileges, primary keys and extensions.
+        Results are cached per source host under the state dir for an hour.
+        :param workers: number of databases checked at the same time
+        :param refresh: check again even if a recent result is cached
+        :return: True if no blocking issue was found
+        """
+        from preflight import PreflightChecker, BLOCKING
+        cfg = self._db_config[dbname]
+        host = f'{cfg["aws-host"]}:{cfg["aws-port"]}'
+        with self._config_lock:
+            lock = self._preflight_locks.setdefault(host, threading.Lock())
+        # databases of the same host share the check, the first one runs it and the others read the cache
+        with lock:
+            checker = PreflightChecker(self._source_connection(dbname), workers=workers,
+                                       cache_dir=os.path.join(self._state_dir, "preflight"))
+            issues = checker.run(refresh=refresh)
+        for issue in issues:
+            where = f"{issue['database']}: " if issue["database"] else ""
+            log = self._logger.error if issue["severity"] == BLOCKING else self._logger.warning
+            log(f"preflight {dbname} {issue['check']}: {where}{issue['message']}")
+        blocking = [_ for _ in issues if _["severity"] == BLOCKING]
+        self._logger.info(f"preflight {dbname}: {len(blocking)} blocking issues, "
+                          f"{len(issues) - len(blocking)} warnings")
+        return not blocking
+
+    def size(self, dbname, sample_seconds=10, workers=8):
+        """
+        Recommend a cloud SQL tier and disk size from the measured source: table sizes (with TOAST and indexes),
+        commit, row write and WAL rates, with disk headroom for the changes written during the full dump.
+        :param sample_seconds: seconds over which write rates are sampled, 0 averages them since the last
+                               statistics reset
+        :param workers: number of databases scanned at the same time
+        :return: dict of cpu, mem (MB), storage (GB), tier and estimated dump_seconds
+        """
+        from sizing import WorkloadSampler, recommend
+        workload = WorkloadSampler(self._source_connection(dbname), workers=workers,
+                                   sample_seconds=sample_seconds).measure()
+        recommendation = recommend(workload)
+        # kept for the throughput history of the run, see _record_run
+        self._state.update(dbname, source_bytes=workload["data_bytes"])
+        self._logger.info(f"workload of {dbname}: {workload['data_bytes'] / 1024 ** 3:.2f} GB in "
+                          f"{workload['databases']} databases, {workload['commits_per_second']:.1f} commits/s, "
+                          f"{workload['writes_per_second']:.1f} rows written/s, "
+                          f"{workload['wal_bytes_per_second'] / 1024 ** 2:.2f} MB/s of WAL")
+        self._logger.info(f"recommended for {dbname}: {recommendation['tier']}, {recommendation['storage']} GB, "
+                          f"full dump ~{int(recommendation['dump_seconds'])}s")
+        return recommendation
+
+    def _instance_settings(self, dbname):
+        """
+        :return: cpu, mem (MB) and storage (GB) of the destination: the config values, or the recommendation
+                 of `size` for the ones that are absent. Without a configured mem, it is derived from the cpu
+                 in use, so the tier stays within the memory per vCPU limits. The recommendation is kept in the
+                 state, so a resumed sync provisions the same instance.
+        """
+        from sizing import memory_mb
+        config = self._db_config[dbname]
+        fields = {"cpu": "gcp-instance-cpu", "mem": "gcp-instance-mem", "storage": "gcp-instance-storage"}
+        if all(config.get(field) is not None for field in fields.values()):
+            return tuple(config[field] for field in fields.values())
+        sizing = self._state.get(dbname).get("sizing")
+        if sizing is None:
+            self._logger.info(f"sizing the destination of {dbname}, "
+                              f"{', '.join(_ for _ in fields.values() if config.get(_) is None)} not configured")
+            sizing = self.size(dbname)
+            self._state.update(dbname, sizing=sizing)
+        cpu, _, storage = (config[field] if config.get(field) is not None else sizing[key]
+                           for key, field in fields.items())
+        mem = config["gcp-instance-mem"] if config.get("gcp-instance-mem") is not None else memory_mb(cpu)
+        return cpu, mem, storage
+
+    def _source_connection(self, dbname):
+        """
+        :return: host:port:user:password connection string of the RDS source
+        """
+        cfg = self._db_config[dbname]
+        return f'{cfg["aws-host"]}:{cfg["aws-port"]}:{cfg["aws-replication-username"]}:{cfg["aws-replication-password"]}'
+
+    def _destination_connection(self, dbname):
+        """
+        :return: host:port:user:password connection string of the cloud SQL destination
+        """
+        cfg = self._db_config[dbname]
+        return f'{cfg["gcp-host"]}:{cfg["gcp-port"]}:{"postgres"}:{cfg["gcp-root-password"]}'
+
+    def sync(self, dbname, cdc_timeout=None, preflight=True, engine="dms", jobs=8, pg_bin=None):
         """
         Starts db migration process.
         1. Creates and starts migration job
+        Every completed step is recorded in the state dir, so a new run resumes after the last completed step.
         :param dbname: name of service in the config yaml
+        :param cdc_timeout: seconds to wait for the CDC phase once the job is running, defaults to no limit
+        :param preflight: check the source is ready before creating any resource, see `preflight`
+        :param engine: "dms", or "native" to copy into an existing destination with pg_dump/psql and COPY,
+                       see `_sync_native`
+        :param jobs: native engine, maximum number of tables copied at the same time
+        :param pg_bin: native engine, directory of pg_dump and psql, defaults to the PATH
         """
+        if engine == "native":
+            return self._sync_native(dbname, jobs, pg_bin)
+        if engine != "dms":
+            raise Exception(f"unknown engine {engine}, expected dms or native")
+        if self._state.done(dbname, CDC_REACHED):
+            self._logger.info(f"CDC phase already reached for {dbname}, ready to cutover")
+            self._set_status(dbname, "CDC")
+            return
+        missing = [] if self._state.done(dbname, DESTINATION_PROFILE) else self._db_config.missing(dbname, DMS_FIELDS)
+        if missing:
+            raise Exception(f"{', '.join(missing)} of {dbname} must be set to create its destination with DMS")
+        if "sync_started" not in self._state.get(dbname):
+            self._state.update(dbname, sync_started=time.time())
         self._logger.info("Starting migration job")
+        self._set_status(dbname, "TESTING_CONNECTION")
         if not self.test_connection(dbname):
             self._logger.info(
                 "migration job won't continue because connection test was not succesful"
             )
+            self._set_status(dbname, "CONNECTION_FAILED")
             return
-        cfg = self._db_config[dbname]
+        if preflight and not self._state.done(dbname, SOURCE_PROFILE):
+            self._set_status(dbname, "PREFLIGHT")
+            if not self.preflight(dbname):
+                self._logger.info("migration job won't continue because the source is not ready, see preflight")
+                self._set_status(dbname, "PREFLIGHT_FAILED")
+                return
 
         # Prepare migration job and Start
-        self._create_connection_profile(dbname)
-        self._create_dms_job(dbname)
+        self._set_status(dbname, "CREATING_PROFILES")
+        if not self._state.done(dbname, SOURCE_PROFILE):
+            self._create_source_profile(dbname)
+            self._state.mark(dbname, SOURCE_PROFILE)
+        if not self._state.done(dbname, DESTINATION_PROFILE):
+            self._create_destination_profile(dbname)
+            self._state.mark(dbname, DESTINATION_PROFILE)
+        self._set_status(dbname, "CREATING_JOB")
+        if not self._state.done(dbname, JOB_CREATED):
+            self._create_migration_job(dbname)
+            self._state.mark(dbname, JOB_CREATED)
+        if not self._state.done(dbname, JOB_STARTED):
+            self._start_migration_job(dbname)
+            self._state.mark(dbname, JOB_STARTED)
 
         # Create cloudsql users and Retrieve cloudsql information
-        self._await_state(dbname, "RUNNING")
+        self._set_status(dbname, "AWAIT_RUNNING")
+        self._await_state(dbname, "RUNNING", timeout=AWAIT_RUNNING_TIMEOUT)
         self._logger.info("job running, await database CDC phase")
-        self._await_phase(dbname, target_phase="CDC")
+        self._set_status(dbname, "AWAIT_CDC")
+        self._await_phase(dbname, target_phase="CDC", timeout=cdc_timeout)
+        record = self._state.mark(dbname, CDC_REACHED)
+        self._set_status(dbname, "CDC")
         self._logger.info("CDC phase reached, sync complete, ready to cutover")
+        steps = record["steps"]
+        self._record_run(dbname, "dms", steps[CDC_REACHED] - steps[JOB_STARTED],
+                         steps[JOB_STARTED] - record.get("sync_started", steps[JOB_STARTED]),
+                         record.get("source_bytes"))
+
+    def _sync_native(self, dbname, jobs=8, pg_bin=None):
+        """
+        Copy every database of the source into the existing destination instance (gcp-host) without DMS:
+        schema, data and sequences are streamed from the source in a single snapshot, see native.NativeCopier.
+        There is no CDC, writes to the source after the copy started are not carried over.
+        Every copied database is recorded, a new run copies the remaining ones.
+        """
+        from native import NativeCopier
+        if self._state.done(dbname, NATIVE_COPIED):
+            self._logger.info(f"{dbname} was already copied")
+            self._set_status(dbname, "COPIED")
+            return
+        cfg = self._db_config[dbname]
+        if not cfg.get("gcp-host") or not cfg.get("gcp-root-password"):
+            raise Exception(f"the native engine copies into an existing instance, set gcp-host and "
+                            f"gcp-root-password of {dbname}")
+        self._set_status(dbname, "TESTING_CONNECTION")
+        if not self.test_connection(dbname):
+            self._set_status(dbname, "CONNECTION_FAILED")
+            return
+        self._set_status(dbname, "COPYING")
+        started = time.time()
+        copied = 0
+        copier = NativeCopier(self._source_connection(dbname), self._destination_connection(dbname), workers=jobs,
+                              pg_bin=pg_bin)
+        for database in copier.databases():
+            step = f"{NATIVE_COPIED}:{database}"
+            if self._state.done(dbname, step):
+                continue
+            database_started = time.time()
+            tables, size = copier.copy_database(database)
+            copied += size
+            self._logger.info(f"copied {database} of {dbname}: {tables} tables, {size / 1024 ** 2:.1f} MB "
+                              f"in {time.time() - database_started:.1f}s")
+            self._state.mark(dbname, step)
+        self._set_status(dbname, "SYNC_SEQUENCES")
+        for database, _, _, error in copier.sync_sequences():
+            if error is not None:
+                self._logger.error(f"sequences of {dbname} {database}: {applied} of {read} set, {error}")
+        self._state.mark(dbname, NATIVE_COPIED)
+        self._set_status(dbname, "COPIED")
+        if copied:
+            self._record_run(dbname, "native", time.time() - started, 0, copied)
+
+    def _source_bytes(self, dbname, workers=8):
+        """
+        :return: bytes of the tables of the source, with TOAST and indexes
+        """
+        from get_metadata import GetTables
+        with GetTables(self._source_connection(dbname), workers=workers, discover=False, include_toast=True,
+                       include_indexes=True) as tables:
+            tables.get_databases()
+            tables.get_tables()
+            return sum(size for _, _, _, _, _, size in tables.table_rows)
+
+    def _record_run(self, dbname, engine, seconds, overhead, size):
+        """
+        Add a finished copy to the throughput history `plan` estimates from, see planner.ThroughputHistory.
+        A failure is only logged, the run itself succeeded.
+        :param size: bytes copied, as measured by `size` or `plan` for DMS; the run is not recorded without it
+        """
+        from planner import ThroughputHistory
+        if not size:
+            self._logger.info(f"size of the source of {dbname} was not measured, throughput not recorded")
+            return
+        try:
+            cpu = self._instance_settings(dbname)[0] if engine == "dms" else 1
+            ThroughputHistory(os.path.join(self._state_dir, "throughput.json")).record(
+                dbname, engine, size, cpu, seconds, overhead)
+        except Exception as error:
+            self._logger.warning(f"failed to record the throughput of {dbname}: {error}")
+
+    def plan(self, dbnames=None, engine="dms", workers=8, per_region=4, per_project=None, per_source=1,
+             scan_workers=8, output=None, project=None, region=None):
+        """
+        Plan a fleet migration: measure every source (tables with TOAST and indexes), estimate every migration
+        from the throughput of past runs (see planner.ThroughputHistory) and order them longest first into waves
+        that respect the concurrency caps, minimising the total duration. `sync_all --plan` follows the plan.
+        :param dbnames: comma separated names of services in the config yaml, defaults to all of them
+        :param engine: engine the estimates are for, "dms" or "native"
+        :param workers: maximum number of databases migrating at the same time
+        :param per_region: maximum number of databases migrating at the same time per gcp project/region
+        :param per_project: maximum number of databases migrating at the same time per gcp project, no limit if None
+        :param per_source: maximum number of databases dumped at the same time from one source host, no limit if None
+        :param scan_workers: number of sources measured at the same time
+        :param output: JSON file of the plan, defaults to plan.json in the state dir
+        :param project: only the entries of this gcp project
+        :param region: only the entries of this gcp region
+        :return: estimated total duration in seconds
+        """
+        from get_metadata import parallel_map
+        from planner import ThroughputHistory, schedule
+        from sizing import recommend
+        history = ThroughputHistory(os.path.join(self._state_dir, "throughput.json"))
+        names = self._dbnames(dbnames, project, region)
+
+        def measure(dbname):
+            try:
+                size = self._source_bytes(dbname, workers=2)
+                # kept for the throughput history of the run, see _record_run
+                self._state.update(dbname, source_bytes=size)
+                return size
+            except Exception as error:
+                self._logger.warning(f"failed to measure the source of {dbname}, left out of the plan: {error}")
+                return None
+
+        items = []
+        for dbname, size in zip(names, parallel_map(measure, names, scan_workers)):
+            if size is None:
+                continue
+            cfg = self._db_config[dbname]
+            if engine == "native":
+                cpu = 1
+            elif cfg.get("gcp-instance-cpu") is not None:
+                cpu = cfg["gcp-instance-cpu"]
+            else:
+                sizing = self._state.get(dbname).get("sizing") or recommend(
+                    {"data_bytes": size, "writes_per_second": 0, "commits_per_second": 0, "wal_bytes_per_second": 0})
+                cpu = sizing["cpu"]
+            overhead, copy = history.estimate(size, cpu, engine)
+            project_id, region_name = self._region_key(dbname)
+            items.append({"dbname": dbname, "project": project_id, "region": region_name,
+                          "source": self._source_key(dbname), "bytes": size, "cpu": cpu,
+                          "seconds": overhead + copy})
+        planned, makespan = schedule(items, workers, per_region, per_project=per_project, per_source=per_source)
+        width = max([len("database")] + [len(_["dbname"]) for _ in planned])
+        lines = [f"{'wave':>4}  {'start':>8}  {'end':>8}  {'database'.ljust(width)}  {'GB':>8}  {'cpu':>3}"]
+        for item in planned:
+            lines.append(f"{item['wave']:>4}  {int(item['start']):>7}s  {int(item['end']):>7}s  "
+                         f"{item['dbname'].ljust(width)}  {item['bytes'] / 1024 ** 3:>8.2f}  {item['cpu']:>3}")
+        self._logger.info(f"plan of {len(planned)} databases, {len(history.runs())} past runs:\n" + "\n".join(lines))
+        self._logger.info(f"estimated total duration {int(makespan)}s")
+        output = output or os.path.join(self._state_dir, "plan.json")
+        write_json(output, {"engine": engine, "workers": workers, "per_region": per_region,
+                            "per_project": per_project, "per_source": per_source, "makespan": makespan,
+                            "schedule": planned})
+        self._logger.info(f"plan written to {output}")
+        return makespan
+
+    def sync_all(self, dbnames=None, workers=8, per_region=4, report_interval=30, cdc_timeout=None, preflight=True,
+                 project=None, region=None, engine="dms", jobs=8, pg_bin=None, plan=None, per_project=None,
+                 per_source=None):
+        """
+        Runs sync for many databases at once.
+        A failing database is reported and does not stop the rest.
+        :param dbnames: comma separated names of services in the config yaml, defaults to all of them
+        :param workers: maximum number of databases migrating at the same time
+        :param per_region: maximum number of databases migrating at the same time per gcp project/region
+        :param report_interval: seconds between status table reports
+        :param cdc_timeout: seconds to wait for the CDC phase of every database, defaults to no limit
+        :param preflight: check every source is ready before creating any resource, see `preflight`
+        :param project: only the entries of this gcp project
+        :param region: only the entries of this gcp region
+        :param engine: see `sync`, with `jobs` and `pg_bin`
+        :param plan: JSON file written by `plan`: its databases are started in its order, with its engine and
+                     concurrency caps
+        :param per_project: maximum number of databases migrating at the same time per gcp project
+        :param per_source: maximum number of databases dumped at the same time from one source host
+        """
+        names = self._dbnames(dbnames, project, region)
+        if plan is not None:
+            with open(plan) as f:
+                planned = json.load(f)
+            selected = set(names)
+            names = [_["dbname"] for _ in planned["schedule"] if _["dbname"] in selected]
+            engine = planned["engine"]
+            workers, per_region = planned["workers"], planned["per_region"]
+            per_project, per_source = planned["per_project"], planned["per_source"]
+        limits = []
+        if per_project is not None:
+            limits.append((lambda dbname: self._region_key(dbname)[0], per_project))
+        if per_source is not None:
+            limits.append((self._source_key, per_source))
+        fleet = self._fleet(workers, per_region, report_interval)
+        fleet.run(names, lambda dbname: self._sync_task(dbname, cdc_timeout, preflight, engine, jobs, pg_bin),
+                  self._region_key, limits)
+        self._log_stage_summary()
+
+    def cutover(self, dbname, max_lag_bytes=CUTOVER_MAX_LAG_BYTES, window=60, interval=5, timeout=None,
+                promote_timeout=1800, sequence_margin=SEQUENCE_MARGIN, warmup=True, warmup_workers=4):
+        """
+        Promote the destination of a database in CDC once replication has caught up: the lag of the DMS
+        replication slots on the source must stay under `max_lag_bytes` for `window` seconds, then the job is
+        promoted, awaited until COMPLETED, the destination is checked to accept writes, its sequences are
+        set to the positions of the source and it is warmed up, see `warmup`.
+        A cutover interrupted after the promote resumes by awaiting its completion.
+        :param max_lag_bytes: highest replication lag allowed, in bytes of WAL
+        :param window: seconds the lag must stay under the threshold
+        :param interval: seconds between two lag samples
+        :param timeout: seconds to wait for the lag to stay low, defaults to no limit
+        :param promote_timeout: seconds the promote may take
+        :param sequence_margin: increments every sequence is moved ahead of its source position
+        :param warmup: ANALYZE the destination and prewarm its buffer cache after the promote
+        :param warmup_workers: tables analyzed and relations prewarmed at the same time
+        :return: True if the destination was promoted and accepts writes
+        """
+        from cutover import LagMonitor, check_writable
+        if self._state.done(dbname, CUTOVER_DONE):
+            self._logger.info(f"{dbname} was already cut over")
+            self._set_status(dbname, "CUTOVER_DONE")
+            return True
+        cfg = self._db_config[dbname]
+        project_id, region = cfg["gcp-project-id"], cfg["gcp-instance-region"]
+        job_id = f"{MJ_PREFIX}{dbname}"
+        if not self._state.done(dbname, PROMOTED):
+            job = self._gcp.get_dms_status(project_id, region, job_id)
+            if job is None or job["state"] != "RUNNING" or job["phase"] != "CDC":
+                self._logger.error(f"cutover of {dbname} needs a job in CDC, job is: {job and job['body']}")
+                self._set_status(dbname, "NOT_IN_CDC")
+                return False
+
+            self._set_status(dbname, "AWAIT_LAG")
+            self._logger.info(f"await replication lag of {dbname} under {max_lag_bytes} bytes for {window}s")
+
+            def on_sample(lag, slots, below):
+                if lag is None:
+                    self._logger.info(f"no active replication slot of {dbname} among {len(slots)} slots")
+                    return
+                active = sum(1 for _ in slots if _[2])
+                self._logger.info(f"replication lag of {dbname}: {lag} bytes over {active} active slots, "
+                                  f"under threshold for {int(below)}s")
 
-    def _save_db_config(self):
+            monitor = LagMonitor(self._source_connection(dbname))
+            try:
+                monitor.wait_until_below(max_lag_bytes, window, interval=interval, timeout=timeout,
+                                         on_sample=on_sample)
+            finally:
+                monitor.close()
+
+            self._set_status(dbname, "PROMOTING")
+            self._logger.info(f"promoting {job_id}")
+            self._gcp.promote_dms_job(project_id, region, job_id)
+            self._state.mark(dbname, PROMOTED)
+
+        self._set_status(dbname, "AWAIT_COMPLETED")
+        self._await_state(dbname, "COMPLETED", timeout=promote_timeout)
+        self._set_status(dbname, "CHECK_WRITABLE")
+        check_writable(self._destination_connection(dbname))
+        if not self._state.done(dbname, SEQUENCES_SYNCED):
+            self._set_status(dbname, "SYNC_SEQUENCES")
+            self.sync_sequences(dbname, margin=sequence_margin)
+            self._state.mark(dbname, SEQUENCES_SYNCED)
+        if warmup and not self._state.done(dbname, WARMED_UP):
+            self._set_status(dbname, "WARMUP")
+            self.warmup(dbname, workers=warmup_workers)
+            self._state.mark(dbname, WARMED_UP)
+        self._state.mark(dbname, CUTOVER_DONE)
+        self._set_status(dbname, "CUTOVER_DONE")
+        self._logger.info(f"{dbname} promoted, destination accepts writes")
+        return True
+
+    def sync_sequences(self, dbname, margin=SEQUENCE_MARGIN, workers=8, batch_size=1000):
+        """
+        Set the sequences of the destination to their positions on the source plus `margin` increments,
+        run by `cutover` after the promote.
+        :param workers: number of databases synchronised at the same time
+        :param batch_size: sequences set by one statement on the destination
+        """
+        from sequences import SequenceSync
+        started = time.time()
+        results = SequenceSync(self._source_connection(dbname), self._destination_connection(dbname),
+                               workers=workers, margin=margin, batch_size=batch_size).run()
+        for database, read, applied, error in results:
+            if error is not None:
+                self._logger.error(f"sequences of {dbname} {database} not set: {error}")
+            elif read:
+                self._logger.info(f"sequences of {dbname} {database}: {applied} of {read} set")
+        failed = [_[0] for _ in results if _[3] is not None]
+        self._logger.info(f"{sum(_[2] for _ in results)} sequences of {dbname} set in {time.time() - started:.1f}s"
+                          + (f", {len(failed)} databases failed {failed}" if failed else ""))
+
+    def warmup(self, dbname, workers=4, relations=50, buffer_share=0.5):
+        """
+        Prepare a promoted destination for its workload, run by `cutover` after the promote: ANALYZE every table,
+        largest first, then pg_prewarm the heaps and indexes most read on the source (pg_statio_user_tables).
+        :param workers: tables analyzed and relations prewarmed at the same time
+        :param relations: heaps or index sets of tables considered for prewarm, hottest first
+        :param buffer_share: share of shared_buffers the prewarm may fill
+        """
+        from warmup import Warmup
+        started = time.time()
+        warmer = Warmup(self._source_connection(dbname), self._destination_connection(dbname), workers=workers,
+                        relations=relations, buffer_share=buffer_share)
+        tables, seconds = warmer.analyze()
+        self._logger.info(f"analyzed {tables} tables of {dbname} in {seconds:.1f}s")
+        prewarmed, size, seconds, skipped = warmer.prewarm()
+        for database, reason in skipped.items():
+            self._logger.warning(f"prewarm of {dbname} {database} skipped: {reason}")
+        self._logger.info(f"prewarmed {prewarmed} relations of {dbname}, {size / 1024 ** 2:.1f} MB in {seconds:.1f}s")
+        self._logger.info(f"warm-up of {dbname} took {time.time() - started:.1f}s")
+
+    def cutover_all(self, dbnames=None, workers=1, per_region=1, report_interval=30,
+                    max_lag_bytes=CUTOVER_MAX_LAG_BYTES, window=60, interval=5, timeout=None, promote_timeout=1800,
+                    sequence_margin=SEQUENCE_MARGIN, warmup=True, warmup_workers=4, project=None, region=None):
+        """
+        Cut over many databases in a rolling wave: at most `workers` databases (and `per_region` per gcp
+        project/region) wait for low lag and promote at the same time. See `cutover` for the other parameters.
+        :param dbnames: comma separated names of services in the config yaml, defaults to all of them
+        :param project: only the entries of this gcp project
+        :param region: only the entries of this gcp region
+        """
+        def task(dbname):
+            try:
+                if not self.cutover(dbname, max_lag_bytes=max_lag_bytes, window=window, interval=interval,
+                                    timeout=timeout, promote_timeout=promote_timeout,
+                                    sequence_margin=sequence_margin, warmup=warmup,
+                                    warmup_workers=warmup_workers):
+                    raise Exception(f"cutover stopped at {self._status.get(dbname)}")
+            finally:
+                METRICS.stage(dbname)
+
+        fleet = self._fleet(workers, per_region, report_interval)
+        fleet.run(self._dbnames(dbnames, project, region), task, self._region_key)
+        self._log_stage_summary()
+
+    def _sync_task(self, dbname, cdc_timeout=None, preflight=True, engine="dms", jobs=8, pg_bin=None):
+        try:
+            self.sync(dbname, cdc_timeout=cdc_timeout, preflight=preflight, engine=engine, jobs=jobs, pg_bin=pg_bin)
+        finally:
+            # a failed sync stops the clock of its stage
+            METRICS.stage(dbname)
+        if self._status.get(dbname) not in ("CDC", "COPIED"):
+            raise Exception(f"sync stopped at {self._status.get(dbname)}")
+
+    def _fleet(self, workers, per_region, report_interval):
+        return FleetRunner(self._logger, workers=workers, per_region=per_region,
+                           report_interval=report_interval, status=self._status)
+
+    def _dbnames(self, dbnames=None, project=None, region=None):
+        """
+        :param dbnames: None, a comma separated string or a list of names
+        :param project: only the names of this gcp project
+        :param region: only the names of this gcp region
+        :return: list of names of services in the config yaml
+        """
+        if dbnames is None:
+            return self._db_config.names(project, region)
+        if isinstance(dbnames, str):
+            dbnames = dbnames.split(",")
+        names = [str(_).strip() for _ in dbnames if str(_).strip()]
+        missing = [_ for _ in names if _ not in self._db_config]
+        if missing:
+            raise Exception(f"databases not found in {self._config}: {missing}")
+        selected = set(self._db_config.names(project, region))
+        return [_ for _ in names if _ in selected]
+
+    def _region_key(self, dbname):
+        cfg = self._db_config[dbname]
+        return cfg.get("gcp-project-id"), cfg.get("gcp-instance-region")
+
+    def _source_key(self, dbname):
+        cfg = self._db_config[dbname]
+        return f'{cfg["aws-host"]}:{cfg["aws-port"]}'
+
+    def _set_status(self, dbname, status):
+        self._status[dbname] = status
+        METRICS.stage(dbname, None if status in END_STATUSES else status)
+        self._logger.debug(f"status of {dbname}: {status}")
+
+    def _log_stage_summary(self):
         """
-        Save config dict to configuration  yaml file.
+        Log where the time of the run went: total and longest time of the databases in every stage.
         """
-        with open(self._config, 'w') as f:
-            safe_dump(self._db_config, f, sort_keys=False)
+        summary = METRICS.stage_summary()
+        if not summary:
+            return
+        self._logger.info("time per stage:")
+        for stage, databases, total, highest in summary:
+            self._logger.info(f"  {stage:<32} {databases:>5} databases {total:>10.1f}s total {highest:>9.1f}s longest")
+
+    def _export_metrics(self, path):
+        self._log_stage_summary()
+        METRICS.write(path)
+        self._logger.info(f"metrics written to {path}")
+
     
-    def _await_state(self, dbname, target_state):
+    def _await_state(self, dbname, target_state, timeout=None):
         """
         Await a state of job
         https://cloud.google.com/database-migration/docs/reference/rest/v1alpha2/projects.locations.migrationJobs#phase
         :param dbname:
         :param target_state:
+        :param timeout: seconds after which TimeoutError is raised, defaults to no limit
         :return:
         """
-        job_desc = self._describe_dms_job(dbname)
-        if job_desc["state"] is None:
-            raise Exception(f"job was not found")
-
-        current_state = job_desc['state']
-        sleep_time = 1
-        self._logger.info(f"state of job/{dbname}: {current_state}, target: {target_state}")
-        while current_state != target_state:
-            time.sleep(sleep_time)
-            sleep_time = min(10, sleep_time * 2)
-            job_desc = self._describe_dms_job(dbname)
-            if job_desc['state'] == 'FAILED':
-                raise Exception(f"job failed: {job_desc}")
-            else:
-                current_state = job_desc['state']
+        cfg = self._db_config[dbname]
+        self._logger.info(f"await state of job/{dbname}, target: {target_state}")
+
+        def reached(body):
+            if body is None:
+                raise Exception("job was not found")
+            if body['state'] == 'FAILED' and target_state != 'FAILED':
+                raise Exception(f"job failed: {body}")
+            return body['state'] == target_state
+
+        job_desc = self._gcp.await_migration_job(cfg["gcp-project-id"], cfg["gcp-instance-region"],
+                                                 f"{MJ_PREFIX}{dbname}", reached, timeout=timeout)
         self._logger.info(f"state of job/{dbname}: {job_desc}")
 
-    def _await_phase(self, dbname, target_phase="CDC"):
+    def _await_phase(self, dbname, target_phase="CDC", timeout=None):
         """
         Await a phase of data transfer. Note that the STATE of the job must be RUNNING!!!
         https://cloud.google.com/database-migration/docs/reference/rest/v1alpha2/projects.locations.migrationJobs#phase
         :param dbname:
         :param target_phase:
+        :param timeout: seconds after which TimeoutError is raised, defaults to no limit
         :return:
         """
         phases = {'PHASE_UNSPECIFIED': 1000, 'FULL_DUMP': 2, 'CDC': 3, 'PROMOTE_IN_PROGRESS': 4}
-        job_desc = self._describe_dms_job(dbname)
-        if job_desc["state"] != "RUNNING":
-            raise Exception(f"job was not in RUNNING state: {job_desc}")
-
-        current_phase = job_desc['phase']
-        sleep_time = 1
-        self._logger.info(f"phase {dbname}: {current_phase}, target: {target_phase}")
-        while phases.get(current_phase, -1) < phases.get(target_phase, -2):
-            time.sleep(sleep_time)
-            sleep_time = min(10, sleep_time * 2)
-            job_desc = self._describe_dms_job(dbname)
-            if job_desc['state'] == 'COMPLETED':
-                break
-            elif job_desc['state'] != 'RUNNING':
-                raise Exception(f"job was not in RUNNING state: {job_desc}")
-            else:
-                current_phase = job_desc['phase']
+        cfg = self._db_config[dbname]
+        self._logger.info(f"await phase of job/{dbname}, target: {target_phase}")
+
+        def reached(body):
+            if body is not None and body.get('state') == 'COMPLETED':
+                return True
+            if body is None or body.get('state') != 'RUNNING':
+                raise Exception(f"job was not in RUNNING state: {body}")
+            return phases.get(body.get('phase'), -1) >= phases.get(target_phase, -2)
+
+        job_desc = self._gcp.await_migration_job(cfg["gcp-project-id"], cfg["gcp-instance-region"],
+                                                 f"{MJ_PREFIX}{dbname}", reached, timeout=timeout)
         self._logger.info(f"phase {dbname}: {job_desc}, target: {target_phase}")
-        
-    def _create_dms_job(self, dbname=None):
-        """
-        Creates Database Migration Service Job for a particular database
-        Defaults to None.
 
-        Creating dms job does the following steps:
-        1. Create dms job
-        2. Start dms job
-        :param dbname: name of database in the config yaml
-        """
+    def _create_migration_job(self, dbname):
         self._logger.info(f"Creating Database Migration Service job for {dbname}")
         connection_profile_id_source = f"{CP_SRC_PREFIX}{dbname}"
-        connection_profile_id_destination = f"sql-{dbname}-{self._now_str}"
+        connection_profile_id_destination = self._destination_profile_id(dbname)
         migration_job_id = "{}{}".format(MJ_PREFIX, dbname)
         config = self._db_config[dbname]
         project_id = config.get("gcp-project-id")
@@ -195,24 +888,28 @@ class DataMigrationService:
             }
         }
         self._gcp.create_migration_job(project_id, region_id, migration_job_id, request_body)
-        self._gcp.start_migration_job(project_id, region_id, migration_job_id)
 
-    def _create_connection_profile(self, dbname=None):
+    def _start_migration_job(self, dbname):
+        config = self._db_config[dbname]
+        self._gcp.start_migration_job(config.get("gcp-project-id"), config.get("gcp-instance-region"),
+                                      f"{MJ_PREFIX}{dbname}", timeout=AWAIT_RUNNING_TIMEOUT)
+
+    def _destination_profile_id(self, dbname):
         """
-        Creates required connection profiles for enabling migration job for a
-        particular database.Defaults to None.
-        Creating conection profiles does the following steps:
-        0. Checks if connection profile exists. If there is, then updates the connection profile with new info.
-        1. Creates source "postgresql" connection profile (AWS)
-        2. Creates destination "cloudsql" connection profile
-        :param dbname: name of database in the config yaml
+        :return: name of the destination connection profile and cloud SQL instance of a database.
+                 It is recorded in the state on first use, so a resumed sync keeps the same destination.
         """
+        destination = self._state.get(dbname).get("destination")
+        if destination is None:
+            destination = f"sql-{dbname}-{self._now_str}"
+            self._state.update(dbname, destination=destination)
+        return destination
 
+    def _create_source_profile(self, dbname):
         self._logger.info(f"creating connection profiles for {dbname}")
         config = self._db_config.get(dbname)
         project_id = config.get("gcp-project-id")
         region_id = config.get("gcp-instance-region")
-        migration_job_id = f"{MJ_PREFIX}{dbname}"
 
         # create source connection profile
         connection_profile_id_aws = f"{CP_SRC_PREFIX}{dbname}"
@@ -227,51 +924,55 @@ class DataMigrationService:
         }
         self._gcp.upsert_connection_profile(project_id, region_id, connection_profile_id_aws, request_body_aws)
 
+    def _create_destination_profile(self, dbname):
+        config = self._db_config.get(dbname)
+        project_id = config.get("gcp-project-id")
+        region_id = config.get("gcp-instance-region")
+        migration_job_id = f"{MJ_PREFIX}{dbname}"
+        connection_profile_id_aws = f"{CP_SRC_PREFIX}{dbname}"
+
         # create dest, if the cloudsql instance name exists
         connection_profile_id_gcp = self._gcp.get_cloudsql_instance_name(project_id, region_id, migration_job_id)
         if connection_profile_id_gcp is not None:
             self._logger.info(f"cloud SQL destination instance for {dbname} already created: {connection_profile_id_gcp}")
+            self._state.update(dbname, destination=connection_profile_id_gcp)
             return None
 
-        # must create dest cloudsql instance, and save its root password
-        connection_profile_id_gcp = f"sql-{dbname}-{self._now_str}"
-        cloudsql_root_password = ''.join(
-            random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(12))
-        gcp_cpu = config["gcp-instance-cpu"]
-        gcp_mem = config["gcp-instance-mem"]
-        self._logger.debug(f"{connection_profile_id_gcp} cpu: {gcp_cpu}, mem: {gcp_mem}")
-        request_body_cloudsql = {
-            "displayName": connection_profile_id_gcp,
-            "cloudsql": {
-                "settings": {
-                    "autoStorageIncrease": config["gcp-auto-storage-increase"],
-                    "dataDiskType": config["gcp-disk-type"],
-                    "rootPassword": cloudsql_root_password,
-                    "databaseVersion": config["gcp-database-version"],
-                    "tier": f"db-custom-{gcp_cpu}-{gcp_mem}",
-                    "dataDiskSizeGb": config["gcp-instance-storage"],
-                    "sourceId": f"projects/{project_id}/locations/{region_id}/connectionProfiles/{connection_profile_id_aws}",
-                    "ipConfig": config["gcp-ip-config"]
+        # must create dest cloudsql instance, and save its root password.
+        # the password is recorded before creating, so a sync resumed during provisioning still knows it
+        connection_profile_id_gcp = self._destination_profile_id(dbname)
+        cloudsql_root_password = self._state.get(dbname).get("root_password")
+        if cloudsql_root_password is None:
+            cloudsql_root_password = ''.join(
+                random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(12))
+            self._state.update(dbname, root_password=cloudsql_root_password)
+        if self._gcp.check_connection_profile_state(project_id, region_id, connection_profile_id_gcp) != 'NOT_EXISTS':
+            self._logger.info(f"connection profile {connection_profile_id_gcp} exists, await READY")
+            self._gcp.await_connection_profile(project_id, region_id, connection_profile_id_gcp,
+                                               lambda body: body is not None and body.get("state") == "READY")
+        else:
+            gcp_cpu, gcp_mem, gcp_storage = self._instance_settings(dbname)
+            self._logger.debug(f"{connection_profile_id_gcp} cpu: {gcp_cpu}, mem: {gcp_mem}, storage: {gcp_storage}")
+            request_body_cloudsql = {
+                "displayName": connection_profile_id_gcp,
+                "cloudsql": {
+                    "settings": {
+                        "autoStorageIncrease": config["gcp-auto-storage-increase"],
+                        "dataDiskType": config["gcp-disk-type"],
+                        "rootPassword": cloudsql_root_password,
+                        "databaseVersion": config["gcp-database-version"],
+                        "tier": f"db-custom-{gcp_cpu}-{gcp_mem}",
+                        "dataDiskSizeGb": gcp_storage,
+                        "sourceId": f"projects/{project_id}/locations/{region_id}/connectionProfiles/{connection_profile_id_aws}",
+                        "ipConfig": config["gcp-ip-config"]
+                    }
                 }
             }
-        }
-        self._gcp.upsert_connection_profile(project_id, region_id, connection_profile_id_gcp, request_body_cloudsql)
+            self._gcp.upsert_connection_profile(project_id, region_id, connection_profile_id_gcp, request_body_cloudsql)
         cloudsql_host = self._gcp.get_cloudsql_host(project_id, connection_profile_id_gcp)
         self._logger.debug(f"host for {dbname}/{connection_profile_id_gcp}: {cloudsql_host}")
         self._logger.debug(f"root_password for {dbname}/{connection_profile_id_gcp}: {cloudsql_root_password}")
-        self._db_config[dbname]["gcp-root-password"] = cloudsql_root_password
-        self._db_config[dbname]["gcp-host"] = cloudsql_host
-        self._save_db_config()
-
-    def _describe_dms_job(self, dbname):
-        """
-        Describes current phase of Database Migration Job for a particular database.
-
-        :param dbname: name of database in the config yaml
-        :return {state:, status:, error:} or None if the job was not found
-        """
-        cfg = self._db_config[dbname]
-        return self._gcp.get_dms_status(cfg["gcp-project-id"], cfg["gcp-instance-region"], f"{MJ_PREFIX}{dbname}")
+        self._db_config.update_entry(dbname, gcp_root_password=cloudsql_root_password, gcp_host=cloudsql_host)
 
     def cleanup(self, dbname):
         """
@@ -280,6 +981,77 @@ class DataMigrationService:
         :param database:
         :return:
         """
+        for error in self._cleanup(dbname):
+            self._logger.warning(error)
+        METRICS.stage(dbname)
+
+    def cleanup_all(self, dbnames=None, project=None, region=None):
+        """
+        Runs cleanup for many databases at once, with batch requests: the jobs of all databases are read and
+        deleted first, then the source connection profiles and cloud SQL source representation instances of the
+        jobs deleted. All delete operations are tracked together, and a summary is logged at the end. The state
+        of a database is kept until all its resources are deleted, so a later cleanup resumes it.
+        :param dbnames: comma separated names of services in the config yaml, defaults to all of them
+        :param project: only the entries of this gcp project
+        :param region: only the entries of this gcp region
+        """
+        names = self._dbnames(dbnames, project, region)
+        job_names = {dbname: self._job_name(dbname) for dbname in names}
+        jobs, read_errors = self._gcp.get_migration_jobs(list(job_names.values()))
+        errors = {dbname: [] for dbname in names}
+        found = [dbname for dbname in names if jobs.get(job_names[dbname])]
+        not_found = [dbname for dbname in names if job_names[dbname] in jobs and dbname not in found]
+        for dbname in not_found:
+            self._logger.warning(f"job for service {dbname} was not found")
+            self._state.clear(dbname)
+        for dbname in names:
+            if job_names[dbname] in read_errors:
+                errors[dbname].append(f"unable to read dms job {job_names[dbname]}. {read_errors[job_names[dbname]]}")
+
+        self._logger.info(f"deleting {len(found)} jobs")
+        futures = self._gcp.delete_dms_resources([job_names[dbname] for dbname in found])
+        for dbname in found:
+            try:
+                futures[job_names[dbname]].result()
+            except Exception as e:
+                errors[dbname].append(f"unable to delete dms job {job_names[dbname]}. {str(e)}")
+
+        # the job references the profiles: they stay while it does, for a later cleanup to resume
+        deleted = [dbname for dbname in found if not errors[dbname]]
+        self._logger.info(f"deleting {len(deleted)} source connection profiles and sql instances")
+        profiles = {dbname: jobs[job_names[dbname]]['source'] for dbname in deleted}
+        instances = {dbname: (self._db_config[dbname]["gcp-project-id"],
+                              jobs[job_names[dbname]]['destination'].split("/")[-1] + "-master") for dbname in deleted}
+        profile_futures = self._gcp.delete_dms_resources(list(profiles.values()))
+        instance_futures = self._gcp.delete_cloudsql_instances(list(instances.values()))
+        for dbname in deleted:
+            for what, future in ((f"source connection profile '{profiles[dbname]}'", profile_futures[profiles[dbname]]),
+                                 (f"sql instance '{instances[dbname][1]}'", instance_futures[instances[dbname]])):
+                try:
+                    future.result()
+                except Exception as e:
+                    errors[dbname].append(f"unable to delete {what}. {str(e)}")
+            if not errors[dbname]:
+                self._state.clear(dbname)
+
+        for dbname in names:
+            status = "NOT_FOUND" if dbname in not_found else "FAILED" if errors[dbname] else "DELETED"
+            self._logger.info(f"cleanup {dbname}: {status} {'; '.join(errors[dbname])}")
+        failed = [dbname for dbname in names if errors[dbname]]
+        self._logger.info(f"cleanup finished: {len(names) - len(failed) - len(not_found)} deleted, "
+                          f"{len(failed)} failed, {len(not_found)} not found")
+
+    def _job_name(self, dbname):
+        cfg = self._db_config[dbname]
+        return f"projects/{cfg['gcp-project-id']}/locations/{cfg['gcp-instance-region']}/migrationJobs/{MJ_PREFIX}{dbname}"
+
+    def _cleanup(self, dbname):
+        """
+        Deletes the job first, since it references the connection profiles, then the source connection profile
+        and the cloud SQL source representation instance at the same time. The state of the database is kept
+        unless everything was deleted.
+        :return: list of errors
+        """
         cfg = self._db_config[dbname]
         project_id = cfg["gcp-project-id"]
         region = cfg["gcp-instance-region"]
@@ -287,27 +1059,42 @@ class DataMigrationService:
         job_state = self._gcp.get_dms_status(project_id, region, job_id)
         if not job_state:
             self._logger.warning(f"job for service {dbname} was not found, exiting")
-            return
+            self._state.clear(dbname)
+            return []
 
+        errors = []
         job_state = job_state['body']
-        aws_ref_instance = job_state['destination'].split("/")[-1] + "-master"
+        self._set_status(dbname, "DELETING_JOB")
         try:
-            self._logger.info(f"deleting db ref {aws_ref_instance}")
-            self._gcp.delete_cloudsql_instance(project_id, aws_ref_instance)
+            self._logger.info(f"deleting job {job_id}")
+            self._gcp.delete_dms_job(project_id, region, job_id)
         except Exception as e:
-            self._logger.warning(f"unable to delete sql instance '{aws_ref_instance}'. {str(e)}")
+            # the profile and instance stay while the job references them, a later cleanup resumes
+            return [f"unable to delete dms job {job_id}. {str(e)}"]
 
+        self._set_status(dbname, "DELETING_PROFILE_AND_INSTANCE")
+        aws_ref_instance = job_state['destination'].split("/")[-1] + "-master"
+        deletes = []
         try:
-            self._logger.info(f"deleting profile {job_state['source']}")
-            self._gcp.delete_dms_connection_profile(job_state['source'])
+            self._logger.info(f"deleting db ref {aws_ref_instance}")
+            deletes.append((f"sql instance '{aws_ref_instance}'",
+                            self._gcp.delete_cloudsql_instance(project_id, aws_ref_instance, wait=False)))
         except Exception as e:
-            self._logger.warning(f"unable to delete source connection profile '{job_state['source']}'. {str(e)}")
-
+            errors.append(f"unable to delete sql instance '{aws_ref_instance}'. {str(e)}")
         try:
-            self._logger.info(f"deleting job {job_id}")
-            self._gcp.delete_dms_job(project_id, region, job_id)
+            self._logger.info(f"deleting profile {job_state['source']}")
+            deletes.append((f"source connection profile '{job_state['source']}'",
+                            self._gcp.delete_dms_connection_profile(job_state['source'], wait=False)))
         except Exception as e:
-            self._logger.warning(f"unable to delete dms job {job_id}. {str(e)}")
+            errors.append(f"unable to delete source connection profile '{job_state['source']}'. {str(e)}")
+        for what, future in deletes:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(f"unable to delete {what}. {str(e)}")
+        if not errors:
+            self._state.clear(dbname)
+        return errors
 
     def test_connection(self,dbname):
         """
@@ -315,6 +1102,7 @@ class DataMigrationService:
         :param database:
         :return:
         """
+        import psycopg2
         dc = self._db_config[dbname]
         try:
             self._logger.info("Testing connection")
@@ -342,4 +1130,5 @@ class DataMigrationService:
             return False
 
 if __name__ == '__main__':
+    import fire
     fire.Fire(DataMigrationService)
\ No newline at end of file
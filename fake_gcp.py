@@ -0,0 +1,298 @@
+import random
+import threading
+import time
+from collections import Counter
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+class FakeGcp:
+    """
+    In-process fake of the `datamigration` v1 and `sqladmin` v1beta4 surfaces used by GcpApi.
+    Pass `fake.build` as the `build` argument of GcpApi.
+
+    Migration jobs move CREATING -> NOT_STARTED after `job_creation_seconds`, then RUNNING (FULL_DUMP) ->
+    RUNNING (CDC) -> COMPLETED after promote,
+    connection profiles CREATING -> READY, operations finish after `operation_seconds`.
+    Every call sleeps `latency` seconds and is counted in `calls`.
+    """
+
+    def __init__(self, latency=0.0, provision_seconds=1.0, full_dump_seconds=2.0, promote_seconds=1.0,
+                 operation_seconds=0.5, error_rates=None, failing_jobs=(), instance_host="127.0.0.1", page_size=50,
+                 job_creation_seconds=0.0):
+        """
+        :param error_rates: dict of method, e.g. "migrationJobs.create", to the probability of an HTTP 503
+        :param failing_jobs: migration job ids that go to FAILED instead of CDC
+        :param instance_host: ip address reported for every cloud SQL instance
+        :param job_creation_seconds: seconds a created migration job stays CREATING, it can't be started meanwhile
+        """
+        self.latency = latency
+        self.provision_seconds = provision_seconds
+        self.full_dump_seconds = full_dump_seconds
+        self.promote_seconds = promote_seconds
+        self.operation_seconds = operation_seconds
+        self.job_creation_seconds = job_creation_seconds
+        self.error_rates = error_rates or {}
+        self.failing_jobs = set(failing_jobs)
+        self.instance_host = instance_host
+        self.page_size = page_size
+        self.calls = Counter()
+        self.jobs = {}
+        self.profiles = {}
+        self.instances = {}
+        self.operations = {}
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+    def build(self, api, version):
+        if api == 'datamigration':
+            return _Resource(self, 'dms', {
+                'projects': _Resource(self, 'dms', {
+                    'locations': _Resource(self, 'dms', {
+                        'migrationJobs': _Resource(self, 'migrationJobs', {}),
+                        'connectionProfiles': _Resource(self, 'connectionProfiles', {}),
+                        'operations': _Resource(self, 'dmsOperations', {}),
+                    })
+                })
+            })
+        if api == 'sqladmin':
+            return _Resource(self, 'sqladmin', {
+                'instances': _Resource(self, 'instances', {}),
+                'operations': _Resource(self, 'sqlOperations', {}),
+                'users': _Resource(self, 'users', {}),
+            })
+        raise Exception(f"api {api} {version} is not emulated")
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    # --- state machine ---
+
+    def _now(self):
+        return time.time()
+
+    def _job_view(self, job):
+        now = self._now()
+        view = dict(job)
+        if job['state'] == 'NOT_STARTED' and now - job['created'] < self.job_creation_seconds:
+            view['state'] = 'CREATING'
+        elif job['state'] == 'RUNNING':
+            if job['id'] in self.failing_jobs and now - job['started'] >= self.full_dump_seconds:
+                view['state'] = 'FAILED'
+                view['error'] = {'code': 13, 'message': 'injected failure'}
+            elif job.get('promoted') is not None:
+                done = now - job['promoted'] >= self.promote_seconds
+                view['state'] = 'COMPLETED' if done else 'RUNNING'
+                view['phase'] = 'PROMOTE_IN_PROGRESS' if not done else job.get('phase')
+            else:
+                view['phase'] = 'CDC' if now - job['started'] >= self.full_dump_seconds else 'FULL_DUMP'
+        for key in ('id', 'created', 'started', 'promoted'):
+            view.pop(key, None)
+        return view
+
+    def _profile_view(self, profile):
+        view = dict(profile)
+        if view['state'] == 'CREATING' and self._now() - view.pop('created') >= self.provision_seconds:
+            view['state'] = 'READY'
+        view.pop('created', None)
+        return view
+
+    def _operation(self, name_prefix, sqladmin=False):
+        self._sequence += 1
+        name = f"{name_prefix}operation-{self._sequence}"
+        self.operations[name] = self._now()
+        if sqladmin:
+            return {'name': name.rsplit('/', 1)[-1], 'status': 'PENDING'}
+        return {'name': name, 'done': False}
+
+    def _operation_view(self, name, sqladmin=False):
+        key = name if not sqladmin else next((_ for _ in self.operations if _.endswith('/' + name) or _ == name), None)
+        if key is None:
+            _raise(404, f"operation {name} not found")
+        done = self._now() - self.operations[key] >= self.operation_seconds
+        if sqladmin:
+            return {'name': name, 'status': 'DONE' if done else 'RUNNING'}
+        return {'name': name, 'done': True} if done else {'name': name}
+
+    def call(self, method, batched=False, **kwargs):
+        """
+        Execute one emulated API method.
+        :param batched: the call is part of a batch request, which pays the latency once
+        """
+        self.calls[method] += 1
+        if self.latency and not batched:
+            time.sleep(self.latency)
+        if random.random() < self.error_rates.get(method, 0):
+            _raise(503, f"injected error on {method}")
+        with self._lock:
+            return getattr(self, '_' + method.replace('.', '_'))(**kwargs)
+
+    def _migrationJobs_get(self, name):
+        if name not in self.jobs:
+            _raise(404, f"migration job {name} not found")
+        return self._job_view(self.jobs[name])
+
+    def _migrationJobs_list(self, parent, pageToken=None, **_):
+        return self._page(parent, self.jobs, self._job_view, 'migrationJobs', pageToken)
+
+    def _migrationJobs_create(self, parent, migrationJobId, body):
+        name = f"{parent}/migrationJobs/{migrationJobId}"
+        if name in self.jobs:
+            _raise(409, f"migration job {name} already exists")
+        self.jobs[name] = dict(body, name=name, id=migrationJobId, state='NOT_STARTED', created=self._now())
+        return self._operation(f"{parent}/operations/")
+
+    def _migrationJobs_start(self, name):
+        job = self.jobs.get(name) or _raise(404, f"migration job {name} not found")
+        state = self._job_view(job)['state']
+        if state != 'NOT_STARTED':
+            _raise(400, f"migration job {name} is {state}")
+        job.update(state='RUNNING', started=self._now())
+        return self._operation(f"{name.rsplit('/', 2)[0]}/operations/")
+
+    def _migrationJobs_promote(self, name):
+        job = self.jobs.get(name) or _raise(404, f"migration job {name} not found")
+        if self._job_view(job).get('phase') != 'CDC':
+            _raise(400, f"migration job {name} is not in CDC")
+        job.update(promoted=self._now(), phase='CDC')
+        return self._operation(f"{name.rsplit('/', 2)[0]}/operations/")
+
+    def _migrationJobs_delete(self, name):
+        self.jobs.pop(name, None) or _raise(404, f"migration job {name} not found")
+        return self._operation(f"{name.rsplit('/', 2)[0]}/operations/")
+
+    def _connectionProfiles_get(self, name):
+        if name not in self.profiles:
+            _raise(404, f"connection profile {name} not found")
+        return self._profile_view(self.profiles[name])
+
+    def _connectionProfiles_list(self, parent, pageToken=None, **_):
+        return self._page(parent, self.profiles, self._profile_view, 'connectionProfiles', pageToken)
+
+    def _connectionProfiles_create(self, parent, connectionProfileId, body):
+        name = f"{parent}/connectionProfiles/{connectionProfileId}"
+        if name in self.profiles:
+            _raise(409, f"connection profile {name} already exists")
+        self.profiles[name] = dict(body, name=name, state='CREATING', created=self._now())
+        if 'cloudsql' in body:
+            project = parent.split('/')[1]
+            for instance in (connectionProfileId, f"{connectionProfileId}-master"):
+                self.instances[(project, instance)] = {
+                    'name': instance, 'project': project, 'state': 'RUNNABLE',
+                    'ipAddresses': [{'type': 'PRIMARY', 'ipAddress': self.instance_host}]}
+        return self._operation(f"{parent}/operations/")
+
+    def _connectionProfiles_patch(self, name, updateMask, body):
+        profile = self.profiles.get(name) or _raise(404, f"connection profile {name} not found")
+        profile.update(body)
+        return self._operation(f"{name.rsplit('/', 2)[0]}/operations/")
+
+    def _connectionProfiles_delete(self, name):
+        self.profiles.pop(name, None) or _raise(404, f"connection profile {name} not found")
+        return self._operation(f"{name.rsplit('/', 2)[0]}/operations/")
+
+    def _dmsOperations_get(self, name):
+        return self._operation_view(name)
+
+    def _instances_get(self, project, instance):
+        return dict(self.instances.get((project, instance)) or _raise(404, f"instance {instance} not found"))
+
+    def _instances_insert(self, project, body):
+        if (project, body['name']) in self.instances:
+            _raise(409, f"instance {body['name']} already exists")
+        self.instances[(project, body['name'])] = dict(body, project=project, state='RUNNABLE', ipAddresses=[
+            {'type': 'PRIMARY', 'ipAddress': self.instance_host}])
+        return self._operation(f"{project}/", sqladmin=True)
+
+    def _instances_delete(self, project, instance):
+        self.instances.pop((project, instance), None) or _raise(404, f"instance {instance} not found")
+        return self._operation(f"{project}/", sqladmin=True)
+
+    def _sqlOperations_get(self, project, operation):
+        return self._operation_view(operation, sqladmin=True)
+
+    def _users_insert(self, project, instance, body):
+        if (project, instance) not in self.instances:
+            _raise(404, f"instance {instance} not found")
+        return self._operation(f"{project}/", sqladmin=True)
+
+    def _page(self, parent, resources, view, field, page_token):
+        names = sorted(_ for _ in resources if _.startswith(parent + '/'))
+        start = int(page_token or 0)
+        page = {field: [view(resources[_]) for _ in names[start:start + self.page_size]]}
+        if start + self.page_size < len(names):
+            page['nextPageToken'] = str(start + self.page_size)
+        return page
+
+
+class _Resource:
+    """
+    Emulates a discovery resource: child resources are methods, API methods return requests.
+    """
+    def __init__(self, fake, kind, children):
+        self._fake = fake
+        self._kind = kind
+        self._children = children
+
+    def __getattr__(self, attr):
+        if attr in self._children:
+            return lambda: self._children[attr]
+        if attr == 'new_batch_http_request':
+            return lambda callback=None: _Batch(self._fake, callback)
+        if attr.endswith('_next'):
+            return self._list_next
+        method = f"{self._kind}.{attr}"
+        return lambda **kwargs: _Request(self._fake, method, kwargs)
+
+    def _list_next(self, request, response):
+        if 'nextPageToken' not in response:
+            return None
+        return _Request(self._fake, request.api_method, dict(request.kwargs, pageToken=response['nextPageToken']))
+
+
+# HTTP method of every emulated API method, so retry policies see the same requests as with discovery clients
+HTTP_METHODS = {'get': 'GET', 'list': 'GET', 'delete': 'DELETE', 'patch': 'PATCH'}
+
+
+class _Request:
+    def __init__(self, fake, api_method, kwargs):
+        self._fake = fake
+        self.api_method = api_method
+        self.method = HTTP_METHODS.get(api_method.rsplit('.', 1)[-1], 'POST')
+        self.uri = api_method
+        self.methodId = api_method
+        self.kwargs = kwargs
+
+    def execute(self, batched=False):
+        return self._fake.call(self.api_method, batched=batched, **self.kwargs)
+
+
+class _Batch:
+    """
+    Emulates a batch request: one round trip counted as "batch", and every request of the batch
+    counted as its own call.
+    """
+    def __init__(self, fake, callback):
+        self._fake = fake
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request, callback or self._callback, request_id or str(len(self._requests))))
+
+    def execute(self):
+        self._fake.calls['batch'] += 1
+        if self._fake.latency:
+            time.sleep(self._fake.latency)
+        for request, callback, request_id in self._requests:
+            try:
+                response, exception = request.execute(batched=True), None
+            except HttpError as error:
+                response, exception = None, error
+            callback(request_id, response, exception)
+
+
+def _raise(status, message):
+    raise HttpError(httplib2.Response({'status': status}), message.encode('utf-8'))
@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+STATUS_PENDING = 'PENDING'
+STATUS_STARTED = 'STARTED'
+STATUS_DONE = 'DONE'
+STATUS_FAILED = 'FAILED'
+
+
+class FleetRunner:
+    """
+    Runs one task per database on a bounded thread pool.
+    At most `per_region` tasks run at the same time for a given (project, region) key, and any other limit
+    given to `run` (e.g. per project or per source host) is honoured the same way.
+    A status table of every database is logged every `report_interval` seconds.
+    A failing task is recorded and never stops the rest of the fleet.
+    """
+
+    def __init__(self, logger, workers=8, per_region=4, report_interval=30, status=None):
+        self._logger = logger
+        self._workers = max(1, int(workers))
+        self._per_region = max(1, int(per_region))
+        self._report_interval = report_interval
+        self.status = {} if status is None else status
+        self._keys = {}
+        self._started = {}
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def set_status(self, dbname, status):
+        with self._lock:
+            self.status[dbname] = status
+
+    def run(self, dbnames, task, key, limits=()):
+        """
+        :param dbnames: databases to process, in the order they should be started
+        :param task: callable(dbname), raises on failure
+        :param key: callable(dbname) -> (project, region), used for the concurrency cap
+        :param limits: list of (callable(dbname) -> key, maximum tasks at the same time per key)
+        :return: dict of dbname -> (STATUS_DONE | STATUS_FAILED, error or None)
+        """
+        pending = list(dbnames)
+        limits = [(self._per_region, {dbname: key(dbname) for dbname in pending})] + \
+                 [(max(1, int(cap)), {dbname: limit_key(dbname) for dbname in pending}) for limit_key, cap in limits]
+        for dbname in pending:
+            self._keys[dbname] = limits[0][1][dbname]
+            self.set_status(dbname, STATUS_PENDING)
+        results = {}
+        running = {}
+        # one count of running tasks per key of every limit
+        per_key = [{} for _ in limits]
+        last_report = time.time()
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            while pending or running:
+                for dbname in list(pending):
+                    if len(running) >= self._workers:
+                        break
+                    if any(counts.get(keys[dbname], 0) >= cap for (cap, keys), counts in zip(limits, per_key)):
+                        continue
+                    pending.remove(dbname)
+                    for (_, keys), counts in zip(limits, per_key):
+                        counts[keys[dbname]] = counts.get(keys[dbname], 0) + 1
+                    self._started[dbname] = time.time()
+                    self.set_status(dbname, STATUS_STARTED)
+                    running[executor.submit(task, dbname)] = dbname
+
+                timeout = max(0, last_report + self._report_interval - time.time())
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dbname = running.pop(future)
+                    for (_, keys), counts in zip(limits, per_key):
+                        counts[keys[dbname]] -= 1
+                    self._finished[dbname] = time.time()
+                    error = future.exception()
+                    if error is None:
+                        results[dbname] = (STATUS_DONE, None)
+                        self.set_status(dbname, STATUS_DONE)
+                    else:
+                        self._logger.error(f"{dbname} failed: {error}")
+                        results[dbname] = (STATUS_FAILED, error)
+                        self.set_status(dbname, f"{STATUS_FAILED}: {error}")
+                # tasks finishing often must not delay the report
+                if time.time() - last_report >= self._report_interval:
+                    self.report()
+                    last_report = time.time()
+
+        self.report()
+        failed = [dbname for dbname, (state, _) in results.items() if state == STATUS_FAILED]
+        self._logger.info(f"fleet finished: {len(results) - len(failed)} done, {len(failed)} failed {failed}")
+        return results
+
+    def report(self):
+        """
+        Log the status table of every database in the fleet.
+        """
+        with self._lock:
+            rows = list(self.status.items())
+        width = max([len("database")] + [len(dbname) for dbname, _ in rows])
+        lines = [f"{'database'.ljust(width)}  {'project/region'.ljust(32)}  {'elapsed':>8}  status"]
+        for dbname, status in rows:
+            project, region = self._keys.get(dbname, ("", ""))
+            started = self._started.get(dbname)
+            elapsed = f"{int(self._finished.get(dbname, time.time()) - started)}s" if started else "-"
+            lines.append(f"{dbname.ljust(width)}  {f'{project}/{region}'.ljust(32)}  {elapsed:>8}  {status}")
+        self._logger.info("fleet status:\n" + "\n".join(lines))
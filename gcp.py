@@ -1,35 +1,232 @@
+import json
 import logging
+import os
 import random
 import string
+import threading
 import time
+from concurrent.futures import Future
+from importlib.metadata import version as package_version
 
-from googleapiclient import discovery
-from googleapiclient.errors import HttpError
+from metrics import METRICS
+from policy import RetryPolicy, PollPolicy
+from poller import ResourcePoller, OperationTracker, MIGRATION_JOBS, CONNECTION_PROFILES
+from state import write_json
+
+
+# maximum number of calls in one batch request
+BATCH_SIZE = 100
+# seconds before a single http request times out, retries are governed by the RetryPolicy
+HTTP_TIMEOUT = 60
+# seconds a fetched discovery document is reused from the cache dir before it is fetched again
+DISCOVERY_MAX_AGE = 24 * 3600
 
 
 class GcpApi:
-    def __init__(self, logger=None):
-        self._dms_api = None
-        self._sqladmin_api = None
-        self._resource_manager_api = None
+    def __init__(self, logger=None, build=None, poll_interval=5, retry_policy=None, poll_policy=None,
+                 cache_dir=None):
+        """
+        :param build: callable(api, version) returning a discovery resource, defaults to one client per thread
+                      built from a shared discovery document
+        :param cache_dir: directory discovery documents fetched over the network are kept in, see
+                          `_discovery_document`
+        :param poll_interval: seconds between two polls of job, connection profile and operation states
+        :param retry_policy: RetryPolicy of every API call, defaults to RetryPolicy()
+        :param poll_policy: PollPolicy of the shared poller, defaults to PollPolicy(poll_interval)
+        """
+        # discovery clients wrap a non thread-safe httplib2 client, so every thread builds its own
+        self._local = threading.local()
+        self._build = build if build is not None else self._build_client
+        self._documents = {}
+        self._cache_dir = cache_dir
+        self._credentials = None
+        self._client_lock = threading.Lock()
         self._projects_cache = None
-        
+        self._poller = None
+        self._poller_lock = threading.Lock()
+        self._poll_interval = poll_interval
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.poll_policy = poll_policy if poll_policy is not None else PollPolicy(interval=poll_interval)
+        self.operations = OperationTracker(interval=min(2, poll_interval), logger=logger)
+
         self._logger = logging.getLogger(__name__) if not logger else logger
 
+    @property
+    def poller(self):
+        with self._poller_lock:
+            if self._poller is None:
+                self._poller = ResourcePoller(self, policy=self.poll_policy, logger=self._logger)
+        return self._poller
+
     def dms(self):
-        if self._dms_api is None:
-            self._dms_api = discovery.build('datamigration', 'v1')
-        return self._dms_api
+        return self._client('datamigration', 'v1')
 
     def sqladmin(self):
-        if self._sqladmin_api is None:
-            self._sqladmin_api = discovery.build('sqladmin', 'v1beta4')
-        return self._sqladmin_api
+        return self._client('sqladmin', 'v1beta4')
 
     def resource_api(self):
-        if self._resource_manager_api is None:
-            self._resource_manager_api = discovery.build('cloudresourcemanager', 'v1')
-        return self._resource_manager_api
+        return self._client('cloudresourcemanager', 'v1')
+
+    def _client(self, api, version):
+        clients = self._local.__dict__.setdefault('clients', {})
+        if (api, version) not in clients:
+            clients[(api, version)] = self._build(api, version)
+        return clients[(api, version)]
+
+    def _build_client(self, api, version):
+        """
+        Build a client for the calling thread, with its own authorized Http, from the discovery document
+        shared by all threads.
+        """
+        # the client libraries are imported on first use, commands that never call an API don't load them
+        import google.auth
+        import google_auth_httplib2
+        import httplib2
+        from googleapiclient import discovery
+        with self._client_lock:
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+            if (api, version) not in self._documents:
+                self._documents[(api, version)] = self._discovery_document(api, version)
+            document = self._documents[(api, version)]
+        http = google_auth_httplib2.AuthorizedHttp(self._credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        return discovery.build_from_document(document, http=http)
+
+    def _discovery_document(self, api, version):
+        """
+        :return: discovery document shipped with the client library, otherwise the one kept in the cache dir
+                 for the same library version if younger than DISCOVERY_MAX_AGE, otherwise fetched and cached
+        """
+        import httplib2
+        from googleapiclient import discovery, discovery_cache
+        document = discovery_cache.get_static_doc(api, version)
+        if document is not None:
+            return document
+        library = package_version("google-api-python-client")
+        path = None if self._cache_dir is None else os.path.join(self._cache_dir, f"{api}.{version}.json")
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            if cached["library"] == library and time.time() - cached["fetched_at"] < DISCOVERY_MAX_AGE:
+                return cached["document"]
+        except (TypeError, FileNotFoundError, ValueError, KeyError):
+            pass
+        uri = discovery.V2_DISCOVERY_URI.format(api=api, apiVersion=version)
+        response, content = httplib2.Http(timeout=HTTP_TIMEOUT).request(uri)
+        if response.status >= 400:
+            raise Exception(f"unable to fetch discovery document for {api} {version}: {response.status}")
+        document = content.decode("utf-8")
+        if path is not None:
+            write_json(path, {"library": library, "fetched_at": time.time(), "document": document})
+        return document
+
+    def _execute(self, request, deadline=None):
+        """
+        Execute a request under the retry policy: quota and transient errors are retried with jittered
+        backoff until the deadline of the call.
+        :param deadline: seconds the call may take, retries included, defaults to the policy deadline
+        :return: response of the request
+        """
+        method = getattr(request, 'methodId', None) or 'batch'
+
+        def attempt():
+            METRICS.inc("gcp_api_calls_total", method=method)
+            with METRICS.timer("gcp_api_call_seconds", method=method):
+                return request.execute()
+
+        def on_retry(attempt, error, delay):
+            METRICS.inc("gcp_api_retries_total", method=method)
+            self._logger.debug(f"retrying {getattr(request, 'uri', request)} in {delay:.1f}s "
+                               f"(attempt {attempt}): {error}")
+
+        return self.retry_policy.call(attempt, method=getattr(request, 'method', None),
+                                      deadline=deadline, on_retry=on_retry)
+
+    def batch_execute(self, client, requests):
+        """
+        Execute many requests of one api with batch requests of up to BATCH_SIZE calls.
+        Calls of a batch that failed with a retryable error are sent again in the next batch, with backoff.
+        :param client: discovery client of the api, e.g. self.dms()
+        :param requests: dict of key to HttpRequest
+        :return: dict of key to (response, exception)
+        """
+        keys = list(requests)
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[keys[int(request_id)]] = (response, exception)
+
+        pending = list(range(len(keys)))
+        attempt = 0
+        while pending:
+            for start in range(0, len(pending), BATCH_SIZE):
+                batch = client.new_batch_http_request(callback=callback)
+                for index in pending[start:start + BATCH_SIZE]:
+                    batch.add(requests[keys[index]], request_id=str(index))
+                self._execute(batch)
+            attempt += 1
+            retry = [index for index in pending if self.retry_policy.retryable(
+                results[keys[index]][1], getattr(requests[keys[index]], 'method', None))]
+            if not retry or attempt >= self.retry_policy.max_attempts:
+                break
+            delay = max(self.retry_policy.delay(attempt, results[keys[index]][1]) for index in retry)
+            METRICS.inc("gcp_api_retries_total", len(retry), method='batch')
+            self._logger.debug(f"retrying {len(retry)} calls of a batch in {delay:.1f}s (attempt {attempt})")
+            time.sleep(delay)
+            pending = retry
+        return results
+
+    def get_migration_jobs(self, names):
+        """
+        :param names: migration job names, projects/{project}/locations/{region}/migrationJobs/{id}
+        :return: dict of name to migration job body, None if not found, and dict of name to the error of the
+                 other reads that failed
+        """
+        jobs = self.dms().projects().locations().migrationJobs()
+        results = self.batch_execute(self.dms(), {name: jobs.get(name=name) for name in names})
+        errors = {name: exception for name, (_, exception) in results.items()
+                  if exception is not None and not _not_found(exception)}
+        return {name: response for name, (response, _) in results.items() if name not in errors}, errors
+
+    def delete_dms_resources(self, names):
+        """
+        Delete many migration jobs and/or connection profiles with batch requests.
+        :param names: resource names, projects/{project}/locations/{region}/{migrationJobs|connectionProfiles}/{id}
+        :return: dict of name to Future of the delete operation
+        """
+        locations = self.dms().projects().locations()
+        requests = {name: (locations.migrationJobs() if "/migrationJobs/" in name else locations.connectionProfiles())
+                    .delete(name=name) for name in names}
+        # operations are polled from the tracker thread, so the client is resolved there
+        return {name: self._operation_future(
+                    exception,
+                    lambda op: self._execute(self.dms().projects().locations().operations().get(name=op['name'])),
+                    response)
+                for name, (response, exception) in self.batch_execute(self.dms(), requests).items()}
+
+    def delete_cloudsql_instances(self, instances):
+        """
+        Delete many cloud SQL instances with batch requests.
+        :param instances: list of (project_id, instance)
+        :return: dict of (project_id, instance) to Future of the delete operation
+        """
+        requests = {key: self.sqladmin().instances().delete(project=key[0], instance=key[1]) for key in instances}
+        return {key: self._operation_future(
+                    exception,
+                    lambda op, project=key[0]: self._execute(
+                        self.sqladmin().operations().get(project=project, operation=op['name'])),
+                    response, timeout=600)
+                for key, (response, exception) in self.batch_execute(self.sqladmin(), requests).items()}
+
+    def _operation_future(self, exception, get_op, op, timeout=120):
+        """
+        :return: Future of a started operation, failed right away if starting it failed
+        """
+        if exception is not None:
+            future = Future()
+            future.set_exception(exception)
+            return future
+        return self._await_operation(lambda: get_op(op), timeout=timeout, wait=False)
 
     def get_dms_status(self, project_id, region_id, migration_job_id):
         """
@@ -39,8 +236,8 @@ class GcpApi:
         :return: None if not found. dict of state, status, and error (if error was present)
         """
         try:
-            body = self.dms().projects().locations().migrationJobs().get(
-                name=f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}").execute()
+            body = self._execute(self.dms().projects().locations().migrationJobs().get(
+                name=f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}"))
             res = {
                 "state": body.get("state"),
                 "phase": body.get("phase"),
@@ -55,8 +252,8 @@ class GcpApi:
 
     def promote_dms_job(self, project_id, region_id, migration_job_id):
         try:
-            self.dms().projects().locations().migrationJobs().promote(
-                name=f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}").execute()
+            self._execute(self.dms().projects().locations().migrationJobs().promote(
+                name=f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}"))
         except Exception as error:
             self._logger.warning(f"failed to promote dms job {project_id}/{migration_job_id}: {error}")
             raise error
@@ -65,38 +262,42 @@ class GcpApi:
             # side effect: logs the state of the DMS job
             self.get_dms_status(project_id, region_id, migration_job_id)
 
-    def delete_dms_job(self, project_id, region_id, migration_job_id):
+    def delete_dms_job(self, project_id, region_id, migration_job_id, wait=True):
         """
+        :param wait: block until the operation is done, otherwise return a Future of it
         :return: Operation object
         """
         name = f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}"
-        op = self.dms().projects().locations().migrationJobs().delete(name=name).execute()
-        self._await_operation(lambda: self.dms().projects().locations().operations().get(name=op['name']).execute())
+        op = self._execute(self.dms().projects().locations().migrationJobs().delete(name=name))
+        return self._await_operation(
+            lambda: self._execute(self.dms().projects().locations().operations().get(name=op['name'])), wait=wait)
 
-    def delete_dms_connection_profile(self, name):
+    def delete_dms_connection_profile(self, name, wait=True):
         """
         :param name:  projects/{projectId}/locations/{region}/connectionProfiles/{name}
+        :param wait: block until the operation is done, otherwise return a Future of it
         """
-        op = self.dms().projects().locations().connectionProfiles().delete(name=name).execute()
-        self._await_operation(lambda: self.dms().projects().locations().operations().get(name=op['name']).execute())
+        op = self._execute(self.dms().projects().locations().connectionProfiles().delete(name=name))
+        return self._await_operation(
+            lambda: self._execute(self.dms().projects().locations().operations().get(name=op['name'])), wait=wait)
 
     def get_cloudsql_instance_name(self, project_id=None, region_id=None, migration_job_id=None):
         """
         :return: cloudSQL instance name for job or None if not exists
         """
         try:
-            response = self.dms().projects().locations(). \
-                migrationJobs().get(
-                name=f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}").execute()
+            response = self._execute(self.dms().projects().locations().migrationJobs().get(
+                name=f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}"))
             return response["destination"].split("/")[-1]
         except Exception as error:
             #self._logger.debug(f"failed to get gcp instance name for dms job {project_id}/{migration_job_id}, {error}")
             return None
 
     def check_connection_profile_state(self, project_id, region_id, connection_profile_id):
+        from googleapiclient.errors import HttpError
         profile_path = f"projects/{project_id}/locations/{region_id}/connectionProfiles/{connection_profile_id}"
         try:
-            response = self.dms().projects().locations().connectionProfiles().get(name=profile_path).execute()
+            response = self._execute(self.dms().projects().locations().connectionProfiles().get(name=profile_path))
             return response.get("state")
         except HttpError as error:
             pass
@@ -120,25 +321,25 @@ class GcpApi:
         if self.check_connection_profile_state(project_id, region_id, connection_profile_id) != 'NOT_EXISTS':
             self._logger.info("connection profile is going to be updated")
             update_mask = "postgresql.host,postgresql.port,postgresql.username,postgresql.password"
-            self.dms().projects().locations().connectionProfiles().patch(name=profile_path, updateMask=update_mask,
-                                                                         body=request_body).execute()
+            self._execute(self.dms().projects().locations().connectionProfiles().patch(
+                name=profile_path, updateMask=update_mask, body=request_body))
         else:
             self._logger.info("connection profile is going to be created")
             try:
-                self.dms().projects().locations().connectionProfiles().create(
+                self._execute(self.dms().projects().locations().connectionProfiles().create(
                     parent=f"projects/{project_id}/locations/{region_id}",
                     connectionProfileId=connection_profile_id,
-                    body=request_body).execute()
+                    body=request_body))
                 self._logger.info(f"await connection profile {connection_profile_id} to be READY")
 
-                sleep_time = 0.1
-                state = None
-                while state != "READY":
-                    state = self.check_connection_profile_state(project_id, region_id, connection_profile_id)
+                def is_ready(body):
+                    state = body.get("state") if body else None
                     self._logger.debug(f'await connection profile {connection_profile_id} to be READY. Current: {state}')
-                    time.sleep(sleep_time)
-                    sleep_time = min(sleep_time * 2, 10)
+                    if state == "FAILED":
+                        raise Exception(f"connection profile {connection_profile_id} FAILED: {body.get('error')}")
+                    return state == "READY"
 
+                self.await_connection_profile(project_id, region_id, connection_profile_id, is_ready)
                 self._logger.info(f"connection profile {connection_profile_id} is READY")
             except Exception as error:
                 raise Exception(f"failed to create connection profile for {connection_profile_id}", error)
@@ -146,50 +347,101 @@ class GcpApi:
     def create_migration_job(self, project_id, region_id, migration_job_id, request_body):
         dms_job_path = f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}"
         try:
-            self.dms().projects().locations().migrationJobs().get(name=dms_job_path).execute()
+            self._execute(self.dms().projects().locations().migrationJobs().get(name=dms_job_path))
         except:
             try:
-                self.dms().projects().locations().migrationJobs().create(
+                self._execute(self.dms().projects().locations().migrationJobs().create(
                     parent="projects/{}/locations/{}".format(project_id, region_id),
                     migrationJobId=migration_job_id,
-                    body=request_body).execute()
+                    body=request_body))
                 self._logger.info("Waiting for DMS Job: {} to be READY".format(migration_job_id))
-                sleep_time = 0.1
-                state = ''
-                while state != 'NOT_STARTED':
-                    time.sleep(sleep_time)
-                    sleep_time = min(1, sleep_time * 2)
-                    response = self.dms().projects().locations().migrationJobs().get(name=dms_job_path).execute()
-                    state = response.get('state')
+                self.await_migration_job(project_id, region_id, migration_job_id,
+                                         lambda body: body is not None and body.get('state') == 'NOT_STARTED')
             except Exception as error:
                 raise Exception("Cannot CREATE migration job for {}: {}".format(dms_job_path, error))
 
-    def start_migration_job(self, project_id, region_id, migration_job_id):
+    def start_migration_job(self, project_id, region_id, migration_job_id, timeout=None):
+        """
+        Start a migration job as soon as it is NOT_STARTED (it may still be CREATING, or not listed yet) and
+        block until it is RUNNING.
+        :param timeout: seconds to wait for RUNNING, defaults to no limit
+        """
         dms_job_path = f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}"
-        try:
-            sleep_time = 0.1
-            state = ''
-            while state != 'RUNNING':
-                response = self.dms().projects().locations().migrationJobs().get(name=dms_job_path).execute()
-                state = response.get("state")
-                # see: https://cloud.google.com/database-migration/docs/reference/rest/v1/projects.locations.migrationJobs#State
-                if state == "NOT_STARTED":
-                    self.dms().projects().locations().migrationJobs().start(name=dms_job_path).execute()
+        def is_running(response):
+            state = response.get("state") if response else None
+            # see: https://cloud.google.com/database-migration/docs/reference/rest/v1/projects.locations.migrationJobs#State
+            if state == "NOT_STARTED":
+                # sent again on every poll that still lists the job as not started
+                try:
+                    self._execute(self.dms().projects().locations().migrationJobs().start(name=dms_job_path))
                     self._logger.info(f"Started DMS Job: {migration_job_id}, await RUNNING")
-                elif state == 'FAILED':
-                    raise Exception(f"failed start migration job: '{response.get('error').get('message')}'")
-                elif state == "COMPLETED":
-                    raise Exception(f"failed start migration job: already completed")
-                sleep_time = min(1, sleep_time * 2)
-                time.sleep(sleep_time)
+                except Exception as error:
+                    self._logger.warning(f"failed to start DMS Job: {migration_job_id}, retrying: {error}")
+            elif state == 'FAILED':
+                raise Exception(f"failed start migration job: '{response.get('error', {}).get('message')}'")
+            elif state == "COMPLETED":
+                raise Exception("failed start migration job: already completed")
+            return state == 'RUNNING'
+
+        try:
+            self.await_migration_job(project_id, region_id, migration_job_id, is_running, timeout=timeout)
 
             self._logger.info("DMS Job: {} is RUNNING".format(migration_job_id))
         except Exception as error:
             raise Exception("Cannot START migration job for {}: {}".format(dms_job_path, error))
 
-    def delete_cloudsql_instance(self, project_id, instance):
-        op = self.sqladmin().instances().delete(project=project_id, instance=instance).execute()
-        self._await_operation(lambda: self.sqladmin().operations().get(project=project_id, operation=op['name']).execute())
+    def list_migration_jobs(self, parent):
+        """
+        :param parent: projects/{project}/locations/{region}
+        :return: dict of migration job name to migration job body
+        """
+        jobs = {}
+        request = self.dms().projects().locations().migrationJobs().list(parent=parent)
+        while request is not None:
+            response = self._execute(request)
+            jobs.update({job["name"]: job for job in response.get("migrationJobs", [])})
+            request = self.dms().projects().locations().migrationJobs().list_next(request, response)
+        return jobs
+
+    def list_connection_profiles(self, parent):
+        """
+        :param parent: projects/{project}/locations/{region}
+        :return: dict of connection profile name to connection profile body
+        """
+        profiles = {}
+        request = self.dms().projects().locations().connectionProfiles().list(parent=parent)
+        while request is not None:
+            response = self._execute(request)
+            profiles.update({profile["name"]: profile for profile in response.get("connectionProfiles", [])})
+            request = self.dms().projects().locations().connectionProfiles().list_next(request, response)
+        return profiles
+
+    def await_migration_job(self, project_id, region_id, migration_job_id, predicate, timeout=None):
+        """
+        Block on the shared poller until predicate(job body) is true.
+        :return: migration job body
+        """
+        name = f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}"
+        with METRICS.timer("await_seconds", kind=MIGRATION_JOBS):
+            return self.poller.wait_for(MIGRATION_JOBS, name, predicate, timeout=timeout)
+
+    def await_connection_profile(self, project_id, region_id, connection_profile_id, predicate, timeout=None):
+        """
+        Block on the shared poller until predicate(connection profile body) is true.
+        :return: connection profile body
+        """
+        name = f"projects/{project_id}/locations/{region_id}/connectionProfiles/{connection_profile_id}"
+        with METRICS.timer("await_seconds", kind=CONNECTION_PROFILES):
+            return self.poller.wait_for(CONNECTION_PROFILES, name, predicate, timeout=timeout)
+
+    def delete_cloudsql_instance(self, project_id, instance, wait=True):
+        """
+        :param wait: block until the operation is done, otherwise return a Future of it
+        """
+        op = self._execute(self.sqladmin().instances().delete(project=project_id, instance=instance))
+        return self._await_operation(
+            lambda: self._execute(self.sqladmin().operations().get(project=project_id, operation=op['name'])),
+            timeout=600, wait=wait)
 
     def create_cloudsql_user(self, project_id, instance, username, password=None):
         """
@@ -197,8 +449,8 @@ class GcpApi:
         """
         if password is None:
             password = ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(12))
-        self.sqladmin().users().insert(project=project_id, instance=instance,
-                                       body={"name": username, "password": password}).execute()
+        self._execute(self.sqladmin().users().insert(project=project_id, instance=instance,
+                                                     body={"name": username, "password": password}))
         return password
 
     def get_cloudsql_host(self, project=None, instance=None):
@@ -206,7 +458,7 @@ class GcpApi:
         :return: ip address of the given cloudSQL instance
         """
         try:
-            response = self.sqladmin().instances().get(project=project, instance=instance).execute()
+            response = self._execute(self.sqladmin().instances().get(project=project, instance=instance))
             for address in response.get("ipAddresses"):
                 if address.get("type") == "PRIMARY":
                     return address.get("ipAddress")
@@ -216,25 +468,26 @@ class GcpApi:
 
     def list_projects(self):
         if self._projects_cache is None:
-            result = self.resource_api().projects().list().execute().get("projects")
+            result = self._execute(self.resource_api().projects().list()).get("projects")
             self._projects_cache = {project.get("name"): project for project in result}
             self._logger.debug(f"discovered project names: {str(list(self._projects_cache.keys()))}")
         return self._projects_cache
 
-    def _await_operation(self, get_op):
-        timeout = 120
-        start_time = time.time()
-
-        def is_done(op):
-            if 'done' in op:
-                return op['done']
-            if 'status' in op:
-                return op['status'] == 'DONE'
-            raise Exception(f"unable to get status of op: {list(op.keys())}")
-
-        operation = {'status': 'x'}
-        while is_done(operation) and time.time() - start_time < timeout:
-            operation = get_op()
-            time.sleep(1)
-        if is_done(operation):
-            raise Exception(f"operation {operation['name']} did not complete: {operation['status']}")
+    def _await_operation(self, get_op, timeout=120, wait=True):
+        """
+        Track an operation on the shared operation tracker.
+        :param wait: block until the operation is done, otherwise return a Future of it
+        :return: finished operation body, or Future of it
+        """
+        future = self.operations.track(get_op, timeout=timeout)
+        started = time.time()
+        future.add_done_callback(lambda _: METRICS.observe("await_seconds", time.time() - started, kind="operations"))
+        return future.result() if wait else future
+
+
+def _not_found(error):
+    """
+    :return: True if an API error means the resource does not exist
+    """
+    from googleapiclient.errors import HttpError
+    return isinstance(error, HttpError) and error.resp.status == 404
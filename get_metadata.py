@@ -1,31 +1,194 @@
 #from pgdb import connect
 import re
+import logging
 import psycopg2
 import os
+import threading
+from contextlib import contextmanager
 from queue import Queue
 from threading import Thread
-from get_metadata_sql import SQL_TO_GET_DATABASES, SQL_TO_GET_SCHEMAS, SQL_TO_GET_TABLES
-import pandas as pd 
-import numpy as np
-
-def get_percentage_migrated(str_con_src, str_con_dst):
-    src = GetTables(str_con_src)
-    dst = GetTables(str_con_dst)
-    print("comparing sizes")
-    pd_tables = pd.DataFrame(src.list_table).merge(pd.DataFrame(dst.list_table),
-                    on=["database","schema","table"])
-    pd_tables["size_y"]= np.where(pd_tables["size_y"] > pd_tables["size_x"],
-                     pd_tables["size_x"], pd_tables["size_y"])
-    percentage_migrated = sum(pd_tables["size_y"])/sum(pd_tables["size_x"]) * 100
-    return percentage_migrated
+from metrics import METRICS
+from get_metadata_sql import SQL_TO_GET_DATABASES, SQL_TO_GET_SCHEMAS, SQL_TO_GET_TABLES_CATALOG, \
+    SQL_TO_GET_TABLES_CATALOG_LEGACY, SQL_TO_GET_CATALOG_FINGERPRINT
+
+DEFAULT_WORKERS = 8
+
+logger = logging.getLogger(__name__)
+
+
+TABLE_KEYS = ["database", "schema", "table"]
+
+
+def get_percentage_migrated(str_con_src, str_con_dst, workers=DEFAULT_WORKERS):
+    return get_migration_breakdown(str_con_src, str_con_dst, workers)["percentage"]
+
+
+def get_migration_breakdown(str_con_src, str_con_dst, workers=DEFAULT_WORKERS):
+    """
+    :return: see compare_sizes
+    """
+    def scan(str_con):
+        with GetTables(str_con, workers=workers) as tables:
+            return tables
+
+    src, dst = parallel_map(scan, [str_con_src, str_con_dst], workers=2)
+    logger.info("comparing sizes")
+    return compare_sizes(src.table_frame(), dst.table_frame())
+
+
+def compare_sizes(src_frame, dst_frame):
+    """
+    Compare the table sizes of source and destination. Tables missing on the destination count as 0% copied,
+    tables only present on the destination are ignored, and the copied size of a table is capped by its source size.
+    :param src_frame: GetTables.table_frame() of the source
+    :param dst_frame: GetTables.table_frame() of the destination
+    :return: dict of overall percentage and per table, schema and database DataFrames
+             with columns size_src, size_dst (copied bytes) and percentage
+    """
+    import numpy as np
+    import pandas as pd
+    from pandas.api.types import union_categoricals
+    src_frame, dst_frame = src_frame.copy(), dst_frame.copy()
+    for key in TABLE_KEYS:
+        # shared categories keep the keys categorical through concat
+        categories = union_categoricals([src_frame[key], dst_frame[key]]).categories
+        src_frame[key] = src_frame[key].cat.set_categories(categories)
+        dst_frame[key] = dst_frame[key].cat.set_categories(categories)
+    frame = pd.concat([src_frame.rename(columns={"size": "size_src"}).assign(size_dst=0, in_src=1),
+                       dst_frame.rename(columns={"size": "size_dst"}).assign(size_src=0, in_src=0)],
+                      ignore_index=True)
+    tables = frame.groupby(TABLE_KEYS, observed=True, sort=False)[["size_src", "size_dst", "in_src"]].sum()
+    tables = tables[tables["in_src"].to_numpy() > 0].drop(columns="in_src")
+    tables["size_dst"] = np.minimum(tables["size_dst"].to_numpy(), tables["size_src"].to_numpy())
+
+    def with_percentage(sizes):
+        sizes = sizes.copy()
+        sizes["percentage"] = np.where(sizes["size_src"] > 0,
+                                       sizes["size_dst"] / sizes["size_src"].where(sizes["size_src"] > 0, 1) * 100,
+                                       100.0)
+        return sizes
+
+    size_src = int(tables["size_src"].sum())
+    return {
+        "percentage": tables["size_dst"].sum() / size_src * 100 if size_src else 100.0,
+        "tables": with_percentage(tables),
+        "schemas": with_percentage(tables.groupby(level=["database", "schema"], observed=True).sum()),
+        "databases": with_percentage(tables.groupby(level="database", observed=True).sum()),
+    }
+
+
+def parse_connection_string(str_connection):
+    """
+    :param str_connection: host:port:user:password
+    :return: dict of psycopg2 connection arguments
+    """
+    host, port, user, password = str_connection.split(":", 3)
+    return {"host": host, "port": port, "user": user, "password": password}
+
+
+def parallel_map(func, items, workers=DEFAULT_WORKERS):
+    """
+    Apply func to every item on a pool of worker threads.
+    :return: list of results in the order of items; the first error is raised once all workers stopped
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    queue = Queue()
+    for index, item in enumerate(items):
+        queue.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except Exception:
+                return
+            try:
+                results[index] = func(item)
+            except Exception as error:
+                errors.append(error)
+
+    threads = [Thread(target=worker, daemon=True) for _ in range(max(1, min(workers, len(items))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+class ConnectionPool:
+    """
+    Reusable psycopg2 connections to every database of one host, at most `maxconn` per database.
+    A thread asking for a database whose connections are all in use blocks until one is returned.
+    """
+    def __init__(self, str_connection, maxconn=1, connect_timeout=3):
+        self._params = parse_connection_string(str_connection)
+        self._maxconn = maxconn
+        self._connect_timeout = connect_timeout
+        self._idle = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def connection(self, database):
+        with self._lock:
+            if self._closed:
+                raise Exception(f"connection pool for {self._params['host']} is closed")
+            slots = self._slots.setdefault(database, threading.BoundedSemaphore(self._maxconn))
+        slots.acquire()
+        conn = None
+        try:
+            with self._lock:
+                idle = self._idle.setdefault(database, [])
+                conn = idle.pop() if idle else None
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(dbname=database, connect_timeout=self._connect_timeout, **self._params)
+                conn.autocommit = True
+            yield conn
+        except Exception:
+            if conn is not None and not conn.closed:
+                conn.close()
+            raise
+        finally:
+            if conn is not None and not conn.closed:
+                if not conn.autocommit:
+                    conn.rollback()
+                with self._lock:
+                    if self._closed:
+                        conn.close()
+                    else:
+                        self._idle[database].append(conn)
+            slots.release()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
 
 
 class GetTables:
-    def __init__(self,str_connection="localhost:5432:postgres:postgres"):
-        self.host = str_connection.split(":")[0]
-        self.port = str_connection.split(":")[1]
-        self.user = str_connection.split(":")[2]
-        self.password = str_connection.split(":")[3]
+    def __init__(self,str_connection="localhost:5432:postgres:postgres", workers=DEFAULT_WORKERS, pool=None,
+                 discover=True, include_toast=False, include_indexes=False):
+        """
+        :param include_toast: add the size of the TOAST relation to the size of each table
+        :param include_indexes: add the size of the indexes to the size of each table
+        """
+        params = parse_connection_string(str_connection)
+        self.host = params["host"]
+        self.port = params["port"]
+        self.user = params["user"]
+        self.password = params["password"]
+        self.workers = workers
+        self.include_toast = include_toast
+        self.include_indexes = include_indexes
+        self.pool = ConnectionPool(str_connection) if pool is None else pool
         self.exclusion_list_database = [
             "template1", "template0", "rdsadmin", "cloudsqladmin"
         ]
@@ -33,46 +196,115 @@ class GetTables:
             "pg_temp_1", "pg_toast_temp_1", "pg_catalog", "information_schema",
             "pglogical"
         ]
-        print(f"getting databases for {self.host}")
-        self.get_databases()
-        print(f"getting tables for {self.host}")
-        self.get_tables()
+        self.list_database = []
+        self.list_schema = []
+        self.table_rows = []
+        if not discover:
+            return
+        try:
+            logger.info(f"getting databases for {self.host}")
+            self.get_databases()
+            logger.info(f"getting tables for {self.host}")
+            self.get_tables()
+        except Exception:
+            self.close()
+            raise
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+    def close(self):
+        self.pool.close()
+    @property
+    def list_table(self):
+        return [{
+            "database": db,
+            "schema": schema,
+            "table": table,
+            "size": size
+        } for db, schema, table, _, _, size in self.table_rows]
+    def table_frame(self):
+        """
+        :return: DataFrame of database, schema, table and size with categorical keys,
+                 partitions are rolled up into their root partitioned table
+        """
+        # pandas is only loaded by the commands comparing sizes
+        import numpy as np
+        import pandas as pd
+        parents = {(db, schema, table): (db, parent_schema, parent_table)
+                   for db, schema, table, parent_schema, parent_table, _ in self.table_rows if parent_table is not None}
+
+        def root(key):
+            while key in parents:
+                key = parents[key]
+            return key
+
+        columns = list(zip(*[root((db, schema, table)) + (size,) for db, schema, table, _, _, size in self.table_rows]))
+        if not columns:
+            columns = [[], [], [], []]
+        return pd.DataFrame({
+            "database": pd.Categorical(columns[0]),
+            "schema": pd.Categorical(columns[1]),
+            "table": pd.Categorical(columns[2]),
+            "size": np.asarray(columns[3], dtype=np.int64),
+        })
     def get_databases(self):
-        cur = self.connect_to_db("postgres").cursor()
-        cur.execute(SQL_TO_GET_DATABASES)
-        self.list_database = [
-            _[0] for _ in cur.fetchall()
-            if _[0] not in self.exclusion_list_database
-        ]
-        cur.close()
+        with self.pool.connection("postgres") as conn, conn.cursor() as cur, \
+                METRICS.timer("metadata_query_seconds", query="databases", host=self.host):
+            cur.execute(SQL_TO_GET_DATABASES)
+            self.list_database = [
+                _[0] for _ in cur.fetchall()
+                if _[0] not in self.exclusion_list_database
+            ]
     def get_tables(self):
         self.list_schema = []
-        self.list_table = []
-        for db in self.list_database:
-            cur = self.connect_to_db(db).cursor()
-            cur.execute(SQL_TO_GET_SCHEMAS)
+        self.table_rows = []
+        for list_schema, table_rows in parallel_map(self.get_tables_of_database, self.list_database, self.workers):
+            self.list_schema.extend(list_schema)
+            self.table_rows.extend(table_rows)
+    def get_tables_of_database(self, db):
+        with self.pool.connection(db) as conn, conn.cursor() as cur:
+            with METRICS.timer("metadata_query_seconds", query="schemas", host=self.host):
+                cur.execute(SQL_TO_GET_SCHEMAS)
             list_schema = [{
                 "database": db,
                 "schema": _[0]
             } for _ in cur.fetchall()
                         if _[0] not in self.exclusion_list_schema]
-            self.list_schema.extend(list_schema)
-
-            list_schema_str = ",".join(
-                [f"'{ _['schema'] }'" for _ in list_schema])
-            cur.execute(SQL_TO_GET_TABLES.format(list_schema_str))
-            list_table = [{
-                "database": db,
-                "schema": _[0],
-                "table": _[1],
-                "size": _[2]
-            } for _ in cur.fetchall()]
-            self.list_table.extend(list_table)
-    def connect_to_db(self, database):
-        conn = psycopg2.connect(dbname=database,
-                                host=self.host,
-                                user=self.user,
-                                password=self.password,
-                                port=self.port,
-                                connect_timeout=3)
-        return conn
+            table_rows = self._query_table_sizes(cur, db, list_schema)
+        return list_schema, table_rows
+    def sample_sizes(self):
+        """
+        Re-read the size of every table of the already discovered databases and schemas.
+        """
+        def sample(db):
+            list_schema = [_ for _ in self.list_schema if _["database"] == db]
+            with self.pool.connection(db) as conn, conn.cursor() as cur:
+                return self._query_table_sizes(cur, db, list_schema)
+        self.table_rows = [_ for table_rows in parallel_map(sample, self.list_database, self.workers) for _ in table_rows]
+        return self.list_table
+    def fingerprint(self):
+        """
+        :return: dict of database to a hash of its table catalog, changes when tables are created, dropped or renamed
+        """
+        with self.pool.connection("postgres") as conn, conn.cursor() as cur:
+            cur.execute(SQL_TO_GET_DATABASES)
+            list_database = [_[0] for _ in cur.fetchall() if _[0] not in self.exclusion_list_database]
+        def fingerprint_of_database(db):
+            with self.pool.connection(db) as conn, conn.cursor() as cur, \
+                    METRICS.timer("metadata_query_seconds", query="fingerprint", host=self.host):
+                cur.execute(SQL_TO_GET_CATALOG_FINGERPRINT)
+                return cur.fetchone()[0]
+        return dict(zip(list_database, parallel_map(fingerprint_of_database, list_database, self.workers)))
+    def _query_table_sizes(self, cur, db, list_schema):
+        """
+        :return: list of (database, schema, table, parent schema, parent table, size)
+        """
+        if not list_schema:
+            return []
+        with METRICS.timer("metadata_query_seconds", query="table_sizes", host=self.host):
+            query = SQL_TO_GET_TABLES_CATALOG if cur.connection.server_version >= 100000 \
+                else SQL_TO_GET_TABLES_CATALOG_LEGACY
+            cur.execute(query, {"schemas": [_["schema"] for _ in list_schema],
+                                "toast": self.include_toast, "indexes": self.include_indexes})
+            return [(db,) + row for row in cur.fetchall()]
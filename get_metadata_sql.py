@@ -7,22 +7,210 @@ SQL_TO_GET_TABLES = """SELECT table_schema, table_name, pg_relation_size('"'||ta
 FROM information_schema.tables 
 where table_type='BASE TABLE' and table_schema in ({}) order by 1,2"""
 
+# catalog level alternative to SQL_TO_GET_TABLES: sizes by oid, parameters (schemas, toast, indexes) are bound.
+# partitions also return the schema and name of their direct parent
+SQL_TO_GET_TABLES_CATALOG = """SELECT n.nspname, c.relname, pn.nspname, p.relname,
+       pg_relation_size(c.oid)
+       + CASE WHEN %(toast)s AND c.reltoastrelid <> 0 THEN pg_total_relation_size(c.reltoastrelid) ELSE 0 END
+       + CASE WHEN %(indexes)s THEN pg_indexes_size(c.oid) ELSE 0 END size
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_catalog.pg_inherits i ON i.inhrelid = c.oid AND c.relispartition
+LEFT JOIN pg_catalog.pg_class p ON p.oid = i.inhparent
+LEFT JOIN pg_catalog.pg_namespace pn ON pn.oid = p.relnamespace
+WHERE c.relkind IN ('r', 'p') AND c.relpersistence <> 't' AND n.nspname = ANY(%(schemas)s)
+ORDER BY 1, 2"""
+# before PostgreSQL 10 there are no partitions (relispartition), no table has a parent
+SQL_TO_GET_TABLES_CATALOG_LEGACY = """SELECT n.nspname, c.relname, NULL, NULL,
+       pg_relation_size(c.oid)
+       + CASE WHEN %(toast)s AND c.reltoastrelid <> 0 THEN pg_total_relation_size(c.reltoastrelid) ELSE 0 END
+       + CASE WHEN %(indexes)s THEN pg_indexes_size(c.oid) ELSE 0 END size
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'r' AND c.relpersistence <> 't' AND n.nspname = ANY(%(schemas)s)
+ORDER BY 1, 2"""
+
+SQL_TO_GET_CATALOG_FINGERPRINT = """SELECT md5(coalesce(string_agg(c.oid::text || ':' || c.relnamespace::text || ':' || c.relname, ',' ORDER BY c.oid), ''))
+FROM pg_catalog.pg_class c
+WHERE c.relkind IN ('r', 'p')"""
+
+# functions and procedures of the given schemas with their identity arguments, except aggregates (which
+# pg_get_functiondef can't print) and the members of extensions
 SQL_TO_GET_FUNCTIONS = """select n.nspname as function_schema,
-       p.proname as function_name,
+       p.proname || '(' || pg_get_function_identity_arguments(p.oid) || ')' as function_name,
        case when l.lanname = 'internal' then p.prosrc
             else pg_get_functiondef(p.oid)
             end as definition
 from pg_proc p
 left join pg_namespace n on p.pronamespace = n.oid
 left join pg_language l on p.prolang = l.oid
-where n.nspname in ({})
+where n.nspname = ANY(%s)
+  and not exists (select 1 from pg_aggregate a where a.aggfnoid = p.oid)
+  and not exists (select 1 from pg_depend d where d.classid = 'pg_proc'::regclass and d.objid = p.oid
+                                              and d.deptype = 'e')
 order by function_schema,
          function_name;"""
 
-SQL_TO_GET_VIEWS = """select table_schema as schema_name,
-       table_name as view_name,
-       view_definition
-from information_schema.views
-where table_schema in ({})
+# read from pg_catalog: information_schema only lists the objects the user has a privilege on, and leaves the
+# definition of a view NULL for any user but its owner
+SQL_TO_GET_VIEWS = """select n.nspname as schema_name,
+       c.relname as view_name,
+       pg_get_viewdef(c.oid) as view_definition
+from pg_catalog.pg_class c
+join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+where c.relkind = 'v'
+  and n.nspname = ANY(%s)
 order by schema_name,
-         view_name;"""
\ No newline at end of file
+         view_name;"""
+
+SQL_TO_GET_SEQUENCES = """SELECT n.nspname, c.relname,
+       concat_ws(' ', format_type(s.seqtypid, NULL), s.seqstart, s.seqmin, s.seqmax, s.seqincrement,
+                 CASE WHEN s.seqcycle THEN 'YES' ELSE 'NO' END)
+FROM pg_catalog.pg_sequence s
+JOIN pg_catalog.pg_class c ON c.oid = s.seqrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = ANY(%s)"""
+# pg_sequence is new in PostgreSQL 10, before it the parameters are only in each sequence relation
+SQL_TO_GET_SEQUENCES_LEGACY = """SELECT sequence_schema, sequence_name,
+       concat_ws(' ', data_type, start_value, minimum_value, maximum_value, increment, cycle_option)
+FROM information_schema.sequences WHERE sequence_schema = ANY(%s)"""
+
+SQL_TO_GET_INDEXES = """SELECT schemaname, indexname, indexdef FROM pg_catalog.pg_indexes WHERE schemaname = ANY(%s)"""
+
+SQL_TO_GET_CONSTRAINTS = """SELECT n.nspname, c.relname || '.' || con.conname, pg_get_constraintdef(con.oid)
+FROM pg_catalog.pg_constraint con
+JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = ANY(%s)"""
+
+# hash of the user objects of the catalogs the schema diff reads, changes when an object is created, dropped or
+# altered (a new row version). Temporary relations are left out
+SQL_TO_GET_SCHEMA_FINGERPRINT = """SELECT md5(coalesce(string_agg(k, ',' ORDER BY k), '')) FROM (
+    SELECT 'c' || oid::text || ':' || xmin::text k FROM pg_catalog.pg_class WHERE oid >= 16384 AND relpersistence <> 't'
+    UNION ALL SELECT 'p' || oid::text || ':' || xmin::text FROM pg_catalog.pg_proc WHERE oid >= 16384
+    UNION ALL SELECT 'r' || oid::text || ':' || xmin::text FROM pg_catalog.pg_rewrite WHERE oid >= 16384
+    UNION ALL SELECT 'o' || oid::text || ':' || xmin::text FROM pg_catalog.pg_constraint WHERE oid >= 16384
+    UNION ALL SELECT 'e' || oid::text || ':' || xmin::text FROM pg_catalog.pg_extension
+    UNION ALL SELECT 's' || seqrelid::text || ':' || xmin::text FROM pg_catalog.pg_sequence WHERE seqrelid >= 16384
+) keys"""
+# before PostgreSQL 10, without pg_sequence: an ALTER SEQUENCE only changes the sequence relation and is not seen
+SQL_TO_GET_SCHEMA_FINGERPRINT_LEGACY = """SELECT md5(coalesce(string_agg(k, ',' ORDER BY k), '')) FROM (
+    SELECT 'c' || oid::text || ':' || xmin::text k FROM pg_catalog.pg_class WHERE oid >= 16384 AND relpersistence <> 't'
+    UNION ALL SELECT 'p' || oid::text || ':' || xmin::text FROM pg_catalog.pg_proc WHERE oid >= 16384
+    UNION ALL SELECT 'r' || oid::text || ':' || xmin::text FROM pg_catalog.pg_rewrite WHERE oid >= 16384
+    UNION ALL SELECT 'o' || oid::text || ':' || xmin::text FROM pg_catalog.pg_constraint WHERE oid >= 16384
+    UNION ALL SELECT 'e' || oid::text || ':' || xmin::text FROM pg_catalog.pg_extension
+) keys"""
+
+SQL_TO_GET_PRIMARY_KEYS = """SELECT n.nspname, c.relname,
+       array_agg(a.attname::text ORDER BY k.ord),
+       array_agg(format_type(a.atttypid, a.atttypmod) ORDER BY k.ord)
+FROM pg_catalog.pg_constraint con
+JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY k(attnum, ord)
+JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+WHERE con.contype = 'p' AND n.nspname = ANY(%s)
+GROUP BY 1, 2"""
+
+SQL_TO_GET_ESTIMATED_ROWS = """SELECT n.nspname, c.relname, c.reltuples::bigint
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'p') AND n.nspname = ANY(%s)"""
+
+# settings DMS needs on the source; rds.logical_replication only exists on RDS
+SQL_TO_GET_REPLICATION_SETTINGS = """SELECT name, setting FROM pg_catalog.pg_settings
+WHERE name IN ('rds.logical_replication', 'wal_level', 'max_replication_slots', 'max_wal_senders',
+               'max_worker_processes', 'shared_preload_libraries', 'server_version_num')"""
+
+SQL_TO_GET_REPLICATION_PRIVILEGE = """SELECT r.rolsuper OR r.rolreplication OR EXISTS (
+    SELECT 1 FROM pg_catalog.pg_auth_members m JOIN pg_catalog.pg_roles g ON g.oid = m.roleid
+    WHERE m.member = r.oid AND g.rolname IN ('rds_superuser', 'rds_replication'))
+FROM pg_catalog.pg_roles r WHERE r.rolname = current_user"""
+
+SQL_TO_COUNT_REPLICATION_SLOTS = "SELECT count(*) FROM pg_catalog.pg_replication_slots"
+
+SQL_TO_GET_EXTENSIONS = "SELECT extname, extversion FROM pg_catalog.pg_extension ORDER BY 1"
+
+# tables DMS can only copy once: without a primary key, updates and deletes are not replicated
+SQL_TO_GET_TABLES_WITHOUT_PRIMARY_KEY = """SELECT n.nspname, c.relname
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'r' AND c.relpersistence = 'p' AND NOT n.nspname = ANY(%s)
+  AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_constraint con WHERE con.conrelid = c.oid AND con.contype = 'p')
+ORDER BY 1, 2"""
+
+# cluster wide activity counters of the given databases, with the time they count from
+SQL_TO_GET_DATABASE_ACTIVITY = """SELECT coalesce(sum(xact_commit), 0),
+       extract(epoch FROM now()),
+       extract(epoch FROM min(coalesce(stats_reset, pg_postmaster_start_time())))
+FROM pg_catalog.pg_stat_database WHERE datname = ANY(%s)"""
+
+SQL_TO_GET_TABLE_WRITES = """SELECT coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0)
+FROM pg_catalog.pg_stat_user_tables"""
+
+# WAL position in bytes, the functions were renamed in PostgreSQL 10
+SQL_TO_GET_WAL_POSITION = "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')"
+SQL_TO_GET_WAL_POSITION_LEGACY = "SELECT pg_xlog_location_diff(pg_current_xlog_location(), '0/0')"
+
+# bytes of WAL written on the source that the logical slots of a plugin (LIKE pattern) haven't confirmed yet
+SQL_TO_GET_REPLICATION_LAG = """SELECT slot_name, database, active,
+       pg_wal_lsn_diff(pg_current_wal_lsn(), coalesce(confirmed_flush_lsn, restart_lsn))
+FROM pg_catalog.pg_replication_slots WHERE slot_type = 'logical' AND plugin LIKE %s"""
+SQL_TO_GET_REPLICATION_LAG_LEGACY = """SELECT slot_name, database, active,
+       pg_xlog_location_diff(pg_current_xlog_location(), coalesce(confirmed_flush_lsn, restart_lsn))
+FROM pg_catalog.pg_replication_slots WHERE slot_type = 'logical' AND plugin LIKE %s"""
+
+# a destination accepts writes once promoted: not in recovery and not read only
+SQL_TO_CHECK_WRITABLE = "SELECT NOT pg_is_in_recovery() AND current_setting('transaction_read_only') = 'off'"
+
+# position of every sequence of the given schemas, last_value is NULL for a sequence never used
+# last_value is NULL for a sequence never used and for one the user may not read, told apart by the privilege
+SQL_TO_GET_SEQUENCE_VALUES = """SELECT schemaname, sequencename, last_value, increment_by, min_value, max_value,
+       has_sequence_privilege(format('%%I.%%I', schemaname, sequencename), 'SELECT')
+FROM pg_catalog.pg_sequences WHERE schemaname = ANY(%s)"""
+# before PostgreSQL 10 the position is only in the sequence relation itself, see SQL_TO_GET_SEQUENCE_VALUES_LEGACY,
+# which fails on a sequence the user may not read
+SQL_TO_GET_SEQUENCE_NAMES_LEGACY = """SELECT n.nspname, c.relname, has_sequence_privilege(c.oid, 'SELECT')
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'S' AND n.nspname = ANY(%s)"""
+SQL_TO_GET_SEQUENCE_VALUES_LEGACY = """SELECT %s, %s, CASE WHEN is_called THEN last_value END, increment_by, min_value,
+       max_value, true FROM {}"""
+
+# set the sequences given as arrays of schemas, names and values, skipping those missing on the destination
+SQL_TO_SET_SEQUENCE_VALUES = """SELECT count(pg_catalog.setval(r, v, true)) FROM (
+    SELECT to_regclass(format('%%I.%%I', s, n)) r, v FROM unnest(%s::text[], %s::text[], %s::bigint[]) u(s, n, v)
+) x WHERE r IS NOT NULL"""
+
+# statements of the given databases by total execution time, only read-only ones without parameters can be replayed:
+# a single SELECT/WITH/TABLE/VALUES statement, no row lock and no catalog or monitoring query
+SQL_TO_GET_TOP_STATEMENTS = r"""SELECT d.datname, s.query, sum(s.calls), sum(s.total_exec_time)
+FROM pg_stat_statements s JOIN pg_catalog.pg_database d ON d.oid = s.dbid
+WHERE d.datname = ANY(%s) AND s.query ~* '^\s*(select|with|table|values)\M' AND s.query !~ '\$[0-9]'
+  AND s.query !~ ';\s*\S' AND s.query !~* '(pg_catalog|information_schema|pg_stat)'
+  AND s.query !~* '\mfor\s+(update|share|no\s+key|key\s+share)\M'
+GROUP BY 1, 2 ORDER BY 4 DESC LIMIT %s"""
+# total_exec_time was total_time before PostgreSQL 13
+SQL_TO_GET_TOP_STATEMENTS_LEGACY = r"""SELECT d.datname, s.query, sum(s.calls), sum(s.total_time)
+FROM pg_stat_statements s JOIN pg_catalog.pg_database d ON d.oid = s.dbid
+WHERE d.datname = ANY(%s) AND s.query ~* '^\s*(select|with|table|values)\M' AND s.query !~ '\$[0-9]'
+  AND s.query !~ ';\s*\S' AND s.query !~* '(pg_catalog|information_schema|pg_stat)'
+  AND s.query !~* '\mfor\s+(update|share|no\s+key|key\s+share)\M'
+GROUP BY 1, 2 ORDER BY 4 DESC LIMIT %s"""
+
+# blocks of the heap and of the indexes of every table read since the statistics were reset, from cache or disk
+SQL_TO_GET_TABLE_IO = """SELECT schemaname, relname, coalesce(heap_blks_read, 0) + coalesce(heap_blks_hit, 0),
+       coalesce(idx_blks_read, 0) + coalesce(idx_blks_hit, 0)
+FROM pg_catalog.pg_statio_user_tables"""
+
+# relations of the tables given as arrays of schemas, names and whether their indexes (or their heap) are wanted,
+# with their position in the arrays and their size, skipping the tables missing on the destination
+SQL_TO_GET_PREWARM_RELATIONS = """SELECT u.o, r.oid::regclass::text, pg_relation_size(r.oid)
+FROM unnest(%s::text[], %s::text[], %s::boolean[]) WITH ORDINALITY u(s, t, idx, o)
+JOIN pg_catalog.pg_class r ON (NOT u.idx AND r.oid = to_regclass(format('%%I.%%I', u.s, u.t)))
+  OR (u.idx AND r.oid IN (SELECT indexrelid FROM pg_catalog.pg_index
+                          WHERE indrelid = to_regclass(format('%%I.%%I', u.s, u.t))))
+ORDER BY 1, 3 DESC"""
+
+SQL_TO_GET_SHARED_BUFFERS = "SELECT pg_size_bytes(current_setting('shared_buffers'))"
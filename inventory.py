@@ -0,0 +1,176 @@
+import glob
+import json
+import os
+import threading
+from collections.abc import Mapping
+
+from state import write_json
+
+# field -> (type, required)
+SCHEMA = {
+    "aws-host": (str, True),
+    "aws-port": (int, True),
+    "aws-replication-username": (str, True),
+    "aws-replication-password": ((str, int), True),
+    "gcp-project-id": (str, True),
+    "gcp-instance-region": (str, True),
+    "gcp-auto-storage-increase": (bool, False),
+    "gcp-database-version": (str, False),
+    "gcp-disk-type": (str, False),
+    "gcp-instance-cpu": (int, False),
+    "gcp-instance-mem": (int, False),
+    "gcp-instance-storage": (int, False),
+    "gcp-ip-config": (dict, False),
+    "gcp-migration-type": (str, False),
+    "gcp-port": (int, False),
+    "gcp-host": (str, False),
+    "gcp-root-password": ((str, int), False),
+}
+# values of the optional fields that are absent
+DEFAULTS = {
+    "gcp-auto-storage-increase": True,
+    "gcp-disk-type": "PD_SSD",
+    "gcp-migration-type": "continuous",
+    "gcp-port": 5432,
+}
+# optional fields the DMS engine needs to create the destination instance
+DMS_FIELDS = ("gcp-database-version", "gcp-ip-config")
+
+
+class Inventory(Mapping):
+    """
+    Config entries of the databases to migrate, read-only mapping of name to entry.
+    `sources` is a yaml file, a directory of yaml files or a glob, or a comma separated list of them.
+    A file holds either many entries (name: entry) or a single entry named after the file.
+    Entries are validated against SCHEMA when loaded, absent optional fields take their DEFAULTS, and entries keep
+    the order they are declared in.
+    Values set at run time (e.g. gcp-host) go to one overlay file per entry under `overlay_dir`, written
+    atomically, and take precedence over the sources.
+    """
+
+    def __init__(self, sources, overlay_dir):
+        self._sources = sources
+        self._overlay_dir = overlay_dir
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._files = {}
+        for path in self._paths():
+            for name, entry in self._load(path).items():
+                if name in self._entries:
+                    raise Exception(f"database {name} is defined in {self._files[name]} and in {path}")
+                self._entries[name] = entry
+                self._files[name] = path
+        overlays = set(os.listdir(overlay_dir)) if os.path.isdir(overlay_dir) else set()
+        for name, entry in self._entries.items():
+            if f"{name}.json" in overlays and isinstance(entry, dict):
+                entry.update(self._overlay(name))
+        errors = [error for name, entry in self._entries.items() for error in validate(name, entry)]
+        if errors:
+            raise Exception(f"invalid config {sources}:\n  " + "\n  ".join(errors))
+        for entry in self._entries.values():
+            for field, value in DEFAULTS.items():
+                if entry.get(field) is None:
+                    entry[field] = value
+
+    def __getitem__(self, name):
+        return self._entries[name]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def regions(self):
+        """
+        :return: dict of (project, region) to the names of its entries
+        """
+        regions = {}
+        for name, entry in self._entries.items():
+            regions.setdefault((entry["gcp-project-id"], entry["gcp-instance-region"]), []).append(name)
+        return regions
+
+    def names(self, project=None, region=None):
+        """
+        :return: names of the entries of a gcp project and/or region, all of them if neither is given, in the order
+                 they are declared
+        """
+        return [name for name, entry in self._entries.items()
+                if project in (None, entry["gcp-project-id"]) and region in (None, entry["gcp-instance-region"])]
+
+    def missing(self, name, fields):
+        """
+        :return: the fields that an entry doesn't set
+        """
+        return [field for field in fields if self._entries[name].get(field) is None]
+
+    def update_entry(self, name, **fields):
+        """
+        Set fields of one entry, persisted in its overlay file without touching the sources or other entries.
+        :param fields: keyword arguments, underscores stand for dashes, e.g. gcp_host
+        """
+        fields = {key.replace("_", "-"): value for key, value in fields.items()}
+        errors = validate(name, dict(self._entries[name], **fields))
+        if errors:
+            raise Exception("\n".join(errors))
+        with self._lock:
+            overlay = dict(self._overlay(name), **fields)
+            write_json(self._overlay_path(name), overlay)
+            self._entries[name].update(fields)
+
+    def _paths(self):
+        paths = []
+        for source in str(self._sources).split(","):
+            source = source.strip()
+            if os.path.isdir(source):
+                matches = glob.glob(os.path.join(source, "*.yaml")) + glob.glob(os.path.join(source, "*.yml"))
+            elif glob.has_magic(source):
+                matches = glob.glob(source)
+            else:
+                matches = [source]
+            if not matches:
+                raise Exception(f"no config file found for {source}")
+            paths.extend(sorted(matches))
+        return paths
+
+    def _load(self, path):
+        import yaml
+        # libyaml parses an order of magnitude faster than the pure python loader
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        with open(path) as f:
+            document = yaml.load(f, Loader=loader) or {}
+        if not isinstance(document, dict):
+            raise Exception(f"{path} is not a mapping of database names to entries")
+        if "aws-host" in document:
+            return {os.path.splitext(os.path.basename(path))[0]: document}
+        return document
+
+    def _overlay_path(self, name):
+        return os.path.join(self._overlay_dir, f"{name}.json")
+
+    def _overlay(self, name):
+        path = self._overlay_path(name)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+
+def validate(name, entry):
+    """
+    :return: list of errors of an entry, empty if it is valid
+    """
+    if not isinstance(entry, dict):
+        return [f"{name}: entry is not a mapping"]
+    errors = []
+    for field, (kind, required) in SCHEMA.items():
+        if field not in entry or entry[field] is None:
+            if required:
+                errors.append(f"{name}: {field} is missing")
+        elif not isinstance(entry[field], kind) or (kind is int and isinstance(entry[field], bool)):
+            names = " or ".join(_.__name__ for _ in (kind if isinstance(kind, tuple) else (kind,)))
+            errors.append(f"{name}: {field} must be {names}, got {entry[field]!r}")
+    unknown = sorted(set(entry) - set(SCHEMA))
+    if unknown:
+        errors.append(f"{name}: unknown fields {', '.join(unknown)}")
+    return errors
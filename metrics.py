@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from codetiming import Timer
+
+# timed spans kept for the JSONL export, the oldest are dropped first
+MAX_SPANS = 100000
+
+
+class Metrics:
+    """
+    Process wide counters and timings of the migration steps: API calls and retries, await loops,
+    metadata queries and the time every database spends in each sync/cutover stage.
+    Exported as Prometheus text exposition or as JSONL, one line per timed span and per counter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (name, labels) -> (count, sum, max)
+        self._timings = {}
+        self._spans = deque(maxlen=MAX_SPANS)
+        # key (e.g. a database) -> (stage, started)
+        self._stages = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            count, total, highest = self._timings.get(key, (0, 0.0, 0.0))
+            self._timings[key] = (count + 1, total + seconds, max(highest, seconds))
+            self._spans.append((time.time() - seconds, seconds, name, key[1]))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time the block and record it under name and labels, failed blocks get the label error=true.
+        """
+        timer = Timer(logger=None)
+        timer.start()
+        try:
+            yield timer
+        except Exception:
+            labels["error"] = "true"
+            raise
+        finally:
+            self.observe(name, timer.stop(), **labels)
+
+    def stage(self, key, stage=None):
+        """
+        Move key into stage, recording the time spent in its previous stage as stage_seconds.
+        :param stage: new stage, None to leave the current stage without entering another
+        """
+        now = time.time()
+        with self._lock:
+            previous = self._stages.get(key)
+            if previous is not None and previous[0] == stage:
+                return
+            if stage is None:
+                self._stages.pop(key, None)
+            else:
+                self._stages[key] = (stage, now)
+        if previous is not None:
+            self.observe("stage_seconds", now - previous[1], stage=previous[0], database=key)
+
+    def stage_summary(self):
+        """
+        :return: list of (stage, number of databases, total seconds, highest seconds), most time first
+        """
+        stages = {}
+        with self._lock:
+            for (name, labels), (count, total, highest) in self._timings.items():
+                if name != "stage_seconds":
+                    continue
+                stage = dict(labels)["stage"]
+                databases, stage_total, stage_highest = stages.get(stage, (0, 0.0, 0.0))
+                stages[stage] = (databases + 1, stage_total + total, max(stage_highest, total))
+        return sorted(((stage,) + values for stage, values in stages.items()), key=lambda _: _[2], reverse=True)
+
+    def prometheus(self):
+        """
+        :return: metrics in the Prometheus text exposition format, timings as summaries
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timings = sorted(self._timings.items())
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{_format(labels)} {value}" for (other, labels), value in counters if other == name)
+        for name in sorted({name for (name, _), _ in timings}):
+            lines.append(f"# TYPE {name} summary")
+            for (other, labels), (count, total, highest) in timings:
+                if other == name:
+                    lines.append(f"{name}_count{_format(labels)} {count}")
+                    lines.append(f"{name}_sum{_format(labels)} {total:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def jsonl(self):
+        """
+        :return: one JSON line per timed span, then one per counter
+        """
+        with self._lock:
+            spans = list(self._spans)
+            counters = sorted(self._counters.items())
+        lines = [json.dumps({"ts": started, "name": name, "seconds": seconds, "labels": dict(labels)})
+                 for started, seconds, name, labels in spans]
+        lines.extend(json.dumps({"name": name, "value": value, "labels": dict(labels)})
+                     for (name, labels), value in counters)
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the metrics to path, as JSONL if it ends with .jsonl, otherwise as Prometheus text.
+        """
+        with open(path, "w") as f:
+            f.write(self.jsonl() if path.endswith(".jsonl") else self.prometheus())
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(labels):
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+# shared by every module of a run
+METRICS = Metrics()
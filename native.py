@@ -0,0 +1,176 @@
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from psycopg2 import sql
+
+from get_metadata import GetTables, ConnectionPool, parallel_map, parse_connection_string, DEFAULT_WORKERS
+from metrics import METRICS
+from sequences import SequenceSync
+
+# bytes of table data one copy job is given before another job is added
+BYTES_PER_JOB = 64 * 1024 ** 2
+
+
+class NativeCopier:
+    """
+    Copies every database of a source to an existing destination without DMS: the schema is streamed from
+    `pg_dump --section=pre-data` into `psql`, table data is streamed with COPY TO STDOUT / COPY FROM STDIN through
+    an in-memory pipe, `workers` tables at a time, largest first, then indexes, constraints and triggers are
+    streamed from `pg_dump --section=post-data` and the sequences are set. Nothing is spooled to disk.
+    The schema and every table are read in the snapshot of a single source transaction.
+    The number of copy jobs of a database grows with its size in the GetTables inventory, up to `workers`.
+    """
+    def __init__(self, str_con_src, str_con_dst, workers=DEFAULT_WORKERS, pg_bin=None):
+        """
+        :param pg_bin: directory of pg_dump and psql, defaults to the PATH; pg_dump must not be older than
+                       the source server
+        """
+        self._str_con_src = str_con_src
+        self._str_con_dst = str_con_dst
+        self._src = parse_connection_string(str_con_src)
+        self._dst = parse_connection_string(str_con_dst)
+        self._workers = workers
+        self._pg_bin = pg_bin
+
+    def databases(self):
+        """
+        :return: names of the databases of the source
+        """
+        with GetTables(self._str_con_src, workers=self._workers, discover=False) as tables:
+            tables.get_databases()
+            return tables.list_database
+
+    def copy_database(self, db):
+        """
+        Copy one database. The destination database is created if missing and must not have any table.
+        :return: (number of tables, bytes in the source inventory)
+        """
+        src = ConnectionPool(self._str_con_src, maxconn=self._workers + 1)
+        dst = ConnectionPool(self._str_con_dst, maxconn=self._workers)
+        try:
+            src_tables = GetTables(self._str_con_src, workers=1, pool=src, discover=False)
+            _, rows = src_tables.get_tables_of_database(db)
+            self._prepare_destination(dst, db)
+            # partitioned tables hold no rows, their partitions are copied
+            parents = {(parent_schema, parent_table) for _, _, _, parent_schema, parent_table, _ in rows}
+            tables = sorted(((schema, table, size) for _, schema, table, _, _, size in rows
+                             if (schema, table) not in parents), key=lambda _: _[2], reverse=True)
+            total = sum(size for _, _, size in tables)
+            jobs = max(1, min(self._workers, len(tables), math.ceil(total / BYTES_PER_JOB)))
+            excluded_schemas = [_ for _ in src_tables.exclusion_list_schema
+                                if not _.startswith("pg_") and _ != "information_schema"]
+
+            with src.connection(db) as conn, conn.cursor() as cur:
+                # every reader joins this transaction's snapshot, so the copy is consistent
+                cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                try:
+                    cur.execute("SELECT pg_export_snapshot()")
+                    snapshot = cur.fetchone()[0]
+                    with METRICS.timer("native_seconds", step="pre_data", database=db):
+                        self._stream_section(db, "pre-data", snapshot, excluded_schemas)
+                    with METRICS.timer("native_seconds", step="data", database=db):
+                        parallel_map(lambda _: self._copy_table(src, dst, db, snapshot, _[0], _[1]), tables, jobs)
+                    with METRICS.timer("native_seconds", step="post_data", database=db):
+                        self._stream_section(db, "post-data", snapshot, excluded_schemas)
+                finally:
+                    cur.execute("COMMIT")
+        finally:
+            src.close()
+            dst.close()
+        return len(tables), total
+
+    def sync_sequences(self):
+        """
+        Set the sequences of the destination to their positions on the source, which the data section of a
+        dump would have done.
+        :return: see SequenceSync.run
+        """
+        return SequenceSync(self._str_con_src, self._str_con_dst, workers=self._workers, margin=0).run()
+
+    def _prepare_destination(self, dst, db):
+        with dst.connection("postgres") as conn, conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM pg_catalog.pg_database WHERE datname = %s", (db,))
+            if not cur.fetchone()[0]:
+                cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(db)))
+                return
+        _, rows = GetTables(self._str_con_dst, workers=1, pool=dst, discover=False).get_tables_of_database(db)
+        if rows:
+            raise Exception(f"database {db} of the destination already has {len(rows)} tables, "
+                            f"drop it to copy it again")
+
+    def _command(self, name):
+        path = os.path.join(self._pg_bin, name) if self._pg_bin else shutil.which(name)
+        if path is None or not os.path.exists(path):
+            raise Exception(f"{name} not found, install the PostgreSQL client or set pg_bin")
+        return path
+
+    def _stream_section(self, db, section, snapshot, excluded_schemas):
+        """
+        Stream a section of pg_dump of the source into psql on the destination.
+        """
+        dump_args = [self._command("pg_dump"), "-h", self._src["host"], "-p", str(self._src["port"]),
+                     "-U", self._src["user"], "-d", db, f"--section={section}", f"--snapshot={snapshot}",
+                     "--no-owner", "--no-privileges"] + [f"--exclude-schema={_}" for _ in excluded_schemas]
+        restore_args = [self._command("psql"), "-h", self._dst["host"], "-p", str(self._dst["port"]),
+                        "-U", self._dst["user"], "-d", db, "-X", "-q", "-v", "ON_ERROR_STOP=1"]
+        # messages only, the dump itself goes through the pipe
+        with tempfile.TemporaryFile() as dump_errors:
+            dump = subprocess.Popen(dump_args, stdout=subprocess.PIPE, stderr=dump_errors,
+                                    env=dict(os.environ, PGPASSWORD=self._src["password"]))
+            restore = subprocess.Popen(restore_args, stdin=dump.stdout, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE, env=dict(os.environ, PGPASSWORD=self._dst["password"]))
+            dump.stdout.close()
+            _, restore_errors = restore.communicate()
+            if dump.wait() != 0:
+                dump_errors.seek(0)
+                raise Exception(f"pg_dump of the {section} of {db} failed: {dump_errors.read().decode().strip()}")
+        if restore.returncode != 0:
+            raise Exception(f"restore of the {section} of {db} failed: {restore_errors.decode().strip()}")
+
+    def _copy_table(self, src, dst, db, snapshot, schema, table):
+        """
+        Stream the rows of one table from source to destination. The destination table is truncated and
+        loaded in one transaction, a failed copy leaves it unchanged.
+        """
+        relation = sql.Identifier(schema, table)
+        read_fd, write_fd = os.pipe()
+        errors = []
+
+        def produce(conn):
+            try:
+                with os.fdopen(write_fd, "wb") as pipe, conn.cursor() as cur:
+                    cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                    try:
+                        cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+                        cur.copy_expert(sql.SQL("COPY {} TO STDOUT (FORMAT binary)").format(relation), pipe)
+                    finally:
+                        cur.execute("COMMIT")
+            except Exception as error:
+                errors.append(error)
+
+        with src.connection(db) as src_conn, dst.connection(db) as dst_conn, \
+                METRICS.timer("native_table_seconds", database=db):
+            producer = threading.Thread(target=produce, args=(src_conn,), daemon=True)
+            producer.start()
+            try:
+                with os.fdopen(read_fd, "rb") as pipe, dst_conn.cursor() as cur:
+                    cur.execute("BEGIN")
+                    try:
+                        cur.execute(sql.SQL("TRUNCATE ONLY {}").format(relation))
+                        cur.copy_expert(sql.SQL("COPY {} FROM STDIN (FORMAT binary)").format(relation), pipe)
+                        producer.join()
+                    finally:
+                        cur.execute("ROLLBACK" if errors or producer.is_alive() else "COMMIT")
+            except Exception:
+                # closing the pipe stops the producer, its error is the cause of a truncated copy unless it only
+                # lost the pipe
+                producer.join()
+                if errors and not isinstance(errors[0], BrokenPipeError):
+                    raise errors[0]
+                raise
+        if errors:
+            raise errors[0]
@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+
+import psycopg2
+
+from get_metadata import GetTables, ConnectionPool, parallel_map, DEFAULT_WORKERS
+from get_metadata_sql import SQL_TO_GET_TOP_STATEMENTS, SQL_TO_GET_TOP_STATEMENTS_LEGACY
+
+SOURCE = 'source'
+DESTINATION = 'destination'
+PERCENTILES = (50, 95, 99)
+# limit of one replayed execution, a statement slower than this on one side is reported as an error
+STATEMENT_TIMEOUT_MS = 30000
+
+
+class ParityBenchmark:
+    """
+    Replays the top read-only statements of the source (by total time in pg_stat_statements) against source and
+    destination at the same time, with `clients` connections per side each running a statement `iterations`
+    times, and measures the latency of every execution (with its rows fetched) and the throughput of each side.
+    Statements run one after the other, each in a READ ONLY transaction that is rolled back.
+    pg_stat_statements keeps statements with their constants replaced by parameters, only those without any
+    parameter can be replayed.
+    """
+    def __init__(self, str_con_src, str_con_dst, statements=10, clients=4, iterations=50, warmup=1,
+                 workers=DEFAULT_WORKERS):
+        """
+        :param statements: number of statements replayed
+        :param warmup: executions of every client before the measured ones, not counted
+        :param workers: number of databases scanned at the same time
+        """
+        self._str_con_src = str_con_src
+        self._str_con_dst = str_con_dst
+        self._statements = statements
+        self._clients = max(1, int(clients))
+        self._iterations = iterations
+        self._warmup = warmup
+        self._workers = workers
+
+    def statements(self):
+        """
+        :return: list of (database, query, calls, total milliseconds) of the source, slowest in total first
+        """
+        pool = ConnectionPool(self._str_con_src, maxconn=1)
+        try:
+            tables = GetTables(self._str_con_src, workers=self._workers, pool=pool, discover=False)
+            tables.get_databases()
+            for db in ["postgres"] + [_ for _ in tables.list_database if _ != "postgres"]:
+                # the view is cluster wide but only exists in the databases where the extension is created
+                with pool.connection(db) as conn, conn.cursor() as cur:
+                    cur.execute("SELECT to_regclass('pg_stat_statements') IS NOT NULL, "
+                                "current_setting('server_version_num')::int")
+                    installed, version = cur.fetchone()
+                    if not installed:
+                        continue
+                    cur.execute(SQL_TO_GET_TOP_STATEMENTS if version >= 130000 else SQL_TO_GET_TOP_STATEMENTS_LEGACY,
+                                (tables.list_database, self._statements))
+                    return [(database, query, int(calls), float(total)) for database, query, calls, total
+                            in cur.fetchall()]
+            raise Exception("pg_stat_statements is not installed in any database of the source, "
+                            "add it to shared_preload_libraries and CREATE EXTENSION pg_stat_statements")
+        finally:
+            pool.close()
+
+    def run(self, statements=None):
+        """
+        :param statements: list of (database, query, ...) to replay, defaults to `statements()`
+        :return: list of {database, query, calls, source, destination}, with the stats of each side,
+                 see `_replay`
+        """
+        statements = self.statements() if statements is None else statements
+        pools = {SOURCE: ConnectionPool(self._str_con_src, maxconn=self._clients),
+                 DESTINATION: ConnectionPool(self._str_con_dst, maxconn=self._clients)}
+        try:
+            results = []
+            for database, query, calls, *_ in statements:
+                source, destination = parallel_map(lambda side: self._replay(pools[side], database, query),
+                                                   [SOURCE, DESTINATION], 2)
+                results.append({"database": database, "query": query, "calls": calls,
+                                SOURCE: source, DESTINATION: destination})
+            return results
+        finally:
+            for pool in pools.values():
+                pool.close()
+
+    def _replay(self, pool, database, query):
+        """
+        Run a statement `iterations` times on each of `clients` connections, all starting together after
+        their warm-up.
+        :return: dict of executions, p50/p95/p99 (milliseconds), throughput (executions per second) and the
+                 first error, or None
+        """
+        latencies = []
+        errors = []
+        started = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(self._clients, action=lambda: started.append(time.perf_counter()))
+
+        def execute(cur):
+            cur.execute("BEGIN READ ONLY")
+            try:
+                cur.execute(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT_MS}")
+                begin = time.perf_counter()
+                cur.execute(query)
+                if cur.description is not None:
+                    cur.fetchall()
+                return (time.perf_counter() - begin) * 1000
+            finally:
+                cur.execute("ROLLBACK")
+
+        def client(_):
+            ready = False
+            try:
+                with pool.connection(database) as conn, conn.cursor() as cur:
+                    for _ in range(self._warmup):
+                        execute(cur)
+                    ready = True
+                    barrier.wait()
+                    for _ in range(self._iterations):
+                        elapsed = execute(cur)
+                        with lock:
+                            latencies.append(elapsed)
+            except threading.BrokenBarrierError:
+                # another client failed before the start
+                pass
+            except psycopg2.Error as error:
+                errors.append(str(error).strip().splitlines()[0])
+                if not ready:
+                    barrier.abort()
+
+        parallel_map(client, range(self._clients), self._clients)
+        duration = time.perf_counter() - started[0] if started else 0
+        latencies.sort()
+        stats = {"executions": len(latencies), "error": errors[0] if errors else None,
+                 "throughput": len(latencies) / duration if duration > 0 else 0.0}
+        for percentile in PERCENTILES:
+            stats[f"p{percentile}"] = _percentile(latencies, percentile)
+        return stats
+
+
+def _percentile(values, percentile):
+    """
+    :param values: sorted values
+    :return: nearest-rank percentile, None without values
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(percentile / 100 * len(values)) - 1)]
@@ -0,0 +1,126 @@
+import heapq
+import json
+import threading
+import time
+
+from sizing import DUMP_BYTES_PER_SECOND_PER_CPU
+from state import write_json
+
+# what a run is expected to take before any is recorded: provisioning (profiles, cloud SQL instance, job start)
+# and copy rate per destination vCPU, for each engine. The native engine doesn't scale with the tier, its runs are
+# recorded and estimated with 1 vCPU
+PRIOR_OVERHEAD_SECONDS = {"dms": 900, "native": 10}
+PRIOR_BYTES_PER_SECOND_PER_CPU = {"dms": DUMP_BYTES_PER_SECOND_PER_CPU, "native": 2 * DUMP_BYTES_PER_SECOND_PER_CPU}
+# weight of the prior against the recorded runs: as many bytes as one run of this size, and one run of overhead
+PRIOR_BYTES = 1024 ** 3
+PRIOR_RUNS = 1
+# runs kept in the history, the oldest are dropped first
+MAX_RUNS = 1000
+
+
+class ThroughputHistory:
+    """
+    Copy rates and provisioning overheads of past runs, kept in one JSON file, from which the duration of a
+    migration is estimated. Rates are pooled per engine and per destination vCPU, starting from the prior above
+    and converging to the recorded runs as they accumulate.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def runs(self):
+        """
+        :return: list of {dbname, engine, bytes, cpu, seconds, overhead, at}
+        """
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def record(self, dbname, engine, size, cpu, seconds, overhead):
+        """
+        :param size: bytes copied
+        :param cpu: vCPUs of the destination
+        :param seconds: duration of the copy (the full dump for DMS)
+        :param overhead: seconds before the copy started
+        """
+        with self._lock:
+            runs = self.runs() + [{"dbname": dbname, "engine": engine, "bytes": size, "cpu": cpu,
+                                   "seconds": seconds, "overhead": overhead, "at": time.time()}]
+            write_json(self._path, runs[-MAX_RUNS:])
+
+    def estimate(self, size, cpu, engine="dms"):
+        """
+        :return: estimated (overhead, copy) seconds of a migration of `size` bytes to `cpu` vCPUs
+        """
+        runs = [_ for _ in self.runs() if _["engine"] == engine and _["seconds"] > 0]
+        prior_rate = PRIOR_BYTES_PER_SECOND_PER_CPU[engine]
+        rate = (PRIOR_BYTES + sum(_["bytes"] for _ in runs)) \
+            / (PRIOR_BYTES / prior_rate + sum(_["seconds"] * _["cpu"] for _ in runs))
+        overhead = (PRIOR_RUNS * PRIOR_OVERHEAD_SECONDS[engine] + sum(_["overhead"] for _ in runs)) \
+            / (PRIOR_RUNS + len(runs))
+        return overhead, size / (rate * cpu)
+
+
+def schedule(items, workers, per_region, per_project=None, per_source=None):
+    """
+    Order migrations to minimise the makespan under the concurrency caps: longest first, every one started as soon
+    as a worker, its (project, region), its project and its source are free (list scheduling, as FleetRunner runs
+    them). Migrations started at the same time form a wave.
+    :param items: list of dicts with dbname, project, region, source and seconds
+    :param workers: maximum at the same time, at least 1
+    :param per_region: maximum at the same time per (project, region), no limit if None
+    :param per_project: maximum at the same time per gcp project, no limit if None
+    :param per_source: maximum at the same time per source host, the load a source takes, no limit if None
+    :return: items in start order with start, end and wave added, and the makespan in seconds
+    """
+    if workers is None or int(workers) < 1:
+        raise Exception(f"workers must be at least 1, got {workers}")
+    per_region = None if per_region is None else max(1, int(per_region))
+    per_project = None if per_project is None else max(1, int(per_project))
+    per_source = None if per_source is None else max(1, int(per_source))
+    # pending migrations of every project/region, longest first: a project/region is either free or blocked as a
+    # whole, only the sources within it have to be checked one by one
+    queues = {}
+    for item in sorted(items, key=lambda _: _["seconds"], reverse=True):
+        queues.setdefault((item["project"], item["region"]), []).append(item)
+    regions, projects, sources = {}, {}, {}
+    running = []
+    planned = []
+    now, wave = 0.0, 0
+
+    def free(counts, key, cap):
+        return cap is None or counts.get(key, 0) < cap
+
+    while any(queues.values()):
+        started = False
+        while len(running) < workers:
+            best = None
+            for key, queue in queues.items():
+                if not queue or not free(regions, key, per_region) or not free(projects, key[0], per_project):
+                    continue
+                candidate = next((_ for _ in queue if free(sources, _["source"], per_source)), None)
+                if candidate is not None and (best is None or candidate["seconds"] > best[1]["seconds"]):
+                    best = key, candidate
+            if best is None:
+                break
+            key, item = best
+            queues[key].remove(item)
+            item = dict(item, start=now, end=now + item["seconds"], wave=wave)
+            for counts, counted in ((regions, key), (projects, key[0]), (sources, item["source"])):
+                counts[counted] = counts.get(counted, 0) + 1
+            heapq.heappush(running, (item["end"], len(planned), item))
+            planned.append(item)
+            started = True
+        wave += 1 if started else 0
+        if not running:
+            break
+        # the next start can only happen once a running migration ends
+        now = running[0][0]
+        while running and running[0][0] <= now:
+            _, _, item = heapq.heappop(running)
+            for counts, counted in ((regions, (item["project"], item["region"])), (projects, item["project"]),
+                                    (sources, item["source"])):
+                counts[counted] -= 1
+    return planned, max((_["end"] for _ in planned), default=0.0)
@@ -0,0 +1,137 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+# quota and availability errors, retried for every method
+RETRYABLE_STATUSES = (429, 503)
+# server errors, only retried when repeating the call is safe
+IDEMPOTENT_RETRYABLE_STATUSES = (500, 502, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+# migration job states/phases in which a change is expected soon, or only after a long time
+FAST_PHASES = ('NOT_STARTED', 'CREATING', 'STARTING', 'PROMOTE_IN_PROGRESS', 'DELETING')
+SLOW_PHASES = ('FULL_DUMP',)
+
+
+class RetryPolicy:
+    """
+    Retries an API call on quota and transient errors with exponential backoff and full jitter,
+    honouring the Retry-After header, until `max_attempts` or the deadline of the call is reached.
+    """
+
+    def __init__(self, max_attempts=8, base=1.0, cap=32.0, deadline=300.0):
+        """
+        :param base: seconds of the first backoff
+        :param cap: maximum seconds between two attempts
+        :param deadline: default seconds a call may take, retries included
+        """
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+
+    def retryable(self, error, method=None):
+        """
+        :param method: HTTP method of the call, None if unknown (e.g. a batch request)
+        """
+        from googleapiclient.errors import HttpError
+        if not isinstance(error, HttpError):
+            return False
+        status = error.resp.status
+        if status in RETRYABLE_STATUSES:
+            return True
+        return status in IDEMPOTENT_RETRYABLE_STATUSES and str(method).upper() in IDEMPOTENT_METHODS
+
+    def delay(self, attempt, error=None):
+        """
+        :param attempt: number of failed attempts so far, starting at 1
+        :return: seconds to sleep before the next attempt
+        """
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.cap)
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+    def call(self, func, method=None, deadline=None, on_retry=None):
+        """
+        :param func: callable doing one attempt of the call
+        :param deadline: seconds the call may take, retries included, defaults to the policy deadline
+        :param on_retry: callable(attempt, error, delay) invoked before sleeping
+        :return: result of func
+        """
+        ends = time.monotonic() + (self.deadline if deadline is None else deadline)
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except Exception as error:
+                attempt += 1
+                if attempt >= self.max_attempts or not self.retryable(error, method):
+                    raise
+                delay = self.delay(attempt, error)
+                if time.monotonic() + delay > ends:
+                    raise
+                if on_retry is not None:
+                    on_retry(attempt, error, delay)
+                time.sleep(delay)
+
+
+class PollPolicy:
+    """
+    Interval between two polls of a resource: starts at `fast` and grows by `growth` while nothing changes,
+    up to a ceiling that depends on the phase of the resource (`fast` right after a start or near promote,
+    `slow` during a full dump, `interval` otherwise). Every interval is jittered by +/- `jitter`.
+    """
+
+    def __init__(self, interval=5, fast=None, slow=None, growth=1.5, jitter=0.2):
+        self.interval = interval
+        self.fast = min(interval, 2) if fast is None else fast
+        self.slow = max(interval, 30) if slow is None else slow
+        self.growth = growth
+        self.jitter = jitter
+
+    def ceiling(self, body):
+        """
+        :param body: resource body, None if it is not listed yet
+        """
+        if body is None:
+            return self.fast
+        phase = body.get('phase')
+        if body.get('state') in FAST_PHASES or phase in FAST_PHASES:
+            return self.fast
+        if body.get('state') == 'RUNNING' and phase in SLOW_PHASES:
+            return self.slow
+        return self.interval
+
+    def next_interval(self, previous, changed, ceiling):
+        """
+        :param previous: last interval, None on the first poll
+        :param changed: the polled resources changed since the last poll
+        :return: interval before the next poll, not jittered
+        """
+        if previous is None or changed:
+            return min(self.fast, ceiling)
+        return min(previous * self.growth, ceiling)
+
+    def jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def _retry_after(error):
+    """
+    :return: seconds of the Retry-After header of an HttpError, given in seconds or as an HTTP date
+    """
+    from googleapiclient.errors import HttpError
+    if not isinstance(error, HttpError) or error.resp is None:
+        return None
+    value = error.resp.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,270 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from policy import PollPolicy
+
+MIGRATION_JOBS = 'migrationJobs'
+CONNECTION_PROFILES = 'connectionProfiles'
+
+
+class ResourcePoller:
+    """
+    Shared poller for DMS migration jobs and connection profiles.
+    It calls `list` once per (kind, project/region) that has registered waiters, caches the result
+    and resolves the waiters whose predicate is satisfied, so the number of API calls grows with
+    the number of regions instead of the number of jobs.
+    Every (kind, project/region) is polled on its own schedule given by the PollPolicy: fast while a
+    waited resource is starting or being promoted, slow while it is in a full dump, and backing off
+    while nothing changes.
+    """
+
+    def __init__(self, gcp, policy=None, logger=None):
+        """
+        :param gcp: GcpApi used for the list calls
+        :param policy: PollPolicy, defaults to PollPolicy()
+        """
+        self._gcp = gcp
+        self._policy = policy if policy is not None else PollPolicy()
+        self._interval = self._policy.interval
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._waiters = []
+        self._cache = {}
+        # (kind, parent) -> (time of the next poll, last interval, waited bodies of the last poll)
+        self._schedule = {}
+        self._thread = None
+
+    def get(self, kind, name, max_age=None):
+        """
+        :param kind: MIGRATION_JOBS or CONNECTION_PROFILES
+        :param name: projects/{project}/locations/{region}/{kind}/{id}
+        :param max_age: seconds a cached list is considered fresh, defaults to the poll interval
+        :return: cached resource body or None if it was not listed
+        """
+        key = (kind, _parent(name))
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is None or time.time() - cached[0] > (self._interval if max_age is None else max_age):
+            cached = self._refresh(key)
+        return cached[1].get(name)
+
+    def wait_for(self, kind, name, predicate, timeout=None):
+        """
+        Block until predicate(body) is true. predicate receives None while the resource is not listed
+        and may raise to abort the wait.
+        :return: resource body that satisfied the predicate
+        """
+        key = (kind, _parent(name))
+        waiter = (key, name, predicate, Future())
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and time.time() - cached[0] <= self._interval and _resolve(waiter, cached[1]):
+            return waiter[3].result()
+
+        with self._lock:
+            self._waiters.append(waiter)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="dms-poller", daemon=True)
+                self._thread.start()
+            # a project/region that was never listed needs an early poll, others keep their schedule
+            if key not in self._cache:
+                self._schedule.pop(key, None)
+                self._wakeup.set()
+            elif key in self._schedule:
+                # a new waiter may need a faster schedule than the one computed for the current waiters,
+                # the cache may have been filled since it was read above
+                cached = self._cache[key]
+                due, interval, bodies = self._schedule[key]
+                ceiling = self._policy.ceiling(cached[1].get(name))
+                if interval > ceiling:
+                    self._schedule[key] = (min(due, cached[0] + ceiling), ceiling, bodies)
+                    self._wakeup.set()
+            else:
+                # listed for earlier waiters but not scheduled anymore: polled on the next round, which must not
+                # wait for the schedule of the other project/regions
+                self._wakeup.set()
+        try:
+            return waiter[3].result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"timed out after {timeout}s waiting for {name}")
+        finally:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            with self._lock:
+                keys = {waiter[0] for waiter in self._waiters}
+                if not keys:
+                    self._thread = None
+                    self._schedule.clear()
+                    return
+                for key in set(self._schedule) - keys:
+                    del self._schedule[key]
+                due = [key for key in keys if key not in self._schedule or self._schedule[key][0] <= now]
+            for key in due:
+                self._poll(key)
+            with self._lock:
+                next_due = min((self._schedule[key][0] for key in keys if key in self._schedule), default=now)
+            self._wakeup.wait(max(0, next_due - time.time()))
+
+    def _poll(self, key):
+        """
+        List one (kind, project/region), resolve its waiters and schedule its next poll.
+        """
+        with self._lock:
+            _, interval, previous = self._schedule.get(key, (None, None, None))
+        try:
+            resources = self._refresh(key)[1]
+        except Exception as error:
+            self._logger.warning(f"failed to list {key[0]} for {key[1]}: {error}")
+            # back off the failing region, retrying no later than the slowest poll
+            interval = min(self._policy.slow, (interval or self._policy.fast) * 2)
+            with self._lock:
+                self._schedule[key] = (time.time() + self._policy.jittered(interval), interval, previous)
+            return
+        with self._lock:
+            waiters = [waiter for waiter in self._waiters if waiter[0] == key]
+        pending = []
+        for waiter in waiters:
+            if _resolve(waiter, resources):
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+            else:
+                pending.append(waiter)
+
+        bodies = {waiter[1]: resources.get(waiter[1]) for waiter in pending}
+        ceiling = min((self._policy.ceiling(body) for body in bodies.values()), default=self._policy.interval)
+        interval = self._policy.next_interval(interval, bodies != previous, ceiling)
+        with self._lock:
+            self._schedule[key] = (time.time() + self._policy.jittered(interval), interval, bodies)
+
+    def _refresh(self, key):
+        kind, parent = key
+        if kind == MIGRATION_JOBS:
+            resources = self._gcp.list_migration_jobs(parent)
+        else:
+            resources = self._gcp.list_connection_profiles(parent)
+        cached = (time.time(), resources)
+        with self._lock:
+            self._cache[key] = cached
+        self._logger.debug(f"polled {len(resources)} {kind} in {parent}")
+        return cached
+
+
+def _parent(name):
+    """
+    :param name: projects/{project}/locations/{region}/{kind}/{id}
+    :return: projects/{project}/locations/{region}
+    """
+    return name.rsplit("/", 2)[0]
+
+
+def _resolve(waiter, resources):
+    """
+    :return: True if the waiter's future was completed
+    """
+    _, name, predicate, future = waiter
+    if future.done():
+        return True
+    try:
+        if not predicate(resources.get(name)):
+            return False
+        future.set_result(resources.get(name))
+    except Exception as error:
+        future.set_exception(error)
+    return True
+
+
+class OperationTracker:
+    """
+    Tracks many long-running operations (DMS and Cloud SQL Admin) from a single polling thread,
+    instead of one sleep loop per operation.
+    """
+
+    def __init__(self, interval=2, logger=None):
+        """
+        :param interval: seconds between two polls of the pending operations
+        """
+        self._interval = interval
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._lock = threading.Lock()
+        self._pending = []
+        self._thread = None
+
+    def track(self, get_op, timeout=None):
+        """
+        :param get_op: callable returning the current operation body
+        :param timeout: seconds after which the operation is failed with TimeoutError
+        :return: Future resolved with the finished operation body
+        """
+        future = Future()
+        deadline = time.time() + timeout if timeout else None
+        with self._lock:
+            self._pending.append((get_op, deadline, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="operation-tracker", daemon=True)
+                self._thread.start()
+        return future
+
+    def wait(self, get_op, timeout=None):
+        """
+        Block until the operation is done.
+        :return: finished operation body
+        """
+        return self.track(get_op, timeout).result()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+                if not pending:
+                    self._thread = None
+                    return
+            for entry in pending:
+                get_op, deadline, future = entry
+                try:
+                    operation = get_op()
+                    if is_operation_done(operation):
+                        error = operation_error(operation)
+                        if error:
+                            raise Exception(f"operation {operation.get('name')} failed: {error}")
+                        future.set_result(operation)
+                    elif deadline is not None and time.time() > deadline:
+                        raise TimeoutError(f"operation {operation.get('name')} did not complete: "
+                                           f"{operation.get('status', operation.get('metadata'))}")
+                    else:
+                        continue
+                except Exception as error:
+                    future.set_exception(error)
+                with self._lock:
+                    self._pending.remove(entry)
+            # jitter keeps many trackers (e.g. parallel runs) from polling in lockstep
+            time.sleep(self._interval * random.uniform(0.8, 1.2))
+
+
+def is_operation_done(operation):
+    """
+    :param operation: DMS operation (`done` is omitted until true) or Cloud SQL Admin operation (`status`)
+    """
+    if 'status' in operation:
+        return operation['status'] == 'DONE'
+    return operation.get('done', False)
+
+
+def operation_error(operation):
+    """
+    :return: error of a finished operation, None if it succeeded
+    """
+    error = operation.get('error')
+    if isinstance(error, dict) and 'errors' in error:
+        return error['errors'] or None
+    return error
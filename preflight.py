@@ -0,0 +1,143 @@
+import json
+import os
+import time
+
+from get_metadata import GetTables, ConnectionPool, parallel_map, DEFAULT_WORKERS
+from get_metadata_sql import SQL_TO_GET_REPLICATION_SETTINGS, SQL_TO_GET_REPLICATION_PRIVILEGE, \
+    SQL_TO_COUNT_REPLICATION_SLOTS, SQL_TO_GET_EXTENSIONS, SQL_TO_GET_TABLES_WITHOUT_PRIMARY_KEY
+from state import write_json
+
+BLOCKING = 'blocking'
+WARNING = 'warning'
+
+# extensions cloud SQL for PostgreSQL can create, others have to be dropped or replaced before migrating
+# see: https://cloud.google.com/sql/docs/postgres/extensions
+CLOUDSQL_EXTENSIONS = {
+    "address_standardizer", "address_standardizer_data_us", "amcheck", "autoinc", "bloom", "btree_gin",
+    "btree_gist", "citext", "cube", "dblink", "dict_int", "dict_xsyn", "earthdistance", "fuzzystrmatch", "hll",
+    "hstore", "insert_username", "intagg", "intarray", "ip4r", "isn", "lo", "ltree", "moddatetime", "orafce",
+    "pageinspect", "pg_bigm", "pg_buffercache", "pg_cron", "pg_freespacemap", "pg_hint_plan", "pg_partman",
+    "pg_prewarm", "pg_repack", "pg_similarity", "pg_squeeze", "pg_stat_statements", "pg_trgm", "pg_visibility",
+    "pg_wait_sampling", "pgaudit", "pgcrypto", "pgfincore", "pglogical", "pgrouting", "pgrowlocks", "pgstattuple",
+    "pgtap", "plpgsql", "plproxy", "plv8", "postgis", "postgis_raster", "postgis_sfcgal", "postgis_tiger_geocoder",
+    "postgis_topology", "postgres_fdw", "prefix", "rdkit", "refint", "sslinfo", "tablefunc", "tcn",
+    "temporal_tables", "tsm_system_rows", "tsm_system_time", "unaccent", "uuid-ossp", "vector",
+}
+# number of tables without primary key named in an issue
+SAMPLE_TABLES = 5
+
+
+class PreflightChecker:
+    """
+    Checks that an RDS source is ready for a DMS continuous migration before any resource is created:
+    logical replication, replication slots and senders, pglogical, replication privileges, primary keys
+    and extensions. Server settings are read once, databases are checked in parallel over pooled connections.
+    Results are cached per host under `cache_dir` for `max_age` seconds.
+    """
+    def __init__(self, str_con_src, workers=DEFAULT_WORKERS, cache_dir=None, max_age=3600):
+        self._str_con_src = str_con_src
+        self._workers = workers
+        self._cache_dir = cache_dir
+        self._max_age = max_age
+        host, port = str_con_src.split(":", 2)[:2]
+        self._host = f"{host}:{port}"
+
+    def run(self, refresh=False):
+        """
+        :param refresh: check again even if the cached result is recent
+        :return: list of issues {check, severity, database, message}, database is None for server level issues
+        """
+        cached = self._cached()
+        if cached is not None and not refresh:
+            return cached
+        pool = ConnectionPool(self._str_con_src, maxconn=1)
+        try:
+            tables = GetTables(self._str_con_src, workers=self._workers, pool=pool, discover=False)
+            tables.get_databases()
+            excluded_schemas = tables.exclusion_list_schema + ["pg_toast"]
+            issues = self._check_server(pool, len(tables.list_database))
+            for database_issues in parallel_map(lambda db: self._check_database(pool, db, excluded_schemas),
+                                                tables.list_database, self._workers):
+                issues.extend(database_issues)
+        finally:
+            pool.close()
+        if self._cache_dir is not None:
+            write_json(self._cache_path(), {"checked_at": time.time(), "issues": issues})
+        return issues
+
+    def _cached(self):
+        if self._cache_dir is None:
+            return None
+        try:
+            with open(self._cache_path()) as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            return None
+        if time.time() - cached["checked_at"] > self._max_age:
+            return None
+        return cached["issues"]
+
+    def _cache_path(self):
+        return os.path.join(self._cache_dir, f"{self._host.replace(':', '_')}.json")
+
+    def _check_server(self, pool, databases):
+        """
+        :param databases: number of databases to migrate, DMS uses a replication slot and a sender for each
+        """
+        with pool.connection("postgres") as conn, conn.cursor() as cur:
+            cur.execute(SQL_TO_GET_REPLICATION_SETTINGS)
+            settings = dict(cur.fetchall())
+            cur.execute(SQL_TO_GET_REPLICATION_PRIVILEGE)
+            privileged = cur.fetchone()[0]
+            cur.execute(SQL_TO_COUNT_REPLICATION_SLOTS)
+            slots_in_use = cur.fetchone()[0]
+
+        issues = []
+
+        def issue(check, severity, message):
+            issues.append({"check": check, "severity": severity, "database": None, "message": message})
+
+        if settings.get("rds.logical_replication", "on") != "on":
+            issue("rds.logical_replication", BLOCKING, "rds.logical_replication is off, set it to 1 in the "
+                                                       "parameter group and reboot the instance")
+        if settings.get("wal_level") != "logical":
+            issue("wal_level", BLOCKING, f"wal_level is {settings.get('wal_level')}, logical is required")
+        if "pglogical" not in [_.strip() for _ in settings.get("shared_preload_libraries", "").split(",")]:
+            issue("shared_preload_libraries", BLOCKING, "pglogical is not in shared_preload_libraries")
+        required = {
+            "max_replication_slots": databases + slots_in_use,
+            "max_wal_senders": databases + slots_in_use,
+            "max_worker_processes": databases + 1,
+        }
+        for name, minimum in required.items():
+            value = int(settings.get(name, 0))
+            if value < minimum:
+                issue(name, BLOCKING, f"{name} is {value}, at least {minimum} needed for {databases} databases "
+                                      f"and {slots_in_use} replication slots in use")
+        if not privileged:
+            issue("privileges", BLOCKING, "the replication user is neither superuser, replication, "
+                                          "rds_superuser nor rds_replication")
+        return issues
+
+    def _check_database(self, pool, db, excluded_schemas):
+        with pool.connection(db) as conn, conn.cursor() as cur:
+            cur.execute(SQL_TO_GET_EXTENSIONS)
+            extensions = [name for name, _ in cur.fetchall()]
+            cur.execute(SQL_TO_GET_TABLES_WITHOUT_PRIMARY_KEY, (excluded_schemas,))
+            without_pk = [f"{schema}.{table}" for schema, table in cur.fetchall()]
+
+        issues = []
+
+        def issue(check, severity, message):
+            issues.append({"check": check, "severity": severity, "database": db, "message": message})
+
+        if "pglogical" not in extensions:
+            issue("pglogical", BLOCKING, "extension pglogical is not installed, run CREATE EXTENSION pglogical")
+        unsupported = [_ for _ in extensions if _ not in CLOUDSQL_EXTENSIONS]
+        if unsupported:
+            issue("extensions", WARNING, f"extensions not available on cloud SQL: {', '.join(unsupported)}")
+        if without_pk:
+            sample = ", ".join(without_pk[:SAMPLE_TABLES]) + (", ..." if len(without_pk) > SAMPLE_TABLES else "")
+            issue("primary_keys", WARNING, f"{len(without_pk)} tables without primary key, only their inserts "
+                                           f"are replicated: {sample}")
+        return issues
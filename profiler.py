@@ -0,0 +1,72 @@
+import time
+
+NOT_STARTED = 'not_started'
+STALLED = 'stalled'
+COPYING = 'copying'
+DONE = 'done'
+
+
+class TransferProfiler:
+    """
+    Per table copy rates of a migration, from destination size samples over a sliding `window` of seconds,
+    and a ranking of the tables holding the migration back.
+    Destination sizes are sampled on every call of `sample`, the source every `source_interval` seconds only,
+    since its sizes barely move during a dump. Built on the inventory and store of a ProgressTracker.
+    """
+    def __init__(self, tracker, store, window=60, source_interval=300):
+        self._tracker = tracker
+        self._store = store
+        self._window = window
+        self._source_interval = source_interval
+        self._source_sampled = None
+
+    def sample(self):
+        """
+        Sample the destination, and the source if its last sample is older than `source_interval`, discovering
+        the tables of a sampled side again when its catalog changed.
+        :return: hot spots, see `hot_spots`
+        """
+        sides = ("destination",)
+        if self._source_sampled is None or time.time() - self._source_sampled >= self._source_interval:
+            sides = ("source", "destination")
+            self._source_sampled = time.time()
+        for side in sides:
+            self._tracker.refresh_inventory(side)
+        self._tracker.sample(sides, retention=2 * max(self._window, self._source_interval))
+        return self.hot_spots()
+
+    def hot_spots(self):
+        """
+        :return: list of unfinished tables {database, schema, table, size_src, size_dst, remaining, rate (bytes/s,
+                 None until two samples), eta (s, None if not moving), status}, tables that are not moving first,
+                 largest remaining first, then the longest eta first
+        """
+        source = self._store.last_snapshots("source", 1)
+        if not source:
+            return []
+        # the list comes from the source inventory, a table missing on the destination has size 0
+        destination = self._store.snapshots_since("destination", time.time() - self._window) or [(None, {})]
+        _, size_src = source[0]
+        first_ts, first = destination[0]
+        last_ts, last = destination[-1]
+        span = last_ts - first_ts if last_ts is not None else 0
+
+        tables = []
+        for key, size in size_src.items():
+            copied = last.get(key, 0)
+            remaining = max(0, size - copied)
+            if remaining == 0:
+                continue
+            rate = max(0, copied - first.get(key, 0)) / span if span > 0 else None
+            if copied == 0:
+                status = NOT_STARTED
+            elif rate == 0 and span >= self._window / 2:
+                status = STALLED
+            else:
+                status = COPYING
+            database, schema, table = key
+            tables.append({"database": database, "schema": schema, "table": table, "size_src": size,
+                           "size_dst": min(copied, size), "remaining": remaining, "rate": rate,
+                           "eta": remaining / rate if rate else None, "status": status})
+        return sorted(tables, key=lambda _: (_["eta"] is None, _["remaining"] if _["eta"] is None else _["eta"]),
+                      reverse=True)
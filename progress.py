@@ -0,0 +1,175 @@
+import logging
+import os
+import sqlite3
+import time
+
+from get_metadata import GetTables, parallel_map, DEFAULT_WORKERS
+
+SIDES = ("source", "destination")
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressStore:
+    """
+    SQLite cache of the table inventory and of the size snapshots of both sides of a migration.
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprint (side TEXT, database TEXT, fingerprint TEXT,
+                PRIMARY KEY (side, database));
+            CREATE TABLE IF NOT EXISTS inventory (side TEXT, database TEXT, schema TEXT,
+                PRIMARY KEY (side, database, schema));
+            CREATE TABLE IF NOT EXISTS snapshot (ts REAL, side TEXT, database TEXT, schema TEXT, "table" TEXT,
+                size INTEGER);
+            CREATE INDEX IF NOT EXISTS snapshot_ts ON snapshot (side, ts);
+            -- every snapshot taken, also those without any table (a destination before the dump created them)
+            CREATE TABLE IF NOT EXISTS sample (side TEXT, ts REAL, PRIMARY KEY (side, ts));
+        """)
+
+    def close(self):
+        self._db.close()
+
+    def fingerprints(self, side):
+        rows = self._db.execute("SELECT database, fingerprint FROM fingerprint WHERE side = ?", (side,))
+        return dict(rows.fetchall())
+
+    def inventory(self, side):
+        """
+        :return: list of {database, schema}
+        """
+        rows = self._db.execute("SELECT database, schema FROM inventory WHERE side = ? ORDER BY 1, 2", (side,))
+        return [{"database": database, "schema": schema} for database, schema in rows.fetchall()]
+
+    def save_inventory(self, side, fingerprints, list_schema):
+        with self._db:
+            self._db.execute("DELETE FROM fingerprint WHERE side = ?", (side,))
+            self._db.execute("DELETE FROM inventory WHERE side = ?", (side,))
+            self._db.executemany("INSERT INTO fingerprint VALUES (?, ?, ?)",
+                                 [(side, database, fingerprint) for database, fingerprint in fingerprints.items()])
+            self._db.executemany("INSERT INTO inventory VALUES (?, ?, ?)",
+                                 [(side, _["database"], _["schema"]) for _ in list_schema])
+
+    def save_snapshot(self, ts, side, list_table, retention=24 * 3600):
+        with self._db:
+            self._db.execute("INSERT OR IGNORE INTO sample VALUES (?, ?)", (side, ts))
+            self._db.executemany("INSERT INTO snapshot VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(ts, side, _["database"], _["schema"], _["table"], _["size"]) for _ in list_table])
+            self._db.execute("DELETE FROM snapshot WHERE side = ? AND ts < ?", (side, ts - retention))
+            self._db.execute("DELETE FROM sample WHERE side = ? AND ts < ?", (side, ts - retention))
+
+    def last_snapshots(self, side, count=2):
+        """
+        :return: list of (ts, {(database, schema, table): size}), newest first
+        """
+        snapshots = []
+        for ts in self._sample_times(side)[::-1][:count]:
+            sizes = self._db.execute('SELECT database, schema, "table", size FROM snapshot WHERE side = ? AND ts = ?',
+                                     (side, ts))
+            snapshots.append((ts, {(database, schema, table): size for database, schema, table, size in sizes}))
+        return snapshots
+
+    def snapshots_since(self, side, ts):
+        """
+        :return: list of (ts, {(database, schema, table): size}) taken at or after ts, oldest first
+        """
+        snapshots = {_: {} for _ in self._sample_times(side) if _ >= ts}
+        rows = self._db.execute('SELECT ts, database, schema, "table", size FROM snapshot WHERE side = ? AND ts >= ?',
+                                (side, ts))
+        for ts, database, schema, table, size in rows.fetchall():
+            snapshots.setdefault(ts, {})[(database, schema, table)] = size
+        return sorted(snapshots.items())
+
+    def _sample_times(self, side):
+        """
+        :return: times of the snapshots of a side, oldest first; stores written before the sample table only
+                 have the snapshots holding tables
+        """
+        rows = self._db.execute("SELECT ts FROM sample WHERE side = ? UNION SELECT ts FROM snapshot WHERE side = ? "
+                                "ORDER BY 1", (side, side))
+        return [ts for (ts,) in rows.fetchall()]
+
+
+class ProgressTracker:
+    """
+    Tracks the progress of a migration by re-sampling table sizes on both sides.
+    The database/schema inventory is discovered once and cached in the store; it is only discovered
+    again when the catalog fingerprint of a side changes.
+    """
+    def __init__(self, str_con_src, str_con_dst, store, workers=DEFAULT_WORKERS):
+        self._store = store
+        self._tables = {
+            "source": GetTables(str_con_src, workers=workers, discover=False),
+            "destination": GetTables(str_con_dst, workers=workers, discover=False),
+        }
+
+    def close(self):
+        for tables in self._tables.values():
+            tables.close()
+
+    def refresh_inventory(self, side):
+        """
+        Discover the inventory of a side again if its catalog changed since it was cached.
+        :return: True if the inventory was discovered again
+        """
+        tables = self._tables[side]
+        fingerprints = tables.fingerprint()
+        if fingerprints == self._store.fingerprints(side):
+            tables.list_database = list(fingerprints)
+            tables.list_schema = self._store.inventory(side)
+            return False
+        logger.info(f"catalog of {side} {tables.host} changed, discovering tables")
+        tables.get_databases()
+        tables.get_tables()
+        self._store.save_inventory(side, fingerprints, tables.list_schema)
+        return True
+
+    def sample(self, sides=SIDES, retention=24 * 3600):
+        """
+        Sample the sizes of the given sides and store them as a snapshot.
+        :param retention: seconds snapshots are kept
+        :return: report of the progress, see `report`
+        """
+        now = time.time()
+        for side, list_table in zip(sides, parallel_map(lambda side: self._tables[side].sample_sizes(), sides, 2)):
+            self._store.save_snapshot(now, side, list_table, retention=retention)
+        return self.report()
+
+    def report(self):
+        """
+        :return: dict with the overall percentage, throughput in bytes/s, eta in seconds
+                 and per table {database, schema, table, size_src, size_dst, throughput},
+                 None before the source was sampled
+        """
+        source = self._store.last_snapshots("source", 1)
+        if not source:
+            return None
+        # without any destination snapshot every table is still to copy
+        destination = self._store.last_snapshots("destination", 2)
+        _, size_src = source[0]
+        ts, size_dst = destination[0] if destination else (None, {})
+        previous_ts, previous_dst = destination[1] if len(destination) > 1 else (None, {})
+
+        tables = []
+        for key, size in size_src.items():
+            copied = min(size_dst.get(key, 0), size)
+            throughput = 0
+            if previous_ts is not None and ts > previous_ts:
+                throughput = max(0, size_dst.get(key, 0) - previous_dst.get(key, 0)) / (ts - previous_ts)
+            database, schema, table = key
+            tables.append({"database": database, "schema": schema, "table": table,
+                           "size_src": size, "size_dst": copied, "throughput": throughput})
+
+        total = sum(_["size_src"] for _ in tables)
+        copied = sum(_["size_dst"] for _ in tables)
+        throughput = sum(_["throughput"] for _ in tables)
+        remaining = total - copied
+        return {
+            "percentage": copied / total * 100 if total else 100,
+            "remaining": remaining,
+            "throughput": throughput,
+            "eta": remaining / throughput if throughput else None,
+            "tables": tables,
+        }
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+
+from get_metadata import GetTables, ConnectionPool, parallel_map, DEFAULT_WORKERS
+from get_metadata_sql import SQL_TO_GET_FUNCTIONS, SQL_TO_GET_VIEWS, SQL_TO_GET_SEQUENCES, SQL_TO_GET_INDEXES, \
+    SQL_TO_GET_CONSTRAINTS, SQL_TO_GET_EXTENSIONS, SQL_TO_GET_SCHEMA_FINGERPRINT, SQL_TO_GET_SEQUENCES_LEGACY, \
+    SQL_TO_GET_SCHEMA_FINGERPRINT_LEGACY
+from state import write_json
+
+MISSING = 'missing'
+DIFFERENT = 'different'
+
+# kind -> query returning (schema, name, definition) of the objects of the schemas bound as its parameter
+OBJECT_QUERIES = {
+    "function": SQL_TO_GET_FUNCTIONS,
+    "view": SQL_TO_GET_VIEWS,
+    "sequence": SQL_TO_GET_SEQUENCES,
+    "index": SQL_TO_GET_INDEXES,
+    "constraint": SQL_TO_GET_CONSTRAINTS,
+}
+# before PostgreSQL 10
+LEGACY_OBJECT_QUERIES = dict(OBJECT_QUERIES, sequence=SQL_TO_GET_SEQUENCES_LEGACY)
+
+
+class SchemaCatalog:
+    """
+    Hashes of the normalised definitions of the functions, views, sequences, indexes, constraints and extensions
+    of every database of one host, read in parallel over pooled connections.
+    With a `cache_dir` the hashes of a database are kept with its schema fingerprint, and a database is only read
+    again when its fingerprint changed.
+    """
+    def __init__(self, str_con, workers=DEFAULT_WORKERS, cache_dir=None):
+        self._str_con = str_con
+        self._workers = workers
+        host, port = str_con.split(":", 2)[:2]
+        self._cache_dir = None if cache_dir is None else os.path.join(cache_dir, f"{host}_{port}")
+
+    def objects(self):
+        """
+        :return: dict of database to {kind: {name: hash}}, names are schema qualified
+        """
+        pool = ConnectionPool(self._str_con, maxconn=1)
+        try:
+            tables = GetTables(self._str_con, workers=self._workers, pool=pool, discover=False)
+            tables.get_databases()
+            with pool.connection("postgres") as conn, conn.cursor() as cur:
+                cur.execute("SHOW server_version_num")
+                legacy = int(cur.fetchone()[0]) < 100000
+            excluded_schemas = tables.exclusion_list_schema + ["pg_toast"]
+            return dict(zip(tables.list_database,
+                            parallel_map(lambda db: self._objects_of_database(pool, db, excluded_schemas, legacy),
+                                         tables.list_database, self._workers)))
+        finally:
+            pool.close()
+
+    def _objects_of_database(self, pool, db, excluded_schemas, legacy):
+        with pool.connection(db) as conn, conn.cursor() as cur:
+            cur.execute(SQL_TO_GET_SCHEMA_FINGERPRINT_LEGACY if legacy else SQL_TO_GET_SCHEMA_FINGERPRINT)
+            fingerprint = cur.fetchone()[0]
+            cached = self._cached(db)
+            if cached is not None and cached["fingerprint"] == fingerprint:
+                return cached["objects"]
+            cur.execute("SELECT nspname FROM pg_catalog.pg_namespace WHERE NOT nspname = ANY(%s) "
+                        "AND nspname NOT LIKE 'pg_temp_%%' AND nspname NOT LIKE 'pg_toast_temp_%%'",
+                        (excluded_schemas,))
+            schemas = [_[0] for _ in cur.fetchall()]
+            objects = {}
+            for kind, sql in (LEGACY_OBJECT_QUERIES if legacy else OBJECT_QUERIES).items():
+                cur.execute(sql, (schemas,))
+                objects[kind] = {f"{schema}.{name}": _hash(definition) for schema, name, definition in cur.fetchall()}
+            cur.execute(SQL_TO_GET_EXTENSIONS)
+            objects["extension"] = {name: _hash(version) for name, version in cur.fetchall()}
+        if self._cache_dir is not None:
+            write_json(self._cache_path(db), {"fingerprint": fingerprint, "objects": objects})
+        return objects
+
+    def _cached(self, db):
+        if self._cache_dir is None:
+            return None
+        try:
+            with open(self._cache_path(db)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _cache_path(self, db):
+        return os.path.join(self._cache_dir, f"{db}.json")
+
+
+def diff(str_con_src, str_con_dst, workers=DEFAULT_WORKERS, cache_dir=None):
+    """
+    Compare the schema objects of source and destination, both read at the same time.
+    :return: list of {database, kind, name, status} of the source objects missing or different on the destination
+    """
+    source, destination = parallel_map(lambda str_con: SchemaCatalog(str_con, workers, cache_dir).objects(),
+                                       [str_con_src, str_con_dst], 2)
+    differences = []
+    for database, kinds in sorted(source.items()):
+        for kind, objects in sorted(kinds.items()):
+            other = destination.get(database, {}).get(kind, {})
+            for name, digest in sorted(objects.items()):
+                if name not in other:
+                    differences.append({"database": database, "kind": kind, "name": name, "status": MISSING})
+                elif other[name] != digest:
+                    differences.append({"database": database, "kind": kind, "name": name, "status": DIFFERENT})
+    return differences
+
+
+def _hash(definition):
+    """
+    :return: hash of a definition with its whitespace collapsed and trailing semicolons removed
+    """
+    normalised = re.sub(r"\s+", " ", str(definition or "")).strip().rstrip(";").rstrip()
+    return hashlib.md5(normalised.encode()).hexdigest()
@@ -0,0 +1,107 @@
+import psycopg2
+from psycopg2 import sql
+
+from get_metadata import GetTables, ConnectionPool, parallel_map, DEFAULT_WORKERS
+from get_metadata_sql import SQL_TO_GET_SEQUENCE_VALUES, SQL_TO_GET_SEQUENCE_NAMES_LEGACY, \
+    SQL_TO_GET_SEQUENCE_VALUES_LEGACY, SQL_TO_SET_SEQUENCE_VALUES
+from metrics import METRICS
+
+# increments added to every position, for values handed out on the source after it was read
+DEFAULT_MARGIN = 1000
+# sequences set by one statement (and so one transaction) on the destination
+DEFAULT_BATCH_SIZE = 1000
+
+
+class SequenceSync:
+    """
+    Copies the positions of the sequences of every database from source to destination, which DMS does not
+    replicate. Each database is read with a single query over a pooled connection and written with one
+    statement per `batch_size` sequences, databases are processed in parallel. A database that fails (e.g. missing
+    on the destination) is reported and does not stop the others.
+    Every position is moved `margin` increments ahead, within the bounds of its sequence. Sequences the source user
+    has no SELECT privilege on cannot be read: the others are set and the database is reported as failed.
+    """
+    def __init__(self, str_con_src, str_con_dst, workers=DEFAULT_WORKERS, margin=DEFAULT_MARGIN,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        self._str_con_src = str_con_src
+        self._host = str_con_src.split(":", 1)[0]
+        self._str_con_dst = str_con_dst
+        self._workers = workers
+        self._margin = margin
+        self._batch_size = batch_size
+
+    def run(self):
+        """
+        :return: list of (database, sequences found, sequences set, error or None), sequences never used on the
+                 source are not set
+        """
+        src = ConnectionPool(self._str_con_src, maxconn=1)
+        dst = ConnectionPool(self._str_con_dst, maxconn=1)
+        try:
+            tables = GetTables(self._str_con_src, workers=self._workers, pool=src, discover=False)
+            tables.get_databases()
+            with src.connection("postgres") as conn, conn.cursor() as cur:
+                cur.execute("SHOW server_version_num")
+                legacy = int(cur.fetchone()[0]) < 100000
+            excluded_schemas = tables.exclusion_list_schema + ["pg_toast"]
+
+            def sync(db):
+                read = 0
+                try:
+                    values, unreadable = self._read(src, db, excluded_schemas, legacy)
+                    read = len(values) + len(unreadable)
+                    applied = self._write(dst, db, [_ for _ in values if _[2] is not None])
+                except psycopg2.Error as error:
+                    return db, read, 0, str(error).strip().splitlines()[0]
+                if unreadable:
+                    return db, read, applied, f"no SELECT privilege on {len(unreadable)} sequences, not set: " \
+                                              f"{', '.join(unreadable)}"
+                return db, read, applied, None
+
+            return parallel_map(sync, tables.list_database, self._workers)
+        finally:
+            src.close()
+            dst.close()
+
+    def _read(self, pool, db, excluded_schemas, legacy):
+        """
+        :return: list of (schema, name, position to set or None if the sequence was never used), list of names of
+                 the sequences the user may not read
+        """
+        with pool.connection(db) as conn, conn.cursor() as cur, \
+                METRICS.timer("metadata_query_seconds", query="sequences", host=self._host):
+            cur.execute("SELECT nspname FROM pg_catalog.pg_namespace WHERE NOT nspname = ANY(%s)", (excluded_schemas,))
+            schemas = [_[0] for _ in cur.fetchall()]
+            unreadable = []
+            if legacy:
+                cur.execute(SQL_TO_GET_SEQUENCE_NAMES_LEGACY, (schemas,))
+                rows = cur.fetchall()
+                unreadable = [f"{schema}.{name}" for schema, name, readable in rows if not readable]
+                names = [(schema, name) for schema, name, readable in rows if readable]
+                if not names:
+                    return [], unreadable
+                query = sql.SQL(" UNION ALL ").join(
+                    sql.SQL(SQL_TO_GET_SEQUENCE_VALUES_LEGACY).format(sql.Identifier(schema, name))
+                    for schema, name in names)
+                cur.execute(query, [_ for name in names for _ in name])
+            else:
+                cur.execute(SQL_TO_GET_SEQUENCE_VALUES, (schemas,))
+            rows = cur.fetchall()
+        unreadable += [f"{schema}.{name}" for schema, name, *_, readable in rows if not readable]
+        return [(schema, name, None if last is None else self._ahead(last, increment, lowest, highest))
+                for schema, name, last, increment, lowest, highest, readable in rows if readable], unreadable
+
+    def _ahead(self, last, increment, lowest, highest):
+        return min(highest, max(lowest, last + self._margin * increment))
+
+    def _write(self, pool, db, values):
+        """
+        :return: number of sequences set, those missing on the destination are skipped
+        """
+        count = 0
+        with pool.connection(db) as conn, conn.cursor() as cur:
+            for start in range(0, len(values), self._batch_size):
+                schemas, names, positions = zip(*values[start:start + self._batch_size])
+                cur.execute(SQL_TO_SET_SEQUENCE_VALUES, (list(schemas), list(names), list(positions)))
+                count += cur.fetchone()[0]
+        return count
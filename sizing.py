@@ -0,0 +1,122 @@
+import math
+import time
+
+from get_metadata import GetTables, ConnectionPool, parallel_map, DEFAULT_WORKERS
+from get_metadata_sql import SQL_TO_GET_DATABASE_ACTIVITY, SQL_TO_GET_TABLE_WRITES, SQL_TO_GET_WAL_POSITION, \
+    SQL_TO_GET_WAL_POSITION_LEGACY
+
+GB = 1024 ** 3
+MB = 1024 ** 2
+
+# full dump throughput of one destination vCPU (copy and index builds), and the dump duration aimed at
+DUMP_BYTES_PER_SECOND_PER_CPU = 10 * MB
+TARGET_DUMP_SECONDS = 6 * 3600
+# sustained source write load one destination vCPU can replay during CDC
+WRITES_PER_SECOND_PER_CPU = 2000
+COMMITS_PER_SECOND_PER_CPU = 500
+# cloud SQL custom tiers: 1 or an even number of vCPUs up to 96, 0.9 to 6.5 GB per vCPU in multiples of 256 MB
+MIN_CPU = 2
+MAX_CPU = 96
+MEM_MB_PER_CPU = 3840
+MIN_MEM_MB = 3840
+# disk: free space on top of the data, WAL kept by checkpoints, and the minimum disk size of cloud SQL
+DATA_HEADROOM = 0.2
+WAL_RESERVE_BYTES = 2 * GB
+MIN_STORAGE_GB = 10
+# WAL bytes per written row, used when the WAL position can't be sampled
+WAL_BYTES_PER_WRITE = 150
+
+
+class WorkloadSampler:
+    """
+    Measures what a source needs from its destination: the size of every table (with TOAST and indexes)
+    from the GetTables scan, and commit, row write and WAL rates from pg_stat_database, pg_stat_user_tables
+    and the WAL position, sampled over `sample_seconds`. With `sample_seconds` 0 the rates are averaged since
+    the statistics were last reset, and WAL is estimated from the row writes.
+    """
+    def __init__(self, str_con_src, workers=DEFAULT_WORKERS, sample_seconds=10):
+        self._str_con_src = str_con_src
+        self._workers = workers
+        self._sample_seconds = sample_seconds
+
+    def measure(self):
+        """
+        :return: dict of data_bytes, databases, commits_per_second, writes_per_second, wal_bytes_per_second
+        """
+        pool = ConnectionPool(self._str_con_src, maxconn=1)
+        try:
+            tables = GetTables(self._str_con_src, workers=self._workers, pool=pool, discover=False,
+                               include_toast=True, include_indexes=True)
+            tables.get_databases()
+            first = self._counters(pool, tables.list_database)
+            # the table scan runs during the sampling window
+            tables.get_tables()
+            if self._sample_seconds:
+                time.sleep(max(0, first["at"] + self._sample_seconds - time.time()))
+                second = self._counters(pool, tables.list_database)
+                elapsed = max(second["at"] - first["at"], 1e-3)
+                commits = (second["commits"] - first["commits"]) / elapsed
+                writes = (second["writes"] - first["writes"]) / elapsed
+                wal = (second["wal"] - first["wal"]) / elapsed if first["wal"] is not None else None
+            else:
+                elapsed = max(first["at"] - first["since"], 1)
+                commits = first["commits"] / elapsed
+                writes = first["writes"] / elapsed
+                wal = None
+        finally:
+            pool.close()
+        return {
+            "data_bytes": sum(size for _, _, _, _, _, size in tables.table_rows),
+            "databases": len(tables.list_database),
+            "commits_per_second": commits,
+            "writes_per_second": writes,
+            "wal_bytes_per_second": wal if wal is not None else writes * WAL_BYTES_PER_WRITE,
+        }
+
+    def _counters(self, pool, list_database):
+        with pool.connection("postgres") as conn, conn.cursor() as cur:
+            cur.execute(SQL_TO_GET_DATABASE_ACTIVITY, (list_database,))
+            commits, at, since = cur.fetchone()
+            cur.execute("SHOW server_version_num")
+            legacy = int(cur.fetchone()[0]) < 100000
+            try:
+                cur.execute(SQL_TO_GET_WAL_POSITION_LEGACY if legacy else SQL_TO_GET_WAL_POSITION)
+                wal = float(cur.fetchone()[0])
+            except Exception:
+                # e.g. a read replica, or missing privileges on the WAL functions
+                wal = None
+
+        def writes_of_database(db):
+            with pool.connection(db) as conn, conn.cursor() as cur:
+                cur.execute(SQL_TO_GET_TABLE_WRITES)
+                return float(cur.fetchone()[0])
+
+        writes = sum(parallel_map(writes_of_database, list_database, self._workers))
+        return {"at": float(at), "since": float(since), "commits": float(commits), "writes": writes, "wal": wal}
+
+
+def memory_mb(cpu):
+    """
+    :return: memory in MB of a custom tier of `cpu` vCPUs, within the per vCPU limits of cloud SQL
+    """
+    return max(MIN_MEM_MB, cpu * MEM_MB_PER_CPU // 256 * 256)
+
+
+def recommend(workload):
+    """
+    Recommend a cloud SQL tier and disk for a measured workload, see WorkloadSampler.measure.
+    :return: dict of cpu, mem (MB), storage (GB), tier, and the estimated dump_seconds
+    """
+    cpu = max(MIN_CPU,
+              math.ceil(workload["data_bytes"] / (DUMP_BYTES_PER_SECOND_PER_CPU * TARGET_DUMP_SECONDS)),
+              math.ceil(workload["writes_per_second"] / WRITES_PER_SECOND_PER_CPU),
+              math.ceil(workload["commits_per_second"] / COMMITS_PER_SECOND_PER_CPU))
+    cpu = min(MAX_CPU, cpu + cpu % 2)
+    mem = memory_mb(cpu)
+    dump_seconds = workload["data_bytes"] / (DUMP_BYTES_PER_SECOND_PER_CPU * cpu)
+    # changes written on the source during the dump are replayed on the destination once it finishes
+    storage_bytes = workload["data_bytes"] * (1 + DATA_HEADROOM) + WAL_RESERVE_BYTES \
+        + workload["wal_bytes_per_second"] * dump_seconds
+    storage = max(MIN_STORAGE_GB, math.ceil(storage_bytes / GB))
+    return {"cpu": cpu, "mem": mem, "storage": storage, "tier": f"db-custom-{cpu}-{mem}",
+            "dump_seconds": dump_seconds}
@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+SOURCE_PROFILE = 'source_profile'
+DESTINATION_PROFILE = 'destination_profile'
+JOB_CREATED = 'job_created'
+JOB_STARTED = 'job_started'
+CDC_REACHED = 'cdc_reached'
+PROMOTED = 'promoted'
+SEQUENCES_SYNCED = 'sequences_synced'
+WARMED_UP = 'warmed_up'
+# native engine: a copied database is recorded as 'native_copied:<database>', the whole source as 'native_copied'
+NATIVE_COPIED = 'native_copied'
+CUTOVER_DONE = 'cutover_done'
+
+
+class StateStore:
+    """
+    Local record of the migration steps completed for every database, one JSON file per database
+    under `{state_dir}/sync/`. Files are replaced atomically, so a crash never leaves a partial record.
+    """
+    def __init__(self, state_dir):
+        self._dir = os.path.join(state_dir, "sync")
+        self._lock = threading.Lock()
+
+    def get(self, dbname):
+        """
+        :return: dict of the record of a database, with the completed steps under "steps"
+        """
+        try:
+            with open(self._path(dbname)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"steps": {}}
+
+    def update(self, dbname, **fields):
+        with self._lock:
+            record = self.get(dbname)
+            record.update(fields)
+            self._write(dbname, record)
+        return record
+
+    def mark(self, dbname, step, **fields):
+        """
+        Record that a step completed, together with any value needed to resume after it.
+        """
+        with self._lock:
+            record = self.get(dbname)
+            record.update(fields)
+            record["steps"][step] = time.time()
+            self._write(dbname, record)
+        return record
+
+    def done(self, dbname, step):
+        return step in self.get(dbname)["steps"]
+
+    def clear(self, dbname):
+        with self._lock:
+            try:
+                os.remove(self._path(dbname))
+            except FileNotFoundError:
+                pass
+
+    def _path(self, dbname):
+        return os.path.join(self._dir, f"{dbname}.json")
+
+    def _write(self, dbname, record):
+        write_json(self._path(dbname), record)
+
+
+def write_json(path, record):
+    """
+    Write a JSON file atomically: a crash leaves either the previous or the new content.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
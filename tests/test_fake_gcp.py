@@ -0,0 +1,146 @@
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from yaml import safe_dump
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dms import DataMigrationService, MJ_PREFIX, CP_SRC_PREFIX  # noqa: E402
+from fake_gcp import FakeGcp, _raise  # noqa: E402
+from gcp import GcpApi  # noqa: E402
+from state import JOB_CREATED  # noqa: E402
+
+DATABASES = [f"fleet-{i}" for i in range(4)]
+FAILING = DATABASES[1]
+
+
+def _entry():
+    # the source is never reached: the connection test is patched and, unmeasured, the throughput is not recorded
+    return {"aws-host": "127.0.0.1", "aws-port": 1, "aws-replication-username": "postgres",
+            "aws-replication-password": "postgres", "gcp-database-version": "POSTGRES_11", "gcp-instance-cpu": 2,
+            "gcp-instance-mem": 7680, "gcp-instance-region": "region-0", "gcp-instance-storage": 20,
+            "gcp-ip-config": {"enableIpv4": True}, "gcp-project-id": "test-project"}
+
+
+class FakeGcpTest(unittest.TestCase):
+    """
+    sync_all, its resume and cleanup_all against the in-process DMS/Cloud SQL emulator.
+    """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        config_path = os.path.join(self.tmp.name, "config.yaml")
+        with open(config_path, "w") as f:
+            safe_dump({dbname: _entry() for dbname in DATABASES}, f, sort_keys=False)
+        self.fake = FakeGcp(provision_seconds=0.1, full_dump_seconds=0.3, promote_seconds=0.1, operation_seconds=0.1,
+                            failing_jobs={f"{MJ_PREFIX}{FAILING}"})
+        self.service = DataMigrationService(config=config_path, state_dir=os.path.join(self.tmp.name, "state"))
+        sys.stdout = sys.__stdout__
+        self.service._logger.setLevel(logging.ERROR)
+        self.service._gcp = GcpApi(logger=self.service._logger, build=self.fake.build, poll_interval=0.1)
+        patcher = mock.patch.object(DataMigrationService, "test_connection", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _sync_all(self):
+        self.service.sync_all(preflight=False, report_interval=3600)
+        return dict(self.service._status)
+
+    def test_failing_job_does_not_stop_the_others(self):
+        status = self._sync_all()
+
+        self.assertTrue(status.pop(FAILING).startswith("FAILED"))
+        self.assertEqual(status, {dbname: "DONE" for dbname in DATABASES if dbname != FAILING})
+        for dbname in DATABASES:
+            self.assertIn(f"projects/test-project/locations/region-0/migrationJobs/{MJ_PREFIX}{dbname}",
+                          self.fake.jobs)
+
+    def test_resume_makes_no_api_call(self):
+        self.fake.failing_jobs.clear()
+        self._sync_all()
+        calls = self.fake.total_calls
+
+        status = self._sync_all()
+
+        self.assertEqual(status, {dbname: "DONE" for dbname in DATABASES})
+        self.assertEqual(self.fake.total_calls, calls)
+
+    def test_resumed_job_is_started_once_created(self):
+        # a crash right after the create request: the job is found, still CREATING, by the resumed sync
+        self.fake.failing_jobs.clear()
+        self.fake.job_creation_seconds = 0.5
+        dbname = DATABASES[0]
+        parent = "projects/test-project/locations/region-0"
+        self.fake.call("migrationJobs.create", parent=parent, migrationJobId=f"{MJ_PREFIX}{dbname}", body={
+            "type": "CONTINUOUS", "source": f"{parent}/connectionProfiles/{CP_SRC_PREFIX}{dbname}",
+            "destination": f"{parent}/connectionProfiles/{self.service._destination_profile_id(dbname)}"})
+
+        status = self._sync_all()
+
+        self.assertEqual(status, {dbname: "DONE" for dbname in DATABASES})
+        self.assertEqual(self.fake.calls["migrationJobs.create"], len(DATABASES))
+
+    def test_cleanup_all_deletes_every_migration_resource(self):
+        self._sync_all()
+        destinations = {name for name in self.fake.profiles if f"/{CP_SRC_PREFIX}" not in name}
+
+        self.service.cleanup_all()
+
+        self.assertEqual(self.fake.jobs, {})
+        # the destination instances and their profiles are the migrated databases, they are kept
+        self.assertEqual(set(self.fake.profiles), destinations)
+        self.assertEqual([_ for _ in self.fake.instances if _[1].endswith("-master")], [])
+        for dbname in DATABASES:
+            self.assertFalse(self.service._state.done(dbname, JOB_CREATED))
+
+    def test_cleanup_all_keeps_the_resources_of_a_job_it_failed_to_delete(self):
+        self._sync_all()
+        delete = self.fake._migrationJobs_delete
+
+        def failing_delete(name):
+            if name.endswith(f"/{MJ_PREFIX}{FAILING}"):
+                _raise(400, f"migration job {name} can't be deleted")
+            return delete(name)
+
+        with mock.patch.object(self.fake, "_migrationJobs_delete", failing_delete):
+            self.service.cleanup_all()
+
+        self.assertEqual([_.rsplit("/", 1)[-1] for _ in self.fake.jobs], [f"{MJ_PREFIX}{FAILING}"])
+        self.assertEqual([_.rsplit("/", 1)[-1] for _ in self.fake.profiles if f"/{CP_SRC_PREFIX}" in _],
+                         [f"{CP_SRC_PREFIX}{FAILING}"])
+        self.assertEqual([_[1] for _ in self.fake.instances if _[1].endswith("-master")],
+                         [f"{self.service._destination_profile_id(FAILING)}-master"])
+        for dbname in DATABASES:
+            self.assertEqual(self.service._state.done(dbname, JOB_CREATED), dbname == FAILING)
+
+        # the next cleanup resumes the database left
+        self.service.cleanup_all()
+        self.assertEqual(self.fake.jobs, {})
+
+    def test_cleanup_all_reports_a_job_it_could_not_read(self):
+        self._sync_all()
+        get = self.fake._migrationJobs_get
+
+        def forbidden_get(name):
+            if name.endswith(f"/{MJ_PREFIX}{FAILING}"):
+                _raise(403, f"permission denied on {name}")
+            return get(name)
+
+        with mock.patch.object(self.fake, "_migrationJobs_get", forbidden_get), \
+                self.assertLogs(self.service._logger, logging.INFO) as logs:
+            self.service.cleanup_all()
+
+        self.assertEqual([_.rsplit("/", 1)[-1] for _ in self.fake.jobs], [f"{MJ_PREFIX}{FAILING}"])
+        self.assertTrue(self.service._state.done(FAILING, JOB_CREATED))
+        self.assertTrue(any(f"cleanup {FAILING}: FAILED" in _ for _ in logs.output))
+        self.assertTrue(any("3 deleted, 1 failed, 0 not found" in _ for _ in logs.output))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import contextlib
+import os
+import shutil
+import sys
+import unittest
+import uuid
+
+import psycopg2
+from psycopg2 import sql
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from get_metadata import parse_connection_string  # noqa: E402
+from native import NativeCopier  # noqa: E402
+
+# the docker-compose pair, see docker-compose.yml
+SOURCE = os.environ.get("TEST_SOURCE", "localhost:5432:postgres:postgres")
+DESTINATION = os.environ.get("TEST_DESTINATION", "localhost:5433:postgres:postgres")
+# directory of pg_dump and psql, defaults to the PATH
+PG_BIN = os.environ.get("TEST_PG_BIN")
+
+# rows of every table of the copied database
+TABLES = {"shop.customer": 1000, "shop.orders": 5000, "public.note": 0}
+
+
+@contextlib.contextmanager
+def _cursor(str_con, db="postgres"):
+    conn = psycopg2.connect(dbname=db, connect_timeout=3, **parse_connection_string(str_con))
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            yield cur
+    finally:
+        conn.close()
+
+
+def _reachable(str_con):
+    try:
+        with _cursor(str_con):
+            return True
+    except psycopg2.Error:
+        return False
+
+
+def _client_installed():
+    return all(os.path.exists(os.path.join(PG_BIN, _)) if PG_BIN else shutil.which(_) for _ in ("pg_dump", "psql"))
+
+
+@unittest.skipUnless(_client_installed(), "pg_dump or psql not found, set TEST_PG_BIN")
+@unittest.skipUnless(_reachable(SOURCE) and _reachable(DESTINATION),
+                     "source or destination postgres is unreachable, run docker-compose up -d")
+class NativeCopierTest(unittest.TestCase):
+    """
+    Copies a small database with pg_dump and COPY pipes between the docker-compose source and destination.
+    """
+    def setUp(self):
+        self.db = f"native_test_{uuid.uuid4().hex[:8]}"
+        with _cursor(SOURCE) as cur:
+            cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(self.db)))
+        with _cursor(SOURCE, self.db) as cur:
+            cur.execute("CREATE SCHEMA shop")
+            cur.execute("CREATE TABLE shop.customer (id serial PRIMARY KEY, name text NOT NULL, data bytea)")
+            cur.execute("CREATE TABLE shop.orders (id bigserial PRIMARY KEY, "
+                        "customer_id int NOT NULL REFERENCES shop.customer, amount numeric(10, 2), "
+                        "created timestamptz DEFAULT now())")
+            cur.execute("CREATE INDEX ON shop.orders (customer_id)")
+            cur.execute("CREATE TABLE public.note (id int PRIMARY KEY, body text)")
+            cur.execute("INSERT INTO shop.customer (name, data) "
+                        "SELECT 'customer ' || i, decode(md5(i::text), 'hex') FROM generate_series(1, 1000) i")
+            cur.execute("INSERT INTO shop.orders (customer_id, amount) "
+                        "SELECT i % 1000 + 1, i / 100.0 FROM generate_series(1, 5000) i")
+
+    def tearDown(self):
+        for str_con in (SOURCE, DESTINATION):
+            with _cursor(str_con) as cur:
+                cur.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(self.db)))
+
+    def _counts(self, str_con):
+        counts = {}
+        with _cursor(str_con, self.db) as cur:
+            for table in TABLES:
+                cur.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(*table.split("."))))
+                counts[table] = cur.fetchone()[0]
+        return counts
+
+    def test_copy_database(self):
+        tables, _ = NativeCopier(SOURCE, DESTINATION, workers=2, pg_bin=PG_BIN).copy_database(self.db)
+
+        self.assertEqual(tables, len(TABLES))
+        self.assertEqual(self._counts(SOURCE), TABLES)
+        self.assertEqual(self._counts(DESTINATION), TABLES)
+        with _cursor(DESTINATION, self.db) as cur:
+            # post-data: indexes and constraints follow the rows
+            cur.execute("SELECT count(*) FROM pg_catalog.pg_indexes WHERE schemaname = 'shop'")
+            self.assertEqual(cur.fetchone()[0], 3)
+            cur.execute("SELECT count(*) FROM pg_catalog.pg_constraint WHERE contype = 'f'")
+            self.assertEqual(cur.fetchone()[0], 1)
+
+    def test_destination_with_tables_is_refused(self):
+        with _cursor(DESTINATION) as cur:
+            cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(self.db)))
+        with _cursor(DESTINATION, self.db) as cur:
+            cur.execute("CREATE TABLE public.note (id int PRIMARY KEY, body text)")
+
+        with self.assertRaisesRegex(Exception, "already has 1 tables"):
+            NativeCopier(SOURCE, DESTINATION, workers=2, pg_bin=PG_BIN).copy_database(self.db)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from planner import schedule  # noqa: E402
+
+
+def _item(dbname, seconds, project="p1", region="r1", source="s1"):
+    return {"dbname": dbname, "project": project, "region": region, "source": source, "seconds": seconds}
+
+
+def _max_concurrent(planned, key):
+    """
+    :return: dict of key value to the most migrations of it running at the same time
+    """
+    most = {}
+    for item in planned:
+        running = [_ for _ in planned if _["start"] <= item["start"] < _["end"] and key(_) == key(item)]
+        most[key(item)] = max(most.get(key(item), 0), len(running))
+    return most
+
+
+class ScheduleTest(unittest.TestCase):
+    def test_makespan_and_waves(self):
+        cases = [
+            ("one worker runs them in a row, longest first",
+             [_item("a", 1), _item("b", 3), _item("c", 2)], 1, {},
+             ["b", "c", "a"], [0, 1, 2], 6),
+            ("longest first fills the workers",
+             [_item("a", 1), _item("b", 4), _item("c", 2), _item("d", 3)], 2, {},
+             ["b", "d", "c", "a"], [0, 0, 1, 2], 5),
+            ("more workers than migrations",
+             [_item("a", 1), _item("b", 2)], 8, {},
+             ["b", "a"], [0, 0], 2),
+            ("one per region, regions in parallel",
+             [_item("a", 4), _item("b", 1), _item("c", 3, region="r2")], 3, {"per_region": 1},
+             ["a", "c", "b"], [0, 0, 1], 5),
+            ("one per project across its regions",
+             [_item("a", 4), _item("b", 3, region="r2"), _item("c", 2, project="p2")], 3,
+             {"per_region": None, "per_project": 1},
+             ["a", "c", "b"], [0, 0, 1], 7),
+            ("one per source, a shorter migration of another source goes first",
+             [_item("a", 4), _item("b", 3), _item("c", 1, source="s2")], 2, {"per_region": None, "per_source": 1},
+             ["a", "c", "b"], [0, 0, 1], 7),
+            ("nothing to plan",
+             [], 4, {}, [], [], 0.0),
+        ]
+        for name, items, workers, caps, order, waves, makespan in cases:
+            with self.subTest(name):
+                caps = dict({"per_region": None}, **caps)
+                planned, total = schedule(items, workers, caps.pop("per_region"), **caps)
+                self.assertEqual([_["dbname"] for _ in planned], order)
+                self.assertEqual([_["wave"] for _ in planned], waves)
+                self.assertEqual(total, makespan)
+                for item in planned:
+                    self.assertEqual(item["end"] - item["start"], item["seconds"])
+
+    def test_caps_are_never_exceeded(self):
+        items = [_item(f"db{i}", 10 + i * 7 % 13, project=f"p{i % 2}", region=f"r{i % 3}", source=f"s{i % 4}")
+                 for i in range(40)]
+        cases = [
+            (6, 2, None, None),
+            (6, None, 2, None),
+            (6, None, None, 1),
+            (8, 2, 3, 1),
+        ]
+        for workers, per_region, per_project, per_source in cases:
+            with self.subTest(workers=workers, per_region=per_region, per_project=per_project,
+                              per_source=per_source):
+                planned, makespan = schedule(items, workers, per_region, per_project=per_project,
+                                             per_source=per_source)
+                self.assertEqual(sorted(_["dbname"] for _ in planned), sorted(_["dbname"] for _ in items))
+                self.assertEqual(makespan, max(_["end"] for _ in planned))
+                for key, cap in ((lambda _: None, workers),
+                                 (lambda _: (_["project"], _["region"]), per_region),
+                                 (lambda _: _["project"], per_project),
+                                 (lambda _: _["source"], per_source)):
+                    if cap is not None:
+                        self.assertLessEqual(max(_max_concurrent(planned, key).values()), cap)
+
+    def test_workers_must_be_positive(self):
+        for workers in (0, -1, None):
+            with self.subTest(workers=workers):
+                with self.assertRaisesRegex(Exception, "workers must be at least 1"):
+                    schedule([_item("a", 1)], workers, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
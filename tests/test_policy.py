@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import unittest
+from email.utils import formatdate
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from policy import RetryPolicy, PollPolicy  # noqa: E402
+
+
+def _error(status, retry_after=None):
+    headers = {"status": status}
+    if retry_after is not None:
+        headers["retry-after"] = retry_after
+    return HttpError(httplib2.Response(headers), b"{}")
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_retryable(self):
+        policy = RetryPolicy()
+        cases = [
+            (429, "POST", True),
+            (503, "POST", True),
+            (503, None, True),
+            (500, "GET", True),
+            (502, "get", True),
+            (504, "POST", False),
+            (500, None, False),
+            (404, "GET", False),
+            (403, "GET", False),
+        ]
+        for status, method, expected in cases:
+            with self.subTest(status=status, method=method):
+                self.assertEqual(policy.retryable(_error(status), method), expected)
+        self.assertFalse(policy.retryable(ValueError("not an http error"), "GET"))
+
+    def test_backoff_is_jittered_under_an_exponential_bound(self):
+        policy = RetryPolicy(base=1.0, cap=10.0)
+        for attempt, bound in ((1, 1.0), (2, 2.0), (3, 4.0), (4, 8.0), (5, 10.0), (20, 10.0)):
+            with self.subTest(attempt=attempt):
+                delays = [policy.delay(attempt) for _ in range(200)]
+                self.assertTrue(all(0 <= _ <= bound for _ in delays))
+                # full jitter: spread over the whole range, not clustered at the bound
+                self.assertLess(min(delays), bound / 4)
+                self.assertGreater(max(delays), bound * 3 / 4)
+
+    def test_retry_after(self):
+        policy = RetryPolicy(cap=30.0)
+        self.assertEqual(policy.delay(1, _error(429, "7")), 7.0)
+        self.assertEqual(policy.delay(1, _error(429, "120")), 30.0)
+        self.assertEqual(policy.delay(1, _error(429, "-3")), 0.0)
+        self.assertAlmostEqual(policy.delay(1, _error(503, formatdate(time.time() + 10, usegmt=True))), 10, delta=1.5)
+        # unparsable: the backoff applies
+        self.assertLessEqual(policy.delay(1, _error(503, "soon")), policy.base)
+
+    @mock.patch("policy.time.sleep")
+    def test_call_retries_until_success(self, sleep):
+        policy = RetryPolicy(max_attempts=5, base=0.5)
+        results = [_error(503), _error(429, "2"), "done"]
+        retries = []
+
+        def attempt():
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.assertEqual(policy.call(attempt, "POST", on_retry=lambda *_: retries.append(_)), "done")
+        self.assertEqual([attempt for attempt, _, _ in retries], [1, 2])
+        self.assertEqual(retries[1][2], 2.0)
+        self.assertEqual(sleep.call_count, 2)
+
+    @mock.patch("policy.time.sleep")
+    def test_call_gives_up(self, sleep):
+        cases = [
+            ("not retryable", RetryPolicy(), _error(404), 1),
+            ("unsafe method", RetryPolicy(), _error(500), 1),
+            ("max attempts", RetryPolicy(max_attempts=3), _error(503), 3),
+            ("deadline", RetryPolicy(deadline=5), _error(503, "10"), 1),
+        ]
+        for name, policy, error, attempts in cases:
+            with self.subTest(name):
+                calls = []
+
+                def attempt():
+                    calls.append(1)
+                    raise error
+
+                with self.assertRaises(HttpError):
+                    policy.call(attempt, "POST")
+                self.assertEqual(len(calls), attempts)
+
+
+class PollPolicyTest(unittest.TestCase):
+    def test_ceiling_follows_the_phase(self):
+        policy = PollPolicy(interval=5, fast=1, slow=30)
+        cases = [
+            (None, 1),
+            ({"state": "CREATING"}, 1),
+            ({"state": "NOT_STARTED"}, 1),
+            ({"state": "RUNNING", "phase": "FULL_DUMP"}, 30),
+            ({"state": "RUNNING", "phase": "CDC"}, 5),
+            ({"state": "RUNNING", "phase": "PROMOTE_IN_PROGRESS"}, 1),
+            ({"state": "READY"}, 5),
+        ]
+        for body, expected in cases:
+            with self.subTest(body=body):
+                self.assertEqual(policy.ceiling(body), expected)
+
+    def test_defaults(self):
+        policy = PollPolicy(interval=5)
+        self.assertEqual((policy.fast, policy.slow), (2, 30))
+        policy = PollPolicy(interval=60)
+        self.assertEqual((policy.fast, policy.slow), (2, 60))
+
+    def test_interval_backs_off_while_nothing_changes(self):
+        policy = PollPolicy(interval=5, fast=1, slow=30, growth=2)
+        cases = [
+            (None, False, 30, 1),
+            (1, False, 30, 2),
+            (16, False, 30, 30),
+            (4, False, 5, 5),
+            (16, True, 30, 1),
+            (None, False, 0.5, 0.5),
+        ]
+        for previous, changed, ceiling, expected in cases:
+            with self.subTest(previous=previous, changed=changed, ceiling=ceiling):
+                self.assertEqual(policy.next_interval(previous, changed, ceiling), expected)
+
+    def test_jitter_bounds(self):
+        policy = PollPolicy(jitter=0.2)
+        intervals = [policy.jittered(10) for _ in range(200)]
+        self.assertTrue(all(8 <= _ <= 12 for _ in intervals))
+        self.assertGreater(len(set(intervals)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,282 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from psycopg2 import sql
+
+from get_metadata import GetTables, ConnectionPool, parallel_map
+from get_metadata_sql import SQL_TO_GET_PRIMARY_KEYS, SQL_TO_GET_ESTIMATED_ROWS
+
+# keys sampled per chunk to place the chunk boundaries, and at most for a table
+SAMPLE_KEYS_PER_CHUNK = 20
+MAX_SAMPLE_KEYS = 100000
+# bytes per row assumed for a table never analyzed
+ESTIMATED_ROW_BYTES = 100
+MATCH = 'match'
+MISMATCH = 'mismatch'
+ERROR = 'error'
+
+# planner's row count of a table, and its size to estimate one for a table never analyzed
+SQL_TABLE_ROWS = "SELECT c.reltuples::bigint, pg_relation_size(c.oid) FROM pg_catalog.pg_class c WHERE c.oid = %s::regclass"
+
+# order independent checksum of a set of rows, so chunks don't need to be sorted
+SQL_CHUNK_CHECKSUM = "SELECT count(*), coalesce(sum(('x' || substr(md5(t::text), 1, 16))::bit(64)::bigint::numeric), 0)::text " \
+                     "FROM {}.{} t"
+
+
+class Throttle:
+    """
+    Spaces calls to `wait` so that at most `rate` of them pass per second, across threads.
+    """
+    def __init__(self, rate=None):
+        self._interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self._interval
+        time.sleep(max(0, at - now))
+
+
+class ValidationStore:
+    """
+    SQLite record of the planned chunks of every table and of their last check.
+    A chunk is a range of primary key values, `key`, `lo` and `hi` are JSON lists of the key columns and of their
+    values as text; no `lo` or no `hi` leaves the range open on that side.
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS chunk (database TEXT, schema TEXT, "table" TEXT, key TEXT, lo TEXT,
+                hi TEXT, src_count INTEGER, dst_count INTEGER, src_hash TEXT, dst_hash TEXT, status TEXT,
+                error TEXT, checked_at REAL);
+            CREATE INDEX IF NOT EXISTS chunk_table ON chunk (database, schema, "table");
+        """)
+
+    def close(self):
+        self._db.close()
+
+    def chunks(self, database, schema, table):
+        """
+        :return: list of chunk dicts of a table, empty if it was not planned yet
+        """
+        with self._lock:
+            cur = self._db.execute('SELECT rowid, key, lo, hi, status FROM chunk '
+                                   'WHERE database = ? AND schema = ? AND "table" = ? ORDER BY rowid',
+                                   (database, schema, table))
+            rows = cur.fetchall()
+        return [{"id": id, "database": database, "schema": schema, "table": table, "key": _loads(key),
+                 "lo": _loads(lo), "hi": _loads(hi), "status": status} for id, key, lo, hi, status in rows]
+
+    def plan(self, database, schema, table, key, ranges):
+        """
+        :param key: list of (column, type) of the primary key, None for a table checked as one chunk
+        :param ranges: list of (lo, hi) lists of key values as text, or None
+        """
+        with self._lock, self._db:
+            self._db.executemany('INSERT INTO chunk (database, schema, "table", key, lo, hi) VALUES (?, ?, ?, ?, ?, ?)',
+                                 [(database, schema, table, _dumps(key), _dumps(lo), _dumps(hi)) for lo, hi in ranges])
+
+    def record(self, chunk_id, src, dst, status, error=None):
+        with self._lock, self._db:
+            self._db.execute("UPDATE chunk SET src_count = ?, src_hash = ?, dst_count = ?, dst_hash = ?, status = ?, "
+                             "error = ?, checked_at = ? WHERE rowid = ?",
+                             (src[0], src[1], dst[0], dst[1], status, error, time.time(), chunk_id))
+
+    def summary(self):
+        """
+        :return: list of per table (database, schema, table, src rows, dst rows, chunks, mismatching chunks)
+        """
+        with self._lock:
+            cur = self._db.execute(f'SELECT database, schema, "table", sum(src_count), sum(dst_count), count(*), '
+                                   f"sum(CASE WHEN status = '{MATCH}' THEN 0 ELSE 1 END) "
+                                   f'FROM chunk GROUP BY 1, 2, 3 ORDER BY 1, 2, 3')
+            return cur.fetchall()
+
+
+class DataValidator:
+    """
+    Compares row counts and chunked checksums of every table between source and destination.
+    Tables with a primary key (of any type, composite or not) are split in ranges of about `chunk_rows` rows,
+    between boundaries taken from a sample of their keys; tables without primary key are one chunk.
+    The first and last ranges are open, so rows written on the source after the plan are in a chunk, and the
+    last chunk of a table is checked again on every run. Other chunks that matched in a previous run are not.
+    Chunks run in parallel on `workers` threads, and source queries are throttled to `rate` per second.
+    """
+    def __init__(self, str_con_src, str_con_dst, store, workers=4, chunk_rows=100000, rate=None):
+        self._str_con_src = str_con_src
+        self._store = store
+        self._workers = workers
+        self._chunk_rows = chunk_rows
+        self._throttle = Throttle(rate)
+        self._src = ConnectionPool(str_con_src, maxconn=workers)
+        self._dst = ConnectionPool(str_con_dst, maxconn=workers)
+
+    def close(self):
+        self._src.close()
+        self._dst.close()
+
+    def tables(self):
+        """
+        :return: list of (database, schema, table) of the source; partitioned tables are checked through
+                 their partitions
+        """
+        with GetTables(self._str_con_src, workers=self._workers) as src:
+            parents = {(db, parent_schema, parent_table)
+                       for db, _, _, parent_schema, parent_table, _ in src.table_rows if parent_table is not None}
+            return [(db, schema, table) for db, schema, table, _, _, _ in src.table_rows
+                    if (db, schema, table) not in parents]
+
+    def estimate(self):
+        """
+        Compare the planner's row estimates of both sides.
+        :return: list of (database, schema, table, src rows, dst rows)
+        """
+        tables = self.tables()
+        schemas = _schemas(tables)
+
+        def estimates(job):
+            _, pool, db = job
+            with pool.connection(db) as conn, conn.cursor() as cur:
+                cur.execute(SQL_TO_GET_ESTIMATED_ROWS, (schemas[db],))
+                return {(db, schema, table): rows for schema, table, rows in cur.fetchall()}
+
+        jobs = [(side, pool, db) for side, pool in ((0, self._src), (1, self._dst)) for db in schemas]
+        rows = ({}, {})
+        for (side, _, _), estimated in zip(jobs, parallel_map(estimates, jobs, self._workers)):
+            rows[side].update(estimated)
+        return [key + (rows[0].get(key), rows[1].get(key)) for key in tables]
+
+    def plan(self, recheck=False):
+        """
+        Split every table in chunks, reusing the chunks already planned in the store.
+        :return: list of chunks to check
+        """
+        tables = self.tables()
+        schemas = _schemas(tables)
+        primary_keys = {}
+        for rows in parallel_map(lambda db: self._primary_keys(db, schemas[db]), list(schemas), self._workers):
+            primary_keys.update(rows)
+
+        def chunks_of_table(key):
+            chunks = self._store.chunks(*key)
+            if not chunks:
+                pk = [list(_) for _ in zip(*primary_keys[key])] if key in primary_keys else None
+                self._store.plan(*key, pk, self._ranges(key, pk))
+                chunks = self._store.chunks(*key)
+            return [_ for _ in chunks if recheck or _["status"] != MATCH or _["hi"] is None]
+
+        return [chunk for chunks in parallel_map(chunks_of_table, tables, self._workers) for chunk in chunks]
+
+    def check(self, chunks):
+        """
+        Checksum the chunks on both sides and record the result in the store.
+        :return: number of mismatching chunks
+        """
+        return sum(parallel_map(self._check_chunk, chunks, self._workers))
+
+    def _primary_keys(self, db, schemas):
+        with self._src.connection(db) as conn, conn.cursor() as cur:
+            cur.execute(SQL_TO_GET_PRIMARY_KEYS, (schemas,))
+            return {(db, schema, table): (columns, types) for schema, table, columns, types in cur.fetchall()}
+
+    def _ranges(self, key, pk):
+        """
+        :return: list of (lo, hi) ranges of `chunk_rows` rows, between boundaries taken at even intervals of a
+                 sorted sample of the keys (TABLESAMPLE BERNOULLI, rows rather than pages, so a few keys per chunk
+                 are spread evenly)
+        """
+        if pk is None:
+            return [(None, None)]
+        db, schema, table = key
+        relation = sql.Identifier(schema, table)
+        # qualified, or ORDER BY would sort the text outputs of the same names
+        columns = sql.SQL(", ").join(sql.Identifier("t", column) for column, _ in pk)
+        self._throttle.wait()
+        with self._src.connection(db) as conn, conn.cursor() as cur:
+            cur.execute(SQL_TABLE_ROWS, (relation.as_string(conn),))
+            rows, size = cur.fetchone()
+            rows = rows if rows > 0 else size / ESTIMATED_ROW_BYTES
+            chunks = math.ceil(rows / self._chunk_rows)
+            if chunks <= 1:
+                return [(None, None)]
+            share = min(1.0, min(MAX_SAMPLE_KEYS, chunks * SAMPLE_KEYS_PER_CHUNK) / rows)
+            texts = sql.SQL(", ").join(sql.SQL("{}::text").format(sql.Identifier(column)) for column, _ in pk)
+            if conn.server_version >= 90500:
+                query = sql.SQL("SELECT {} FROM {} t TABLESAMPLE BERNOULLI (%s) ORDER BY {}").format(
+                    texts, relation, columns)
+                params = (share * 100,)
+            else:
+                query = sql.SQL("SELECT {} FROM {} t WHERE random() < %s ORDER BY {}").format(texts, relation, columns)
+                params = (share,)
+            self._throttle.wait()
+            cur.execute(query, params)
+            sample = [list(_) for _ in cur.fetchall()]
+        boundaries = []
+        for index in range(1, chunks):
+            boundary = sample[index * len(sample) // chunks] if sample else None
+            if boundary is not None and boundary not in boundaries:
+                boundaries.append(boundary)
+        edges = [None] + boundaries + [None]
+        return list(zip(edges, edges[1:]))
+
+    def _checksum(self, pool, chunk):
+        query = sql.SQL(SQL_CHUNK_CHECKSUM).format(sql.Identifier(chunk["schema"]), sql.Identifier(chunk["table"]))
+        conditions, params = [], []
+        if chunk["key"] is not None:
+            columns = sql.SQL(", ").join(sql.Identifier(column) for column, _ in chunk["key"])
+            # key values are kept as text, cast back to the type of their column to compare as the index does
+            casts = sql.SQL(", ").join(sql.SQL("%s::{}").format(sql.SQL(type_)) for _, type_ in chunk["key"])
+            for operator, values in ((">=", chunk["lo"]), ("<", chunk["hi"])):
+                if values is not None:
+                    conditions.append(sql.SQL("ROW({}) {} ROW({})").format(columns, sql.SQL(operator), casts))
+                    params.extend(values)
+        if conditions:
+            query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+        with pool.connection(chunk["database"]) as conn, conn.cursor() as cur:
+            # float text output differs between versions unless the digits are fixed
+            cur.execute("SET extra_float_digits = 3")
+            cur.execute(query, params or None)
+            return cur.fetchone()
+
+    def _check_chunk(self, chunk):
+        """
+        :return: 0 if the chunk matches, 1 otherwise
+        """
+        src, dst = (None, None), (None, None)
+        try:
+            self._throttle.wait()
+            src = self._checksum(self._src, chunk)
+            dst = self._checksum(self._dst, chunk)
+        except Exception as error:
+            self._store.record(chunk["id"], src, dst, ERROR, str(error).strip())
+            return 1
+        status = MATCH if src == dst else MISMATCH
+        self._store.record(chunk["id"], src, dst, status)
+        return 0 if status == MATCH else 1
+
+
+def _dumps(value):
+    return None if value is None else json.dumps(value)
+
+
+def _loads(value):
+    return None if value is None else json.loads(value)
+
+
+def _schemas(tables):
+    """
+    :return: dict of database to the sorted list of its schemas
+    """
+    schemas = {}
+    for db, schema, _ in tables:
+        schemas.setdefault(db, set()).add(schema)
+    return {db: sorted(names) for db, names in schemas.items()}
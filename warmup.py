@@ -0,0 +1,133 @@
+import time
+
+import psycopg2
+from psycopg2 import sql
+
+from get_metadata import GetTables, ConnectionPool, parallel_map
+from get_metadata_sql import SQL_TO_GET_TABLE_IO, SQL_TO_GET_PREWARM_RELATIONS, SQL_TO_GET_SHARED_BUFFERS
+from metrics import METRICS
+
+# tables ANALYZEd and relations prewarmed at the same time, low enough to leave the new instance to its clients
+DEFAULT_WORKERS = 4
+# heaps or index sets of tables considered for prewarm, hottest first on the source
+DEFAULT_RELATIONS = 50
+# share of shared_buffers filled by the prewarm, more would evict what was just read
+DEFAULT_BUFFER_SHARE = 0.5
+
+
+class Warmup:
+    """
+    Prepares a promoted destination for its workload: ANALYZE of every table, `workers` at a time, largest first
+    from the GetTables inventory (partitioned tables as a whole, which includes their partitions), then pg_prewarm
+    of the relations most read on the source according to pg_statio_user_tables (the heap of a table, or all of
+    its indexes), hottest first, as long as they fit in `buffer_share` of shared_buffers.
+    """
+    def __init__(self, str_con_src, str_con_dst, workers=DEFAULT_WORKERS, relations=DEFAULT_RELATIONS,
+                 buffer_share=DEFAULT_BUFFER_SHARE):
+        self._str_con_src = str_con_src
+        self._str_con_dst = str_con_dst
+        self._workers = max(1, int(workers))
+        self._relations = relations
+        self._buffer_share = buffer_share
+
+    def analyze(self):
+        """
+        :return: (number of tables analyzed, seconds)
+        """
+        started = time.time()
+        pool = ConnectionPool(self._str_con_dst, maxconn=self._workers)
+        try:
+            tables = GetTables(self._str_con_dst, workers=self._workers, pool=pool, discover=False,
+                               include_toast=True, include_indexes=True)
+            tables.get_databases()
+            tables.get_tables()
+            parents = {(db, schema, table): (db, parent_schema, parent_table)
+                       for db, schema, table, parent_schema, parent_table, _ in tables.table_rows
+                       if parent_table is not None}
+
+            def root(key):
+                while key in parents:
+                    key = parents[key]
+                return key
+
+            sizes = {}
+            for db, schema, table, _, _, size in tables.table_rows:
+                key = root((db, schema, table))
+                sizes[key] = sizes.get(key, 0) + size
+
+            def analyze(key):
+                db, schema, table = key
+                with pool.connection(db) as conn, conn.cursor() as cur, \
+                        METRICS.timer("warmup_seconds", step="analyze", database=db):
+                    cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(schema, table)))
+
+            parallel_map(analyze, sorted(sizes, key=sizes.get, reverse=True), self._workers)
+        finally:
+            pool.close()
+        return len(sizes), time.time() - started
+
+    def prewarm(self):
+        """
+        :return: (relations prewarmed, bytes prewarmed, seconds, dict of database to the reason it was skipped)
+        """
+        started = time.time()
+        src = ConnectionPool(self._str_con_src, maxconn=1)
+        dst = ConnectionPool(self._str_con_dst, maxconn=self._workers)
+        try:
+            with dst.connection("postgres") as conn, conn.cursor() as cur:
+                cur.execute(SQL_TO_GET_SHARED_BUFFERS)
+                budget = cur.fetchone()[0] * self._buffer_share
+            databases = []
+            for str_con, pool in ((self._str_con_src, src), (self._str_con_dst, dst)):
+                tables = GetTables(str_con, workers=self._workers, pool=pool, discover=False)
+                tables.get_databases()
+                databases.append(set(tables.list_database))
+            databases = sorted(databases[0] & databases[1])
+            candidates = sorted(_ for reads in parallel_map(lambda db: self._reads(src, db), databases, self._workers)
+                                for _ in reads)[:self._relations]
+            selected, skipped = [], {}
+            for db in sorted({_[1] for _ in candidates}):
+                try:
+                    selected.extend(self._relations_of_database(dst, db, [_ for _ in candidates if _[1] == db]))
+                except psycopg2.Error as error:
+                    skipped[db] = str(error).strip().splitlines()[0]
+            # hottest first, the relations that don't fit anymore leave room for smaller ones
+            planned, total = [], 0
+            for _, db, relation, size in sorted(selected):
+                if total + size <= budget:
+                    planned.append((db, relation))
+                    total += size
+
+            def prewarm(item):
+                db, relation = item
+                with dst.connection(db) as conn, conn.cursor() as cur, \
+                        METRICS.timer("warmup_seconds", step="prewarm", database=db):
+                    cur.execute("SELECT pg_prewarm(%s::regclass)", (relation,))
+
+            parallel_map(prewarm, planned, self._workers)
+        finally:
+            src.close()
+            dst.close()
+        return len(planned), total, time.time() - started, skipped
+
+    def _reads(self, pool, db):
+        """
+        :return: list of (-blocks read, database, schema, table, indexes) of the tables of a source database,
+                 heap and indexes apart
+        """
+        with pool.connection(db) as conn, conn.cursor() as cur:
+            cur.execute(SQL_TO_GET_TABLE_IO)
+            rows = cur.fetchall()
+        return [(-blocks, db, schema, table, indexes) for schema, table, heap, index in rows
+                for blocks, indexes in ((heap, False), (index, True)) if blocks > 0]
+
+    def _relations_of_database(self, pool, db, candidates):
+        """
+        Create pg_prewarm in a destination database and resolve its candidates to relations.
+        :return: list of (-blocks read on the source, database, relation, bytes)
+        """
+        with pool.connection(db) as conn, conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+            cur.execute(SQL_TO_GET_PREWARM_RELATIONS, ([_[2] for _ in candidates], [_[3] for _ in candidates],
+                                                       [_[4] for _ in candidates]))
+            return [(candidates[position - 1][0], db, relation, size) for position, relation, size in cur.fetchall()]